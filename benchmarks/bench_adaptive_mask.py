@@ -0,0 +1,175 @@
+"""Compare `operations.adaptive_mask` with its previous implementation.
+
+The previous implementation always allocated a full boolean mask for the data,
+and applied single-band ImageStack masks through `np.moveaxis` copies. The
+current one broadcasts the mask as a view, combines it with any mask of the data
+in a single `np.logical_or`, and keeps `np.ma.nomask` when nothing is masked.
+
+For each supported combination of mask and data dimensions this reports the
+best time of a few runs and the peak memory allocated through NumPy, and checks
+that both implementations agree. Run it with
+
+.. code-block:: bash
+
+    python benchmarks/bench_adaptive_mask.py --scenes 8 --bands 13 --size 1024
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from earthdaily.earthone.dynamic_compute.operations import adaptive_mask
+
+
+def previous_adaptive_mask(mask, data):
+    """The previous implementation, without its validation of shapes"""
+    if mask.ndim == 2:
+        masked_data = np.ma.masked_array(data, False)
+        index = tuple(
+            [np.newaxis for _ in range(len(data.shape) - len(mask.shape))] + [...]
+        )
+        masked_data.mask |= mask[index]
+        return masked_data
+
+    if mask.ndim == 3:
+        if mask.shape[0] == 1:
+            mask = np.squeeze(mask, axis=0)
+
+        masked_data = np.ma.masked_array(data, False)
+        index = tuple(
+            [np.newaxis for _ in range(len(data.shape) - len(mask.shape))] + [...]
+        )
+        masked_data.mask |= mask[index]
+        return masked_data
+
+    if isinstance(data, np.ma.MaskedArray):
+        masked_data = data
+    else:
+        masked_data = np.ma.masked_array(data, False)
+    if mask.shape[1] == 1:
+        temp = np.moveaxis(masked_data, (0, 1, 2, 3), (1, 0, 2, 3))
+        temp.mask |= np.moveaxis(mask, (0, 1, 2, 3), (1, 0, 2, 3))
+        masked_data = np.moveaxis(temp, (0, 1, 2, 3), (1, 0, 2, 3))
+    else:
+        masked_data.mask |= mask
+
+    return masked_data
+
+
+def measure(func, repeat):
+    """Best time of `repeat` runs, and peak memory of a run, in bytes"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak, result
+
+
+def cases(scenes, bands, size, rng):
+    def mask(*shape):
+        return rng.random(shape) < 0.1
+
+    def data(*shape):
+        return rng.random(shape).astype(np.float32)
+
+    rows_cols = (size, size)
+    return [
+        ("(r,c) mask, (r,c) data", mask(*rows_cols), data(*rows_cols)),
+        ("(r,c) mask, (b,r,c) data", mask(*rows_cols), data(bands, *rows_cols)),
+        (
+            "(r,c) mask, (n,b,r,c) data",
+            mask(*rows_cols),
+            data(scenes, bands, *rows_cols),
+        ),
+        ("(1,r,c) mask, (b,r,c) data", mask(1, *rows_cols), data(bands, *rows_cols)),
+        (
+            "(b,r,c) mask, (b,r,c) data",
+            mask(bands, *rows_cols),
+            data(bands, *rows_cols),
+        ),
+        (
+            "(1,r,c) mask, (n,b,r,c) data",
+            mask(1, *rows_cols),
+            data(scenes, bands, *rows_cols),
+        ),
+        (
+            "(b,r,c) mask, (n,b,r,c) data",
+            mask(bands, *rows_cols),
+            data(scenes, bands, *rows_cols),
+        ),
+        (
+            "(n,1,r,c) mask, (n,b,r,c) data",
+            mask(scenes, 1, *rows_cols),
+            data(scenes, bands, *rows_cols),
+        ),
+        (
+            "(n,b,r,c) mask, (n,b,r,c) data",
+            mask(scenes, bands, *rows_cols),
+            data(scenes, bands, *rows_cols),
+        ),
+        (
+            "empty mask, (n,b,r,c) data",
+            np.zeros((scenes, 1) + rows_cols, dtype=bool),
+            data(scenes, bands, *rows_cols),
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenes", type=int, default=8)
+    parser.add_argument("--bands", type=int, default=13)
+    parser.add_argument("--size", type=int, default=512, help="Rows and columns")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    implementations = [
+        ("previous", previous_adaptive_mask),
+        ("current", adaptive_mask),
+    ]
+
+    rng = np.random.default_rng(0)
+    print(f"{'case':<36} {'implementation':<14} {'time (ms)':>10} {'peak (MiB)':>11}")
+    for name, mask, data in cases(args.scenes, args.bands, args.size, rng):
+        expected = None
+        for masked_data in (False, True):
+            for label, func in implementations:
+                # Fresh data each run, as ImageStack masks update masked data
+                # in place
+                if masked_data:
+
+                    def make():
+                        return np.ma.masked_array(data, np.zeros(data.shape, bool))
+
+                else:
+
+                    def make():
+                        return data
+
+                elapsed, peak, result = measure(
+                    lambda: func(mask, make()), args.repeat
+                )
+                if expected is None:
+                    expected = result
+                else:
+                    assert np.array_equal(
+                        np.ma.getmaskarray(result), np.ma.getmaskarray(expected)
+                    ), f"{label} mask differs for {name}"
+                case = name + (", masked" if masked_data else "")
+                print(
+                    f"{case:<36} {label:<14} {elapsed * 1e3:>10.1f} "
+                    f"{peak / 2**20:>11.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Compare mask propagation strategies of `operations.masked_einsum`.
+
+The previous implementation contracted two float64 "NaN masks", as large as the
+operands, with a second einsum. The current one contracts the boolean masks as
+integers against broadcast views of ones. `masked_einsum_chunked` additionally
+works through blocks of pixel rows.
+
+For each dot product signature used by `dot`, this reports the best time of a
+few runs and the peak memory allocated through NumPy, and checks that all
+strategies agree. Run it with
+
+.. code-block:: bash
+
+    python benchmarks/bench_masked_einsum.py --scenes 24 --bands 4 --size 1024
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from earthdaily.earthone.dynamic_compute.operations import (
+    masked_einsum,
+    masked_einsum_chunked,
+)
+
+
+def _nan_mask(op):
+    mask = np.zeros(op.shape)
+
+    if not isinstance(op, np.ma.MaskedArray):
+        return mask
+
+    mask[op.mask] = np.nan
+
+    return mask
+
+
+def nan_mask_einsum(signature, op1, op2, optimize=False):
+    """The previous implementation of `masked_einsum`"""
+    unmasked_result = np.einsum(signature, op1, op2)
+
+    if not isinstance(op1, np.ma.MaskedArray) and not isinstance(
+        op2, np.ma.MaskedArray
+    ):
+        return unmasked_result
+
+    mask = np.isnan(np.einsum(signature, _nan_mask(op1), _nan_mask(op2)))
+
+    return np.ma.masked_array(unmasked_result, mask)
+
+
+def measure(func, repeat):
+    """Best time of `repeat` runs, and peak memory of a run, in bytes"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak, result
+
+
+def cases(scenes, bands, size, masked_fraction, rng):
+    def raster(*shape):
+        data = rng.random(shape).astype(np.float32)
+        return np.ma.masked_array(data, rng.random(shape) < masked_fraction)
+
+    stack = raster(scenes, bands, size, size)
+    mosaic = raster(bands, size, size)
+
+    return [
+        ("mosaic . vector", "bij,b->ij", mosaic, rng.random(bands)),
+        ("mosaic . matrix", "bij,bm->mij", mosaic, rng.random((bands, 3))),
+        ("mosaic . mosaic", "bij,bij->ij", mosaic, raster(bands, size, size)),
+        ("stack . vector", "nbij,n->bij", stack, rng.random(scenes)),
+        ("stack . matrix", "nbij,nm->mbij", stack, rng.random((scenes, 3))),
+        ("stack . stack", "nbij,nbij->bij", stack, raster(scenes, bands, size, size)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenes", type=int, default=24)
+    parser.add_argument("--bands", type=int, default=4)
+    parser.add_argument("--size", type=int, default=512, help="Rows and columns")
+    parser.add_argument("--masked-fraction", type=float, default=0.2)
+    parser.add_argument("--chunk-size", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    strategies = [
+        ("nan mask", nan_mask_einsum),
+        ("integer mask", masked_einsum),
+        ("integer mask, optimize", lambda *ops: masked_einsum(*ops, optimize=True)),
+        (
+            f"chunked ({args.chunk_size} rows)",
+            lambda *ops: masked_einsum_chunked(*ops, chunk_size=args.chunk_size),
+        ),
+    ]
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'case':<18} {'strategy':<24} {'time (ms)':>10} {'peak (MiB)':>11}"
+    )
+    for name, signature, op1, op2 in cases(
+        args.scenes, args.bands, args.size, args.masked_fraction, rng
+    ):
+        expected = None
+        for label, func in strategies:
+            elapsed, peak, result = measure(
+                lambda: func(signature, op1, op2), args.repeat
+            )
+            if expected is None:
+                expected = result
+            else:
+                assert np.array_equal(
+                    np.ma.getmaskarray(result), np.ma.getmaskarray(expected)
+                ), f"{label} mask differs for {name}"
+                assert np.ma.allclose(result, expected), f"{label} differs for {name}"
+            print(
+                f"{name:<18} {label:<24} {elapsed * 1e3:>10.1f} {peak / 2**20:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
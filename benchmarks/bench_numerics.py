@@ -0,0 +1,272 @@
+"""Micro-benchmarks of the NumPy kernels run on every legacy-path result.
+
+Each kernel is run on synthetic arrays and ImageStack properties, over a grid of
+scenes, bands, tile sizes and masked fractions. For each case this reports the
+best time of a few runs and the peak memory allocated through NumPy. Run it with
+
+.. code-block:: bash
+
+    python benchmarks/bench_numerics.py --scenes 8,64 --bands 4 --size 256,1024
+
+Results can be saved with ``--save`` and later runs checked against them with
+``--baseline``, which exits with an error if any case is slower, or allocates
+more, than the baseline by more than ``--tolerance``, e.g.
+
+.. code-block:: bash
+
+    python benchmarks/bench_numerics.py --save numerics.json
+    python benchmarks/bench_numerics.py --baseline numerics.json --tolerance 0.2
+
+Kernels
+-------
+* ``adaptive_mask``, an ImageStack masked with a Mosaic mask, and with an
+  ImageStack mask with a single band,
+* ``masked_einsum``, ImageStack . matrix and ImageStack . ImageStack,
+* ``einsum_mask``, the mask propagation of `masked_einsum` on its own, which
+  replaced the float64 ``_nan_mask`` operands,
+* ``property_propagation``, `_default_property_propagation` of two ImageStacks,
+  with properties as lists of dicts and as `ColumnarProperties`,
+* ``property_propagation_for_dot``, of two Mosaics,
+* ``keys_with_fixed_values``, and the properties of ImageStack . matrix, with
+  properties as lists of dicts and as `ColumnarProperties`,
+* ``point_values``, the per-band reduction of `value_at`, of float and boolean
+  results.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from earthdaily.earthone.dynamic_compute.columnar import ColumnarProperties
+from earthdaily.earthone.dynamic_compute.image_stack import (
+    dot_property_propagation_for_image_stack_and_matrix,
+    keys_with_fixed_values,
+)
+from earthdaily.earthone.dynamic_compute.mosaic import property_propagation_for_dot
+from earthdaily.earthone.dynamic_compute.operations import (
+    _default_property_propagation,
+    _einsum_mask,
+    _point_values,
+    adaptive_mask,
+    masked_einsum,
+)
+
+
+# Differences below these are noise rather than regressions
+TIME_SLACK = 1e-5
+PEAK_SLACK = 2**16
+
+
+def measure(func, repeat):
+    """Best time of `repeat` runs, and peak memory of a run, in bytes"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak
+
+
+def raster(rng, shape, masked_fraction, dtype=np.float32):
+    data = rng.random(shape).astype(dtype)
+    return np.ma.masked_array(data, rng.random(shape) < masked_fraction)
+
+
+def stack_properties(scenes, bands, product_id="earthdaily:sentinel-2"):
+    """Properties like those of an ImageStack of catalog images"""
+    band_names = [f"b{i}" for i in range(bands)]
+    return [
+        {
+            "id": f"{product_id}:scene-{i}",
+            "product_id": product_id,
+            "acquired": f"2024-01-{i % 28 + 1:02d}T10:{i % 60:02d}:00Z",
+            "cloud_fraction": (i * 37 % 100) / 100,
+            "geotrans": [500000.0, 10.0, 0.0, 4000000.0, 0.0, -10.0],
+            "crs": "EPSG:32633",
+            "bands": band_names,
+            "pad": 0,
+        }
+        for i in range(scenes)
+    ]
+
+
+def kernels(scenes, bands, size, masked_fraction, rng):
+    """Named zero argument callables running each kernel on synthetic inputs"""
+    stack = raster(rng, (scenes, bands, size, size), masked_fraction)
+    other = raster(rng, (scenes, bands, size, size), masked_fraction)
+    mosaic_mask = rng.random((size, size)) < masked_fraction
+    band_mask = rng.random((scenes, 1, size, size)) < masked_fraction
+    matrix = rng.random((scenes, 3))
+
+    records = stack_properties(scenes, bands)
+    other_records = stack_properties(scenes, bands, "earthdaily:landsat-9")
+    columnar = ColumnarProperties.from_records(records)
+    other_columnar = ColumnarProperties.from_records(other_records)
+
+    point = raster(rng, (bands, 3, 3), masked_fraction, np.float64)
+    boolean_point = rng.random((bands, 3, 3)) < 0.5
+
+    return [
+        ("adaptive_mask", "mosaic mask", lambda: adaptive_mask(mosaic_mask, stack)),
+        (
+            "adaptive_mask",
+            "single band mask",
+            # adaptive_mask writes into the mask of 4-D data, so use a copy
+            lambda: adaptive_mask(band_mask, stack.copy()),
+        ),
+        (
+            "masked_einsum",
+            "stack . matrix",
+            lambda: masked_einsum("nbij,nm->mbij", stack, matrix),
+        ),
+        (
+            "masked_einsum",
+            "stack . stack",
+            lambda: masked_einsum("nbij,nbij->bij", stack, other),
+        ),
+        (
+            "einsum_mask",
+            "stack . matrix",
+            lambda: _einsum_mask("nbij,nm->mbij", stack, matrix, False),
+        ),
+        (
+            "einsum_mask",
+            "stack . stack",
+            lambda: _einsum_mask("nbij,nbij->bij", stack, other, False),
+        ),
+        (
+            "property_propagation",
+            "list",
+            lambda: _default_property_propagation(
+                records, other_records, "same", "add"
+            ),
+        ),
+        (
+            "property_propagation",
+            "columnar",
+            lambda: _default_property_propagation(
+                columnar, other_columnar, "same", "add"
+            ),
+        ),
+        (
+            "property_propagation_for_dot",
+            "mosaics",
+            lambda: property_propagation_for_dot(records[0], other_records[0]),
+        ),
+        ("keys_with_fixed_values", "list", lambda: keys_with_fixed_values(records)),
+        (
+            "keys_with_fixed_values",
+            "columnar",
+            lambda: keys_with_fixed_values(columnar),
+        ),
+        (
+            "keys_with_fixed_values",
+            "stack . matrix, list",
+            lambda: dot_property_propagation_for_image_stack_and_matrix(records, 3),
+        ),
+        (
+            "keys_with_fixed_values",
+            "stack . matrix, columnar",
+            lambda: dot_property_propagation_for_image_stack_and_matrix(columnar, 3),
+        ),
+        ("point_values", "float", lambda: _point_values(point)),
+        ("point_values", "bool", lambda: _point_values(boolean_point)),
+    ]
+
+
+def integers(value):
+    return [int(n) for n in value.split(",")]
+
+
+def floats(value):
+    return [float(n) for n in value.split(",")]
+
+
+def check(results, baseline, tolerance):
+    """Cases of `results` slower or larger than `baseline` beyond `tolerance`"""
+    previous = {
+        tuple(result["case"]): result for result in baseline if "case" in result
+    }
+    regressions = []
+    for result in results:
+        before = previous.get(tuple(result["case"]))
+        if before is None:
+            continue
+        for metric, slack in (("time", TIME_SLACK), ("peak", PEAK_SLACK)):
+            if result[metric] > before[metric] * (1 + tolerance) + slack:
+                regressions.append((result["case"], metric, before[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenes", type=integers, default=[8, 64])
+    parser.add_argument("--bands", type=integers, default=[4])
+    parser.add_argument(
+        "--size", type=integers, default=[256], help="Rows and columns"
+    )
+    parser.add_argument("--masked-fraction", type=floats, default=[0.2])
+    parser.add_argument("--kernel", action="append", help="Only run these kernels")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with results saved earlier")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative increase in time or peak memory over the baseline allowed",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(
+        f"{'kernel':<30} {'case':<26} {'parameters':<22} "
+        f"{'time (ms)':>10} {'peak (MiB)':>11}"
+    )
+    for scenes, bands, size, masked_fraction in itertools.product(
+        args.scenes, args.bands, args.size, args.masked_fraction
+    ):
+        parameters = f"{scenes}x{bands}x{size}^2 {masked_fraction:.0%}"
+        for kernel, case, func in kernels(scenes, bands, size, masked_fraction, rng):
+            if args.kernel and kernel not in args.kernel:
+                continue
+            elapsed, peak = measure(func, args.repeat)
+            results.append(
+                {
+                    "case": [kernel, case, scenes, bands, size, masked_fraction],
+                    "time": elapsed,
+                    "peak": peak,
+                }
+            )
+            print(
+                f"{kernel:<30} {case:<26} {parameters:<22} "
+                f"{elapsed * 1e3:>10.3f} {peak / 2**20:>11.2f}"
+            )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = check(results, json.load(f), args.tolerance)
+        for case, metric, before in regressions:
+            print(f"Regression in {metric} of {case}, baseline {before:.6g}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""Temporal reductions of long ImageStacks in date windows.
+
+`ImageStack.reduce` evaluates every image of the stack at once, so memory and
+latency grow with the number of images. `ChunkedReduction` instead splits the
+date range of the stack's `select_scenes` into windows and reduces each window
+separately, concurrently, to a few partial aggregates:
+
+* ``sum``: the sum,
+* ``mean``: the count of unmasked images and the sum,
+* ``std``: the count, the mean and the standard deviation,
+* ``min`` and ``max``: the minimum and the maximum.
+
+The partials are merged locally with vectorised NumPy into the exact result.
+Standard deviations are merged from the counts, means and sums of squared
+deviations of the windows, as by Chan et al., rather than from sums of
+squares, which lose precision.
+"""
+
+from __future__ import annotations
+
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from earthdaily.earthone.geo import AOI
+
+from . import tracing
+from .datetime_utils import normalize_datetime
+from .graft import client as graft_client
+from .operations import is_op, op_args, op_type, update_kwarg
+from .proxies import parameter
+
+if TYPE_CHECKING:
+    from .compute_map import ComputeMap
+    from .image_stack import ImageStack
+
+# Partial aggregates needed to merge each reducer
+PARTIALS = {
+    "sum": ("sum",),
+    "mean": ("count", "sum"),
+    "std": ("count", "mean", "std"),
+    "min": ("min",),
+    "max": ("max",),
+}
+
+# Number of partials computed concurrently
+CHUNKED_REDUCTION_MAX_WORKERS = int(
+    os.environ.get("DYNAMIC_COMPUTE_CHUNKED_REDUCTION_MAX_WORKERS", 8)
+)
+
+
+def date_windows(
+    start_datetime: Union[str, datetime.date, datetime.datetime],
+    end_datetime: Union[str, datetime.date, datetime.datetime],
+    window: Union[str, datetime.timedelta],
+) -> List[Tuple[str, str]]:
+    """
+    Split a date range into consecutive windows.
+
+    Parameters
+    ----------
+    start_datetime: Union[str, datetime.date, datetime.datetime]
+        Start of the range
+    end_datetime: Union[str, datetime.date, datetime.datetime]
+        End of the range
+    window: Union[str, datetime.timedelta]
+        Length of the windows, as a timedelta or a pandas frequency, e.g. "90D"
+        or "QS". The last window ends at `end_datetime`.
+
+    Returns
+    -------
+    windows: List[Tuple[str, str]]
+        Start and end of each window, as isoformatted strings
+    """
+    import pandas as pd
+
+    start, end = (
+        normalize_datetime(value) for value in (start_datetime, end_datetime)
+    )
+    if isinstance(start, parameter) or isinstance(end, parameter):
+        raise ValueError(
+            "Cannot split a date range given by parameters, "
+            "pass start_datetime and end_datetime"
+        )
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if isinstance(window, datetime.timedelta):
+        offset = pd.Timedelta(window)
+    else:
+        offset = pd.tseries.frequencies.to_offset(window)
+
+    if not start < end:
+        raise ValueError(f"Start {start} is not before end {end}")
+
+    windows = []
+    lower = start
+    while lower < end:
+        upper = min(lower + offset, end)
+        if not upper > lower:
+            raise ValueError(f"Window {window!r} is not a positive length of time")
+        windows.append((lower.isoformat(), upper.isoformat()))
+        lower = upper
+
+    return windows
+
+
+def _date_range(graft: Dict) -> Tuple[Optional[str], Optional[str]]:
+    """The start and end datetimes of the first select_scenes of a graft"""
+    for node in graft.values():
+        if not is_op(node) or not node or op_type(node) != "select_scenes":
+            continue
+        kwargs = next((arg for arg in op_args(node) if isinstance(arg, dict)), {})
+        return tuple(
+            graft.get(kwargs[name]) if name in kwargs else None
+            for name in ("start_datetime", "end_datetime")
+        )
+    return None, None
+
+
+def _prune(graft: Dict) -> Dict:
+    """Remove the nodes of a graft that are no longer referenced, e.g. replaced
+    dates, so that windows of different stacks have the same fingerprint"""
+    graft = dict(graft)
+    while True:
+        unreferenced = [
+            key
+            for key in graft_client.find_unreferenced(graft)
+            if key not in ("returns", graft["returns"])
+        ]
+        if not unreferenced:
+            return graft
+        for key in unreferenced:
+            del graft[key]
+
+
+def stack_windows(
+    image_stack: ImageStack,
+    window: Union[str, datetime.timedelta],
+    start_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+    end_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+) -> List[Tuple[str, str]]:
+    """
+    Split the date range of an ImageStack into windows, see `date_windows`.
+
+    Parameters
+    ----------
+    image_stack: ImageStack
+        The stack whose date range to split
+    window: Union[str, datetime.timedelta]
+        Length of the windows, as a timedelta or a pandas frequency
+    start_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        Start of the range, by default that of the stack, or of the first
+        `select_scenes` of its graft
+    end_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        End of the range, by default that of the stack, or of the first
+        `select_scenes` of its graft
+
+    Returns
+    -------
+    windows: List[Tuple[str, str]]
+        Start and end of each window, as isoformatted strings
+    """
+    graft_start, graft_end = _date_range(dict(image_stack))
+    start_datetime = start_datetime or image_stack.start_datetime or graft_start
+    end_datetime = end_datetime or image_stack.end_datetime or graft_end
+    if start_datetime is None or end_datetime is None:
+        raise ValueError(
+            "The ImageStack has no date range to split, "
+            "pass start_datetime and end_datetime"
+        )
+    return date_windows(start_datetime, end_datetime, window)
+
+
+def restrict_dates(image_stack: ImageStack, start: str, end: str) -> ImageStack:
+    """
+    Restrict an ImageStack to the images acquired in a date window.
+
+    Every `select_scenes` of the stack is limited to the window, so stacks
+    masked by other stacks over the same dates are windowed together.
+
+    Parameters
+    ----------
+    image_stack: ImageStack
+        The stack to restrict
+    start: str
+        Start of the window, as an isoformatted string
+    end: str
+        End of the window, as an isoformatted string
+
+    Returns
+    -------
+    image_stack: ImageStack
+    """
+    from .image_stack import ImageStack
+
+    graft = update_kwarg(dict(image_stack), "select_scenes", "start_datetime", start)
+    graft = update_kwarg(graft, "select_scenes", "end_datetime", end)
+    return ImageStack(
+        _prune(graft),
+        bands=image_stack.bands,
+        product_id=image_stack.product_id,
+        start_datetime=start,
+        end_datetime=end,
+        auth=image_stack._auth,
+    )
+
+
+def merge_partials(
+    reducer: str, partials: Dict[str, List[np.ma.MaskedArray]]
+) -> np.ma.MaskedArray:
+    """
+    Merge the partial aggregates of date windows into the reduction of all of
+    them.
+
+    Parameters
+    ----------
+    reducer: str
+        One of "sum", "mean", "std", "min" or "max"
+    partials: Dict[str, List[np.ma.MaskedArray]]
+        For each partial of the reducer, see `PARTIALS`, its value for each
+        window. Pixels masked in a window had no unmasked images in it.
+
+    Returns
+    -------
+    reduced: np.ma.MaskedArray
+        Pixels are masked where no window had unmasked images.
+    """
+    if reducer not in PARTIALS:
+        raise ValueError(f"Cannot merge {reducer!r}, expected one of {list(PARTIALS)}")
+
+    stacked = {name: np.ma.stack(partials[name]) for name in PARTIALS[reducer]}
+
+    if reducer == "sum":
+        return stacked["sum"].sum(axis=0)
+    if reducer == "min":
+        return stacked["min"].min(axis=0)
+    if reducer == "max":
+        return stacked["max"].max(axis=0)
+
+    counts = stacked["count"].filled(0)
+    count = counts.sum(axis=0)
+    empty = count == 0
+    divisor = np.where(empty, 1, count)
+
+    if reducer == "mean":
+        total = stacked["sum"].filled(0).sum(axis=0)
+        return np.ma.masked_array(total / divisor, mask=empty)
+
+    # Windows without images may have NaN means, which mustn't contribute
+    means = np.where(counts > 0, stacked["mean"].filled(0), 0).astype(np.float64)
+    stds = np.where(counts > 0, stacked["std"].filled(0), 0).astype(np.float64)
+    mean = (counts * means).sum(axis=0) / divisor
+    # Sum of squared deviations from the mean of all windows
+    m2 = (counts * stds**2).sum(axis=0) + (counts * (means - mean) ** 2).sum(axis=0)
+    return np.ma.masked_array(np.sqrt(m2 / divisor), mask=empty)
+
+
+class ChunkedReduction:
+    """
+    A temporal reduction of an ImageStack evaluated in date windows, see
+    `ImageStack.reduce_chunked`.
+
+    Parameters
+    ----------
+    image_stack: ImageStack
+        The stack to reduce over images
+    reducer: str
+        One of "sum", "mean", "std", "min" or "max"
+    window: Union[str, datetime.timedelta]
+        Length of the windows, as a timedelta or a pandas frequency, e.g. "90D"
+    start_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        Start of the range to reduce, by default that of the stack
+    end_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        End of the range to reduce, by default that of the stack
+    max_workers: Optional[int]
+        Maximum number of partials computed concurrently
+    """
+
+    def __init__(
+        self,
+        image_stack: ImageStack,
+        reducer: str,
+        window: Union[str, datetime.timedelta] = "90D",
+        start_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        end_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        max_workers: Optional[int] = None,
+    ):
+        if reducer not in PARTIALS:
+            raise ValueError(
+                f"Reducer {reducer!r} can't be computed in windows, "
+                f"expected one of {list(PARTIALS)}"
+            )
+
+        self.image_stack = image_stack
+        self.reducer = reducer
+        self.windows = stack_windows(image_stack, window, start_datetime, end_datetime)
+        self.max_workers = max_workers or CHUNKED_REDUCTION_MAX_WORKERS
+
+    def window_stack(self, index: int) -> ImageStack:
+        """
+        The ImageStack of the images of a window, see `restrict_dates`.
+
+        Parameters
+        ----------
+        index: int
+            Index of the window in `windows`
+
+        Returns
+        -------
+        image_stack: ImageStack
+        """
+        return restrict_dates(self.image_stack, *self.windows[index])
+
+    def partials(self, index: int) -> Dict[str, ComputeMap]:
+        """
+        The partial aggregates of a window, as Mosaics.
+
+        Parameters
+        ----------
+        index: int
+            Index of the window in `windows`
+
+        Returns
+        -------
+        partials: Dict[str, ComputeMap]
+            The partials of the reducer, see `PARTIALS`, and the count of
+            unmasked images, which tells windows without images apart
+        """
+        stack = self.window_stack(index)
+        return {
+            name: (
+                (stack * 0 + 1).reduce("sum")
+                if name == "count"
+                else stack.reduce(name)
+            )
+            for name in self._partial_names()
+        }
+
+    def _partial_names(self) -> Tuple[str, ...]:
+        """Names of the partials of each window, see `partials`"""
+        return ("count",) + tuple(
+            name for name in PARTIALS[self.reducer] if name != "count"
+        )
+
+    def window_reduction(self, index: int) -> ComputeMap:
+        """
+        The partials of a window as a single Mosaic, so that they are computed
+        in one request. The bands of each partial are concatenated in the order
+        of `partials`.
+
+        Parameters
+        ----------
+        index: int
+            Index of the window in `windows`
+
+        Returns
+        -------
+        mosaic: ComputeMap
+        """
+        mosaics = list(self.partials(index).values())
+        mosaic = mosaics[0]
+        for other in mosaics[1:]:
+            mosaic = mosaic.concat_bands(other)
+        return mosaic
+
+    def _compute_partials(
+        self,
+        indices: List[int],
+        evaluate: Callable[[ComputeMap], np.ma.MaskedArray],
+    ) -> Dict[int, Optional[Dict[str, np.ma.MaskedArray]]]:
+        """The partials of windows, concurrently, None for windows without images"""
+        names = self._partial_names()
+
+        def run(index: int) -> Optional[Dict[str, np.ma.MaskedArray]]:
+            try:
+                value = np.ma.masked_array(evaluate(self.window_reduction(index)))
+            except Exception:
+                # Reducing a window without images may fail, skip it
+                if evaluate(self.window_stack(index).length()) == 0:
+                    return None
+                raise
+
+            bands = len(value) // len(names)
+            partials = {
+                name: value[i * bands : (i + 1) * bands]
+                for i, name in enumerate(names)
+            }
+            # Reducing a window without images may also succeed, with zeros
+            # rather than masked pixels, so windows are dropped by their count
+            if not partials["count"].filled(0).any():
+                return None
+            return partials
+
+        workers = max(1, min(self.max_workers, len(indices)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            values = list(executor.map(tracing.propagate(run), indices))
+        return dict(zip(indices, values))
+
+    def _merge(
+        self, by_window: Dict[int, Optional[Dict[str, np.ma.MaskedArray]]]
+    ) -> np.ma.MaskedArray:
+        merged = {name: [] for name in PARTIALS[self.reducer]}
+        for index in sorted(by_window):
+            if by_window[index] is None:
+                continue
+            for name in merged:
+                merged[name].append(by_window[index][name])
+
+        if not any(merged.values()):
+            raise ValueError("No window of the ImageStack has images")
+
+        return merge_partials(self.reducer, merged)
+
+    @tracing.traced("reduce_chunked")
+    def _evaluate(
+        self, evaluate: Callable[[ComputeMap], np.ma.MaskedArray]
+    ) -> np.ma.MaskedArray:
+        indices = list(range(len(self.windows)))
+        return self._merge(self._compute_partials(indices, evaluate))
+
+    def compute(self, aoi: AOI, **kwargs) -> np.ma.MaskedArray:
+        """
+        Evaluate the reduction for an AOI.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.GeoContext
+            GeoContext for which to evaluate the reduction
+        **kwargs:
+            Further arguments of `ComputeMap.compute`, e.g. parameter values
+
+        Returns
+        -------
+        reduced: np.ma.MaskedArray
+            Bands x rows x columns array, masked where no image is unmasked
+        """
+        return self._evaluate(
+            lambda compute_map: compute_map.compute(aoi, **kwargs).ndarray
+        )
+
+    def compute_local(self, aoi: AOI, provider=None, **kwargs) -> np.ma.MaskedArray:
+        """
+        Evaluate the reduction for an AOI in process, see `local`.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.GeoContext
+            GeoContext for which to evaluate the reduction
+        provider: Optional[local.LocalProvider]
+            Source of imagery, by default deterministic synthetic imagery
+        **kwargs:
+            Values of the graft's parameters
+
+        Returns
+        -------
+        reduced: np.ma.MaskedArray
+            Bands x rows x columns array, masked where no image is unmasked
+        """
+        return self._evaluate(
+            lambda compute_map: compute_map.compute_local(
+                aoi, provider=provider, **kwargs
+            ).ndarray
+        )
@@ -0,0 +1,460 @@
+"""Columnar storage for the per-image properties of an ImageStack.
+
+ImageStack properties are a list with a dict per image. For stacks of thousands
+of images with rich catalog metadata, copying and scanning that list on every
+operation dominates the cost of property propagation. `ColumnarProperties`
+stores the same information as a NumPy array per key, or a single value for keys
+that are the same for every image, so that:
+
+* copies share their columns and only copy a column when it is written to,
+* setting a key for every image, e.g. the bands after `pick_bands`, is O(1),
+* keys with the same value for every image are found with vectorised
+  comparisons, see `fixed_values`.
+
+It is a sequence of mutable row views, so code written for lists of dicts keeps
+working, and `to_records` converts back to a list of dicts.
+
+Values are shared between copies, though not deep copies, so mutable values
+such as lists should be replaced rather than modified in place.
+"""
+
+from __future__ import annotations
+
+from collections.abc import MutableMapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Union
+
+import numpy as np
+
+# Marks a key that's missing from a row
+_MISSING = object()
+
+# Python types stored in native NumPy columns
+_NATIVE_TYPES = (bool, int, float, str)
+
+
+class _Constant:
+    "A column with the same value in every row"
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+def _object_array(values: Iterable, length: int) -> np.ndarray:
+    # np.array would turn equal-length lists into a 2-D array
+    return np.fromiter(values, dtype=object, count=length)
+
+
+def _to_column(values: List) -> Union[np.ndarray, _Constant]:
+    first = values[0]
+    kind = type(first)
+
+    if kind in _NATIVE_TYPES and all(type(value) is kind for value in values):
+        column = np.array(values)
+    else:
+        column = _object_array(values, len(values))
+
+    return _Constant(first) if _is_fixed(column) else column
+
+
+def _is_fixed(column: np.ndarray) -> bool:
+    "Whether every value of a column equals the first, and none are missing"
+    if not len(column):
+        return False
+
+    if column.dtype != object:
+        # As with ==, NaNs aren't equal to themselves
+        return bool((column == column[0]).all())
+
+    first = column[0]
+    if first is _MISSING:
+        return False
+
+    # Compare with a 0-d array so sequence values aren't broadcast
+    scalar = np.empty((), dtype=object)
+    scalar[()] = first
+    try:
+        equal = column == scalar
+        if equal.dtype == bool:
+            return bool(equal.all())
+    except (TypeError, ValueError):
+        pass
+
+    # Values, e.g. arrays, whose comparison isn't a bool
+    for value in column[1:]:
+        try:
+            if value is _MISSING or bool(value != first):
+                return False
+        except (TypeError, ValueError):
+            return False
+    return True
+
+
+_is_missing = np.frompyfunc(lambda value: value is _MISSING, 1, 1)
+
+
+def _item(value: Any) -> Any:
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class PropertyRow(MutableMapping):
+    """
+    A view of the properties of one image in `ColumnarProperties`, which
+    behaves like a dict. Writes go to the underlying columns.
+    """
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table: ColumnarProperties, index: int):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._table._value(self._index, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self._table._set_value(self._index, key, value)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self._table._set_value(self._index, key, _MISSING)
+
+    def __contains__(self, key: object) -> bool:
+        return self._table._value(self._index, key) is not _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self._table._columns:
+            if key in self:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def __copy__(self) -> Dict:
+        return dict(self)
+
+    def __deepcopy__(self, memo) -> Dict:
+        from copy import deepcopy
+
+        return deepcopy(dict(self), memo)
+
+
+class ColumnarProperties(Sequence):
+    """
+    The per-image properties of an ImageStack, stored by key.
+
+    Parameters
+    ----------
+    columns: Optional[Mapping[str, Any]]
+        Values per key, each either a sequence with a value per image or, for
+        keys in `constants`, a single value for every image.
+    length: Optional[int]
+        Number of images, by default the length of the columns.
+    constants: Iterable[str]
+        Keys of `columns` that have a single value.
+    """
+
+    def __init__(
+        self,
+        columns: Optional[Mapping[str, Any]] = None,
+        length: Optional[int] = None,
+        constants: Iterable[str] = (),
+    ):
+        constants = set(constants)
+        self._columns: Dict[str, Union[np.ndarray, _Constant]] = {}
+
+        for key, values in (columns or {}).items():
+            if key in constants:
+                self._columns[key] = _Constant(values)
+                continue
+
+            values = list(values)
+            if length is None:
+                length = len(values)
+            elif len(values) != length:
+                raise ValueError(
+                    f"Column {key} has {len(values)} values, expected {length}"
+                )
+            self._columns[key] = (
+                _to_column(values) if values else np.empty(0, dtype=object)
+            )
+
+        self._length = length or 0
+        # Columns this instance may modify in place, others are shared
+        self._owned = set(self._columns)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Mapping]) -> ColumnarProperties:
+        """
+        Convert a list of per-image property dicts.
+
+        Parameters
+        ----------
+        records: Iterable[Mapping]
+            Properties of each image
+
+        Returns
+        -------
+        properties: ColumnarProperties
+        """
+        if isinstance(records, ColumnarProperties):
+            return records.copy()
+
+        records = list(records)
+        keys = {}
+        for record in records:
+            keys.update(dict.fromkeys(record))
+
+        table = cls(length=len(records))
+        for key in keys:
+            values = [record.get(key, _MISSING) for record in records]
+            if any(value is _MISSING for value in values):
+                table._columns[key] = _object_array(values, len(values))
+            else:
+                table._columns[key] = _to_column(values)
+        table._owned = set(table._columns)
+        return table
+
+    @classmethod
+    def from_constants(
+        cls, values: Mapping[str, Any], length: int
+    ) -> ColumnarProperties:
+        """
+        Properties with the same values for every image.
+
+        Parameters
+        ----------
+        values: Mapping[str, Any]
+            The properties of every image
+        length: int
+            Number of images
+
+        Returns
+        -------
+        properties: ColumnarProperties
+        """
+        return cls(dict(values), length=length, constants=values.keys())
+
+    def to_records(self) -> List[Dict]:
+        """The properties as a list with a dict per image"""
+        columns = []
+        for key, column in self._columns.items():
+            if isinstance(column, _Constant):
+                columns.append((key, [column.value] * self._length))
+            else:
+                columns.append((key, column.tolist()))
+
+        return [
+            {key: values[i] for key, values in columns if values[i] is not _MISSING}
+            for i in range(self._length)
+        ]
+
+    def to_dataframe(self):
+        """The properties as a pandas DataFrame, with a row per image"""
+        import pandas as pd
+
+        return pd.DataFrame(self.to_records(), columns=self.keys())
+
+    def keys(self) -> List[str]:
+        """Keys of the properties of any image"""
+        return list(self._columns)
+
+    def column(self, key: str) -> np.ndarray:
+        """
+        The values of a key for each image, missing values are None.
+
+        Parameters
+        ----------
+        key: str
+            Property key
+
+        Returns
+        -------
+        values: np.ndarray
+        """
+        column = self._columns[key]
+        if isinstance(column, _Constant):
+            values = np.empty(self._length, dtype=object)
+            values.fill(column.value)
+            return values
+        if column.dtype == object:
+            # Compare by identity, == would compare array values elementwise
+            return np.where(_is_missing(column).astype(bool), None, column)
+        return column.copy()
+
+    def set_column(self, key: str, values: Any):
+        """
+        Set a key for every image.
+
+        Parameters
+        ----------
+        key: str
+            Property key
+        values: Any
+            A sequence with a value per image
+        """
+        values = list(values)
+        if len(values) != self._length:
+            raise ValueError(
+                f"Column {key} has {len(values)} values, expected {self._length}"
+            )
+        self._columns[key] = (
+            _to_column(values) if values else np.empty(0, dtype=object)
+        )
+        self._owned.add(key)
+
+    def set_constant(self, key: str, value: Any):
+        """
+        Set a key to the same value for every image.
+
+        Parameters
+        ----------
+        key: str
+            Property key
+        value: Any
+            Value for every image
+        """
+        self._columns[key] = _Constant(value)
+
+    def discard(self, key: str):
+        """
+        Remove a key from every image, if present.
+
+        Parameters
+        ----------
+        key: str
+            Property key
+        """
+        self._columns.pop(key, None)
+        self._owned.discard(key)
+
+    def fixed_values(self) -> Dict[str, Any]:
+        """
+        Keys that every image has with the same value, and their values, as
+        found by `image_stack.keys_with_fixed_values`.
+
+        Returns
+        -------
+        values: Dict[str, Any]
+        """
+        if not self._length:
+            return {}
+
+        fixed = {}
+        for key, column in self._columns.items():
+            if isinstance(column, _Constant):
+                fixed[key] = column.value
+            elif _is_fixed(column):
+                fixed[key] = _item(column[0])
+        return fixed
+
+    def take(self, indices: Any) -> ColumnarProperties:
+        """
+        The properties of a selection of images.
+
+        Parameters
+        ----------
+        indices: Any
+            Indices, a slice or a boolean mask of the images to select
+
+        Returns
+        -------
+        properties: ColumnarProperties
+        """
+        index = np.arange(self._length)[indices]
+        table = ColumnarProperties(length=len(index))
+        for key, column in self._columns.items():
+            table._columns[key] = (
+                column if isinstance(column, _Constant) else column[index]
+            )
+        table._owned = set(table._columns)
+        return table
+
+    def copy(self) -> ColumnarProperties:
+        """A copy sharing columns with this one until either is written to"""
+        table = ColumnarProperties(length=self._length)
+        table._columns = dict(self._columns)
+        table._owned = set()
+        self._owned = set()
+        return table
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo) -> ColumnarProperties:
+        from copy import deepcopy
+
+        table = ColumnarProperties(length=self._length)
+        for key, column in self._columns.items():
+            if isinstance(column, _Constant):
+                table._columns[key] = _Constant(deepcopy(column.value, memo))
+            elif column.dtype == object:
+                table._columns[key] = _object_array(
+                    (
+                        value if value is _MISSING else deepcopy(value, memo)
+                        for value in column
+                    ),
+                    len(column),
+                )
+            else:
+                table._columns[key] = column.copy()
+        table._owned = set(table._columns)
+        return table
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Any) -> Union[PropertyRow, ColumnarProperties]:
+        if isinstance(index, (int, np.integer)):
+            if not -self._length <= index < self._length:
+                raise IndexError("ColumnarProperties index out of range")
+            return PropertyRow(self, int(index) % self._length)
+        return self.take(index)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, tuple, ColumnarProperties)):
+            return self.to_records() == [dict(row) for row in other]
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ColumnarProperties({self._length} images, keys {self.keys()})"
+
+    def _value(self, index: int, key: Any) -> Any:
+        column = self._columns.get(key)
+        if column is None:
+            return _MISSING
+        if isinstance(column, _Constant):
+            return column.value
+        return _item(column[index])
+
+    def _set_value(self, index: int, key: str, value: Any):
+        column = self._columns.get(key)
+
+        if column is None:
+            if value is _MISSING:
+                return
+            column = np.empty(self._length, dtype=object)
+            column.fill(_MISSING)
+        elif isinstance(column, _Constant):
+            constant = column.value
+            column = np.empty(self._length, dtype=object)
+            column.fill(constant)
+        elif column.dtype == object or (
+            type(value) in _NATIVE_TYPES and np.array(value).dtype == column.dtype
+        ):
+            if key not in self._owned:
+                column = column.copy()
+        else:
+            # The value doesn't fit the column's type
+            column = column.astype(object)
+
+        column[index] = value
+        self._columns[key] = column
+        self._owned.add(key)
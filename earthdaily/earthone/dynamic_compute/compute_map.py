@@ -4,18 +4,17 @@ from __future__ import annotations
 
 import dataclasses
 import json
-import sys
 from abc import ABC, abstractclassmethod, abstractmethod
 from copy import copy, deepcopy
-from io import StringIO
 from numbers import Number
-from typing import Dict, List, Type, Union
+from typing import Dict, List, Optional, Type, Union
 
 import earthdaily.earthone as eo
 import numpy as np
 
 from .graft.client import client as graft_client
 from .graft.interpreter.interpreter import interpret
+from .graft.interpreter.profiling import TextTree
 from .graft.syntax import syntax as graft_syntax
 from .operations import (
     _func_op,
@@ -23,7 +22,9 @@ from .operations import (
     _resolution_graft_x,
     _resolution_graft_y,
     compute_aoi,
+    format_bands,
     reset_graft,
+    value_at_many,
 )
 from .proxies import parameter
 from .serialization import BaseSerializationModel
@@ -44,23 +45,6 @@ class DotDict(dict):
 type_map = {"int": int}
 
 
-class Capturing(list):
-    """
-    A class for capturing stdout as a list of strings.
-    Lifted from https://stackoverflow.com/a/16571630
-    """
-
-    def __enter__(self):
-        self._stdout = sys.stdout
-        sys.stdout = self._stringio = StringIO()
-        return self
-
-    def __exit__(self, *args):
-        self.extend(self._stringio.getvalue().splitlines())
-        del self._stringio  # free up some memory
-        sys.stdout = self._stdout
-
-
 # Stub functions for primitives. Note we could just use
 # a single no-op function, but the function name
 # appears in the output
@@ -228,40 +212,40 @@ class ComputeMap(dict, ABC):
         return obj_str
 
     def __repr__(self):
-        with Capturing() as output:
-            interpret(
-                dict(self),
-                builtins=[
-                    ("code", code),
-                    ("mosaic", mosaic),
-                    ("select_scenes", select_scenes),
-                    ("stack_scenes", stack_scenes),
-                    ("array", array),
-                    ("groupby", groupby),
-                    ("filter_data", filter_data),
-                    ("groupby_data", groupby_data),
-                    ("math", math_op),
-                    ("reduction", reduction_op),
-                    ("clip", clip_data),
-                    ("resolution_y", graft_resolution_y),
-                    ("resolution_x", graft_resolution_x),
-                    ("band_op", band_op),
-                    ("index", index),
-                    ("length", length),
-                    ("mask", mask),
-                    ("mask_by_vector", mask_by_vector),
-                    ("functional", functional),
-                    ("dot", dot),
-                    ("filled", fill_mask),
-                    ("from_image_ids", from_image_ids),
-                    ("convolve", convolve),
-                    ("rasterization", rasterization),
-                    ("morphology", morphology),
-                ],
-                debug=True,
-            )()
-
-        return "\n".join(output)
+        tree = TextTree()
+        interpret(
+            dict(self),
+            builtins=[
+                ("code", code),
+                ("mosaic", mosaic),
+                ("select_scenes", select_scenes),
+                ("stack_scenes", stack_scenes),
+                ("array", array),
+                ("groupby", groupby),
+                ("filter_data", filter_data),
+                ("groupby_data", groupby_data),
+                ("math", math_op),
+                ("reduction", reduction_op),
+                ("clip", clip_data),
+                ("resolution_y", graft_resolution_y),
+                ("resolution_x", graft_resolution_x),
+                ("band_op", band_op),
+                ("index", index),
+                ("length", length),
+                ("mask", mask),
+                ("mask_by_vector", mask_by_vector),
+                ("functional", functional),
+                ("dot", dot),
+                ("filled", fill_mask),
+                ("from_image_ids", from_image_ids),
+                ("convolve", convolve),
+                ("rasterization", rasterization),
+                ("morphology", morphology),
+            ],
+            debug=tree,
+        )()
+
+        return str(tree)
 
     def __init__(self, graft, obj_type=None, auth=None):
         """
@@ -302,7 +286,12 @@ class ComputeMap(dict, ABC):
         return new_compute_map
 
     def compute(
-        self, aoi: eo.geo.AOI, **kwargs
+        self,
+        aoi: eo.geo.AOI,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+        mask_format: Optional[str] = None,
+        nodata: Optional[Union[int, float]] = None,
+        **kwargs,
     ) -> Union[
         np.ma.MaskedArray,  # We're returning just data
         List,  # We're returning just properties, and they are a list
@@ -316,6 +305,15 @@ class ComputeMap(dict, ABC):
         ----------
         aoi : earthdaily.earthone.geo.GeoContext
             GeoContext for which to compute evaluate this ComputeMap
+        dtype : Optional[Union[str, numpy.dtype, type]]
+            Data type to cast the result to before it is transferred, e.g. "float32"
+            or "uint16". Smaller types reduce the amount of data transferred.
+        mask_format : Optional[str]
+            How the mask is transferred. One of "packbits" (one bit per pixel),
+            "bool" (one byte per pixel) or "nodata" (no mask is transferred, masked
+            pixels are filled with `nodata` and the mask is reconstructed locally).
+        nodata : Optional[Union[int, float]]
+            Fill value for masked pixels when mask_format is "nodata", defaults to NaN.
 
         Returns
         -------
@@ -325,9 +323,15 @@ class ComputeMap(dict, ABC):
             as a DotDict
         """
 
-        value, properties = compute_aoi(self, aoi, **kwargs)
+        if self.return_val == "properties":
+            # Skip evaluating and transferring the array
+            kwargs.setdefault("metadata_only", True)
+
+        value, properties = compute_aoi(
+            self, aoi, dtype=dtype, mask_format=mask_format, nodata=nodata, **kwargs
+        )
 
-        if "return_type" in properties:
+        if "return_type" in properties and value is not None:
             value = type_map[properties["return_type"]](value)
 
         if self.return_val == "ndarray":
@@ -338,6 +342,95 @@ class ComputeMap(dict, ABC):
 
         return DotDict({"ndarray": value, "properties": properties})
 
+    def compute_local(
+        self,
+        aoi: eo.geo.AOI,
+        provider=None,
+        debug=False,
+        **kwargs,
+    ) -> Union[np.ma.MaskedArray, List, Dict, DotDict]:
+        """
+        Evaluate this ComputeMap in process with NumPy, see `local`.
+
+        Parameters
+        ----------
+        aoi : earthdaily.earthone.geo.GeoContext
+            GeoContext for which to evaluate this ComputeMap, with a shape or
+            resolution
+        provider : Optional[local.LocalProvider]
+            Source of imagery, by default deterministic synthetic imagery
+        debug : bool, callable, or list of callables
+            Profile the evaluation, see `interpret`
+        **kwargs:
+            Values of the graft's parameters
+
+        Returns
+        -------
+        results : Union[Array, List, Dict, DotDict]
+            Evaluation of self for this AOI, as from `compute`
+        """
+        from .local import evaluate_local
+
+        value, properties = evaluate_local(
+            dict(self), aoi, provider=provider, debug=debug, **kwargs
+        )
+
+        if self.return_val == "ndarray":
+            return value
+
+        if self.return_val == "properties":
+            return properties
+
+        return DotDict({"ndarray": value, "properties": properties})
+
+    def sample_points(
+        self,
+        lons: Union[List[float], np.ndarray],
+        lats: Union[List[float], np.ndarray],
+        resolution: Optional[float] = None,
+        as_dataframe: bool = False,
+        **kwargs,
+    ):
+        """
+        Evaluate this ComputeMap at many points
+
+        Parameters
+        ----------
+        lons : Union[List[float], numpy.ndarray]
+            Longitudes of the points
+        lats : Union[List[float], numpy.ndarray]
+            Latitudes of the points
+        resolution : Optional[float]
+            If given, points are sampled from a grid with this resolution, in
+            degrees, and nearby points share a single compute. Otherwise each point
+            is evaluated at its own 1x1 pixel AOI, like the map inspector.
+        as_dataframe : bool
+            Return a pandas DataFrame, with lon and lat columns and a column per
+            band, instead of an array.
+
+        Returns
+        -------
+        values : Union[numpy.ma.MaskedArray, pandas.DataFrame]
+            Values per band for each point, one row per point. Masked values are
+            NaN in a DataFrame.
+        """
+
+        values = value_at_many(self, lats, lons, resolution=resolution, **kwargs)
+        if not as_dataframe:
+            return values
+
+        import pandas as pd
+
+        bands = getattr(self, "bands", None)
+        columns = format_bands(bands) if bands else []
+        if len(columns) != values.shape[1]:
+            columns = list(range(values.shape[1]))
+
+        df = pd.DataFrame(values.astype(float).filled(np.nan), columns=columns)
+        df.insert(0, "lat", np.asarray(lats, dtype=float))
+        df.insert(0, "lon", np.asarray(lons, dtype=float))
+        return df
+
     def to_imagery(self):
         # Compatibility with Workflows.
         new_compute_map = copy(self)
@@ -2,6 +2,7 @@ from .client import (
     apply_graft,
     compress_graft,
     consistent_guid,
+    find_unreferenced,
     function_graft,
     guid,
     is_delayed,
@@ -30,4 +31,5 @@ __all__ = [
     "consistent_guid",
     "unset_all_cache_ids",
     "compress_graft",
+    "find_unreferenced",
 ]
@@ -1,5 +1,15 @@
-from . import exceptions
+from . import exceptions, profiling
 from .interpreter import interpret
+from .profiling import ChromeTrace, NodeEvent, OpAggregates, TextTree
 from .scopedchainmap import ScopedChainMap
 
-__all__ = ["interpret", "exceptions", "ScopedChainMap"]
+__all__ = [
+    "interpret",
+    "exceptions",
+    "profiling",
+    "ScopedChainMap",
+    "NodeEvent",
+    "TextTree",
+    "ChromeTrace",
+    "OpAggregates",
+]
@@ -6,10 +6,10 @@ import timeit
 import six
 
 from .. import syntax
-from . import exceptions
+from . import exceptions, profiling
 from .scopedchainmap import ScopedChainMap
 
-DebugState = collections.namedtuple("DebugState", "depth")
+DebugState = collections.namedtuple("DebugState", "depth hook")
 
 
 def interpret(graft, builtins=None, debug=False):
@@ -22,6 +22,10 @@ def interpret(graft, builtins=None, debug=False):
         A top-level graft function, containing the key "returns".
     builtins: Mapping[str, Any] or None
         Functions (or objects) to make available when evaluating this graft.
+    debug: bool, callable, or list of callables
+        Profile the evaluation. True prints a tree of the evaluated keys with
+        their timings; a callable, e.g. a sink from `profiling`, is called with
+        a `profiling.NodeEvent` as each key starts and stops evaluating.
 
     Returns
     -------
@@ -33,7 +37,8 @@ def interpret(graft, builtins=None, debug=False):
         env = ScopedChainMap()
         if builtins is not None:
             env.update(builtins)
-    debug = DebugState(depth=0) if debug else None
+    hook = profiling.as_hook(debug)
+    debug = DebugState(depth=0, hook=hook) if hook is not None else None
     return as_function(graft, ScopedChainMap(), env, debug=debug)
 
 
@@ -71,22 +76,18 @@ def get(key, body, env, debug=None):
         # key may exist in env, but it's re-defined in a closer scope in `body` which we haven't evaluated yet
 
         if debug is not None:
-            indents = "|   " * debug.depth
-            formatted_expr = repr(expr)[: max(10, 80 - len(indents))]
-            print("{}┌── {!r}: {}".format(indents, key, formatted_expr))
-            debug = DebugState(debug.depth + 1)
+            hook, depth, op = debug.hook, debug.depth, profiling.op_name(expr)
+            debug = DebugState(depth + 1, hook)
             start = timeit.default_timer()
+            hook(profiling.NodeEvent(profiling.START, key, op, depth, start, expr))
 
         result = evaluate(expr, body, env, debug=debug)
 
         if debug is not None:
-            elapsed = timeit.default_timer() - start
-            formatted_result = repr(result)[: max(10, 80 - len(indents))].replace(
-                "\n", " "
-            )
-            print(
-                "{}└── {!r}: {:.3f}s -> {}".format(
-                    indents, key, elapsed, formatted_result
+            stop = timeit.default_timer()
+            hook(
+                profiling.NodeEvent(
+                    profiling.STOP, key, op, depth, stop, result, stop - start
                 )
             )
 
@@ -99,11 +100,17 @@ def get(key, body, env, debug=None):
         # key was precomputed in env at closer or equal scope, so we can use it
 
         if debug is not None:
-            indents = "|   " * debug.depth
-            formatted_result = repr(precomputed)[: max(10, 80 - len(indents))].replace(
-                "\n", " "
+            op = "builtin" if expr is None else profiling.op_name(expr)
+            debug.hook(
+                profiling.NodeEvent(
+                    profiling.PRECOMPUTED,
+                    key,
+                    op,
+                    debug.depth,
+                    timeit.default_timer(),
+                    precomputed,
+                )
             )
-            print("{}  * Precomputed {!r}: {}".format(indents, key, formatted_result))
 
         return precomputed
 
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of graft evaluation.
+
+When `interpret` is given a ``debug`` hook, it is called with a `NodeEvent` as
+each key of the graft starts and stops evaluating, or is found precomputed.
+Any callable can be a hook; the sinks here render the events as:
+
+* `TextTree`, an indented tree of keys with their timings and results,
+* `ChromeTrace`, a Chrome trace-event file or folded stacks for flame graphs,
+* `OpAggregates`, per-operation counts and total and self times.
+
+Several sinks can be given at once as a list.
+
+Example
+-------
+>>> aggregates = OpAggregates() # doctest: +SKIP
+>>> sinks = [TextTree(file=sys.stdout), aggregates] # doctest: +SKIP
+>>> interpret(graft, builtins, debug=sinks)() # doctest: +SKIP
+>>> print(aggregates.table()) # doctest: +SKIP
+"""
+
+import collections
+import json
+import os
+import sys
+from abc import ABC, abstractmethod
+
+from .. import syntax
+
+START = "start"
+STOP = "stop"
+PRECOMPUTED = "precomputed"
+
+NodeEvent = collections.namedtuple(
+    "NodeEvent", "kind key op depth time value elapsed", defaults=(None,)
+)
+NodeEvent.__doc__ = """
+An event in the evaluation of a graft key.
+
+Attributes
+----------
+kind: str
+    One of "start", "stop" or "precomputed"
+key: str
+    The graft key
+op: str
+    The function applied by the key's expression, "literal", "function" or
+    "json" for other expressions, or "builtin" for keys from the builtins
+depth: int
+    Nesting depth of the evaluation, 0 for the graft's returned key
+time: float
+    `timeit.default_timer` at the event
+value: object
+    The key's expression on start, and its result on stop or when precomputed
+elapsed: float or None
+    Seconds taken to evaluate the key, on stop
+"""
+
+
+def op_name(expr):
+    "Name of the operation an expression applies"
+    if syntax.is_application(expr):
+        return expr[0] if syntax.is_key(expr[0]) else "function"
+    elif syntax.is_graft(expr):
+        return "function"
+    elif syntax.is_quoted_json(expr):
+        return "json"
+    return "literal"
+
+
+def summarize(value, width=80):
+    "A single-line repr of a value, truncated to `width` characters"
+    return repr(value)[: max(10, width)].replace("\n", " ")
+
+
+def as_hook(debug):
+    """
+    Turn the ``debug`` argument of `interpret` into an event hook.
+
+    Parameters
+    ----------
+    debug: bool, callable, or list of callables
+        True prints a `TextTree` to stdout, a callable is used as the hook,
+        and a list of callables are all called with each event.
+
+    Returns
+    -------
+    hook: callable or None
+    """
+    if debug is True:
+        return TextTree(file=sys.stdout)
+    if not debug:
+        return None
+    if isinstance(debug, (list, tuple)):
+        hooks = list(debug)
+
+        def fan_out(event):
+            for hook in hooks:
+                hook(event)
+
+        return fan_out
+    return debug
+
+
+class TextTree(object):
+    """
+    Render events as an indented tree, one line per event.
+
+    Parameters
+    ----------
+    file: file-like or None
+        Where to write each line as it is produced, in addition to `lines`.
+    """
+
+    def __init__(self, file=None):
+        self.file = file
+        self.lines = []
+
+    def __call__(self, event):
+        indents = "|   " * event.depth
+        width = 80 - len(indents)
+        if event.kind == START:
+            line = "{}┌── {!r}: {}".format(
+                indents, event.key, repr(event.value)[: max(10, width)]
+            )
+        elif event.kind == STOP:
+            line = "{}└── {!r}: {:.3f}s -> {}".format(
+                indents, event.key, event.elapsed, summarize(event.value, width)
+            )
+        else:
+            line = "{}  * Precomputed {!r}: {}".format(
+                indents, event.key, summarize(event.value, width)
+            )
+
+        self.lines.append(line)
+        if self.file is not None:
+            self.file.write(line + "\n")
+
+    def __str__(self):
+        return "\n".join(self.lines)
+
+
+class _StackSink(ABC):
+    "Base for sinks that match each stop event with its start"
+
+    def __init__(self):
+        self._stack = []
+
+    def __call__(self, event):
+        if event.kind == START:
+            # name, key, start time, time spent in children
+            self._stack.append([event.op, event.key, event.time, 0.0])
+        elif event.kind == STOP:
+            name, key, start, children = self._stack.pop()
+            if self._stack:
+                self._stack[-1][3] += event.elapsed
+            path = [frame[0] for frame in self._stack] + [name]
+            self._finish(path, key, start, event.elapsed, event.elapsed - children)
+        else:
+            self._precomputed(event)
+
+    @abstractmethod
+    def _finish(self, path, key, start, elapsed, self_time):
+        "Record a finished key, given the names of the operations on the stack"
+
+    def _precomputed(self, event):
+        pass
+
+
+class ChromeTrace(_StackSink):
+    """
+    Collect events as Chrome trace events and folded flame-graph stacks.
+
+    Each evaluated key becomes a span named after its operation, which can be
+    viewed with ``chrome://tracing`` or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+        super(ChromeTrace, self).__init__()
+        self.events = []
+        self.folded = collections.Counter()
+        self._origin = None
+
+    def __call__(self, event):
+        if self._origin is None:
+            self._origin = event.time
+        super(ChromeTrace, self).__call__(event)
+
+    def _timestamp(self, time):
+        return (time - self._origin) * 1e6
+
+    def _finish(self, path, key, start, elapsed, self_time):
+        self.events.append(
+            {
+                "name": path[-1],
+                "cat": "graft",
+                "ph": "X",
+                "ts": self._timestamp(start),
+                "dur": elapsed * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": {"key": key, "depth": len(path) - 1},
+            }
+        )
+        self.folded[";".join(path)] += self_time
+
+    def _precomputed(self, event):
+        self.events.append(
+            {
+                "name": event.op,
+                "cat": "graft",
+                "ph": "i",
+                "s": "t",
+                "ts": self._timestamp(event.time),
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": {"key": event.key, "precomputed": True},
+            }
+        )
+
+    def to_chrome_trace(self):
+        "The events in the Chrome trace-event format"
+        return {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        "Write the events to a Chrome trace-event JSON file"
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def to_folded_stacks(self):
+        """
+        Self times in the folded stack format read by flamegraph.pl and
+        speedscope, one ``op;op;op microseconds`` line per stack.
+        """
+        return "\n".join(
+            "{} {}".format(path, int(round(seconds * 1e6)))
+            for path, seconds in sorted(self.folded.items())
+        )
+
+    def write_folded_stacks(self, path):
+        "Write the folded stacks to a file"
+        with open(path, "w") as f:
+            f.write(self.to_folded_stacks() + "\n")
+
+
+class OpAggregates(_StackSink):
+    """
+    Aggregate events by operation: how often each is evaluated or found
+    precomputed, and the total and self time spent evaluating it.
+    """
+
+    def __init__(self):
+        super(OpAggregates, self).__init__()
+        self.stats = collections.defaultdict(
+            lambda: {"calls": 0, "precomputed": 0, "total": 0.0, "self": 0.0}
+        )
+
+    def _finish(self, path, key, start, elapsed, self_time):
+        stats = self.stats[path[-1]]
+        stats["calls"] += 1
+        # Only count time once for recursive operations
+        if path[-1] not in path[:-1]:
+            stats["total"] += elapsed
+        stats["self"] += self_time
+
+    def _precomputed(self, event):
+        self.stats[event.op]["precomputed"] += 1
+
+    def rows(self):
+        "Aggregates per operation, by descending self time"
+        rows = [dict(op=op, **stats) for op, stats in self.stats.items()]
+        return sorted(rows, key=lambda row: row["self"], reverse=True)
+
+    def table(self):
+        "The aggregates as a plain-text table"
+        lines = [
+            "{:<24} {:>8} {:>12} {:>10} {:>10}".format(
+                "op", "calls", "precomputed", "total (s)", "self (s)"
+            )
+        ]
+        for row in self.rows():
+            lines.append(
+                "{:<24} {:>8} {:>12} {:>10.3f} {:>10.3f}".format(
+                    str(row["op"])[:24],
+                    row["calls"],
+                    row["precomputed"],
+                    row["total"],
+                    row["self"],
+                )
+            )
+        return "\n".join(lines)
+
+    def to_dataframe(self):
+        "The aggregates as a pandas DataFrame"
+        import pandas as pd
+
+        return pd.DataFrame(
+            self.rows(), columns=["op", "calls", "precomputed", "total", "self"]
+        )
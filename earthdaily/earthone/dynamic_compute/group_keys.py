@@ -0,0 +1,251 @@
+"""Declarative group keys for `ImageStack.groupby`.
+
+Rather than a Python function, which has to be pickled and sent with every
+request, images can be grouped by a key spec:
+
+* a property name, e.g. ``"cloud_fraction"``, groups by its value,
+* a property name and date parts, e.g. ``"acquired:month"``,
+  ``"acquired:week"`` or ``"acquired:year-month"``, groups by those parts of a
+  date. Weeks are ISO weeks, and a year alongside a week is the ISO year. An
+  integer divisor buckets the last part, numbering the buckets from 0, e.g.
+  ``"acquired:year-doy//16"`` groups into 16 day periods of each year, the
+  first of which is days 1 to 16,
+* a tuple of these, e.g. ``("product_id", "acquired:year")``, groups by all of
+  them.
+
+Keys of a single part are integers, or the property's value, and keys of several
+parts are tuples. Images whose property is missing are left out of the groups.
+
+Keys are evaluated, vectorised, over the metadata of the ImageStack's images.
+For simple stacks the metadata comes from a catalog search, see `scene_search`.
+Otherwise the stack's properties are fetched without reading any pixels. As
+that request is a plain graft it is cached like any other, and there is no code
+to upload.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import re
+from typing import Any, Hashable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from .columnar import ColumnarProperties
+
+# Date parts a key can extract, see `pandas.Series.dt`
+DATE_PARTS = ("year", "quarter", "month", "week", "day", "doy", "hour")
+# Date parts numbered from 1 rather than 0
+_ONE_BASED_PARTS = ("quarter", "month", "week", "day", "doy")
+
+_KEY_PATTERN = re.compile(
+    r"^(?P<name>[^:]+)(:(?P<parts>[a-z-]+)(//(?P<divisor>\d+))?)?$"
+)
+
+GroupKeySpec = Union[str, Sequence[str]]
+
+
+@dataclasses.dataclass(frozen=True)
+class GroupKey:
+    """
+    One component of a group key, see the module documentation.
+
+    Parameters
+    ----------
+    name: str
+        Name of the property
+    parts: Tuple[str, ...]
+        Date parts of the property to group by, or none to group by its value
+    divisor: int
+        Bucket size of the last date part
+    """
+
+    name: str
+    parts: Tuple[str, ...] = ()
+    divisor: int = 1
+
+    @classmethod
+    def parse(cls, spec: str) -> GroupKey:
+        """
+        Parse a key spec such as "acquired:year-doy//16".
+
+        Parameters
+        ----------
+        spec: str
+            The key spec
+
+        Returns
+        -------
+        key: GroupKey
+        """
+        match = _KEY_PATTERN.match(spec) if isinstance(spec, str) else None
+        if match is None:
+            raise ValueError(f"Invalid group key {spec!r}")
+
+        parts = tuple(match["parts"].split("-")) if match["parts"] else ()
+        unknown = [part for part in parts if part not in DATE_PARTS]
+        if unknown:
+            raise ValueError(
+                f"Invalid date parts {unknown} in group key {spec!r}, "
+                f"expected some of {DATE_PARTS}"
+            )
+
+        divisor = int(match["divisor"] or 1)
+        if divisor < 1:
+            raise ValueError(f"Invalid divisor in group key {spec!r}")
+
+        return cls(match["name"], parts, divisor)
+
+    def __str__(self) -> str:
+        spec = self.name
+        if self.parts:
+            spec += ":" + "-".join(self.parts)
+        if self.divisor != 1:
+            spec += f"//{self.divisor}"
+        return spec
+
+    def evaluate(self, values: Sequence[Any]) -> List[Any]:
+        """
+        Compute the key of each image from the values of its property.
+
+        Parameters
+        ----------
+        values: Sequence[Any]
+            Values of the property, None where it is missing
+
+        Returns
+        -------
+        keys: List[Any]
+            Keys, None where the property is missing
+        """
+        import pandas as pd
+
+        if not self.parts:
+            return [_hashable(value) for value in values]
+
+        dates = pd.to_datetime(
+            pd.Series(values, dtype=object), utc=True, format="ISO8601"
+        )
+        iso = dates.dt.isocalendar()
+        columns = []
+        for part in self.parts:
+            if part == "week":
+                column = iso.week.astype("Int64")
+            elif part == "year" and "week" in self.parts:
+                # Days around new year can be in a week of the next or last year
+                column = iso.year.astype("Int64")
+            elif part == "doy":
+                column = dates.dt.dayofyear.astype("Int64")
+            else:
+                column = getattr(dates.dt, part).astype("Int64")
+            columns.append(column)
+        if self.divisor != 1:
+            if self.parts[-1] in _ONE_BASED_PARTS:
+                columns[-1] = columns[-1] - 1
+            columns[-1] = columns[-1] // self.divisor
+
+        missing = dates.isna().to_numpy()
+        rows = zip(*(column.to_numpy(dtype=object) for column in columns))
+        return [
+            None if absent else _key(tuple(int(value) for value in row))
+            for absent, row in zip(missing, rows)
+        ]
+
+
+def _hashable(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _key(values: Tuple) -> Hashable:
+    return values[0] if len(values) == 1 else values
+
+
+def parse_group_key(spec: GroupKeySpec) -> Tuple[GroupKey, ...]:
+    """
+    Parse a key spec, or a tuple of them, see the module documentation.
+
+    Parameters
+    ----------
+    spec: Union[str, Sequence[str]]
+        The key spec, or a tuple or list of key specs
+
+    Returns
+    -------
+    keys: Tuple[GroupKey, ...]
+    """
+    specs = (spec,) if isinstance(spec, str) else tuple(spec)
+    if not specs:
+        raise ValueError("A group key needs at least one property")
+    return tuple(GroupKey.parse(item) for item in specs)
+
+
+def _column(properties: Sequence, name: str) -> List[Any]:
+    if isinstance(properties, ColumnarProperties):
+        if name not in properties.keys():
+            return [None] * len(properties)
+        return list(properties.column(name))
+    return [image.get(name) for image in properties]
+
+
+def group_ids(
+    properties: Sequence, spec: GroupKeySpec
+) -> List[Tuple[Hashable, List[str]]]:
+    """
+    Group the images of an ImageStack by a key spec.
+
+    Parameters
+    ----------
+    properties: Sequence
+        Per image properties of the ImageStack, as dicts or `ColumnarProperties`
+    spec: Union[str, Sequence[str]]
+        The key spec, or a tuple of key specs
+
+    Returns
+    -------
+    groups: List[Tuple[Hashable, List[str]]]
+        (group key, image ids) pairs, sorted by key where the keys can be
+        ordered, otherwise in the order the groups first appear
+    """
+    keys = parse_group_key(spec)
+    per_key = [key.evaluate(_column(properties, key.name)) for key in keys]
+    values = per_key[0] if isinstance(spec, str) else list(zip(*per_key))
+    return groups_from_keys(_column(properties, "id"), values)
+
+
+def groups_from_keys(
+    ids: Sequence[str], keys: Sequence[Hashable]
+) -> List[Tuple[Hashable, List[str]]]:
+    """
+    Group image ids by their keys, leaving out images with a key of None or
+    with None in a tuple key.
+
+    Parameters
+    ----------
+    ids: Sequence[str]
+        Ids of the images
+    keys: Sequence[Hashable]
+        Key of each image
+
+    Returns
+    -------
+    groups: List[Tuple[Hashable, List[str]]]
+        (group key, image ids) pairs, sorted by key where the keys can be
+        ordered, otherwise in the order the groups first appear
+    """
+    groups = {}
+    for image_id, key in zip(ids, keys):
+        if key is None or (isinstance(key, tuple) and None in key):
+            continue
+        groups.setdefault(key, []).append(image_id)
+
+    try:
+        order = sorted(groups)
+    except TypeError:
+        order = list(groups)
+    return [(key, groups[key]) for key in order]
@@ -1,29 +1,67 @@
 from __future__ import annotations
 
 import dataclasses
+import itertools
+import os
 from collections import namedtuple
 from collections.abc import Generator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from copy import deepcopy
-from typing import Any, Callable, Hashable, Union
-
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import earthdaily.earthone as eo
+import numpy as np
 from earthdaily.earthone.geo import AOI
 from tqdm import tqdm
 
-from .compute_map import ComputeMap
+from . import tracing
+from .compute_map import ComputeMap, DotDict
+from .group_keys import GroupKeySpec, group_ids, parse_group_key
 from .image_stack import ImageStack
-from .operations import compute_aoi, encode_function, groupby, reset_graft, set_cache_id
+from .materialize import MaterializedStack
+from .operations import (
+    compute_aoi,
+    encode_function,
+    groupby,
+    reset_graft,
+    set_cache_id,
+)
 from .reductions import reduction
+from .scene_search import catalog_groups
 from .serialization import BaseSerializationModel
 
+# Number of groups computed concurrently by `ImageStackGroups.compute_all`
+GROUPS_MAX_WORKERS = int(os.environ.get("DYNAMIC_COMPUTE_GROUPS_MAX_WORKERS", 4))
+
 BUILT_IN_REDUCERS = ["max", "min", "mean", "median", "sum", "std"]
 
 ImageStackReducer = namedtuple("ImageStackReducer", ["func", "axis"])
 
 
 class ImageStackGroups:
-    def __init__(self, image_stack: ImageStack, groups_graft: dict):
+    def __init__(
+        self,
+        image_stack: ImageStack,
+        groups_graft: dict,
+        key: Optional[GroupKeySpec] = None,
+        grouping_func: Optional[Callable[[dict], Hashable]] = None,
+    ):
         self.groups_graft = groups_graft
         self.image_stack = image_stack
+        self.key = key
+        # The grouping function encoded in the groups graft, if it was built in
+        # this process. It isn't decoded from grafts, which may not be trusted.
+        self.grouping_func = grouping_func
         self.computed_value = None
         self.computed_AOI: AOI = None
         self.reducer: ImageStackReducer = None
@@ -43,41 +81,189 @@ class ImageStackGroups:
             Generator[Any, ComputeMap]: generator which yields a tuple: (group key, ComputeMap)
         """
 
+        for group_name, id_list in self._groups(aoi, **kwargs):
+            yield group_name, self._reduce(self.image_stack.filter_by_id(id_list))
+
+    def _groups(self, aoi: AOI, **kwargs) -> list:
+        """The (group key, id list) pairs for `aoi`, computed once per AOI"""
         if not self.computed_value or self.computed_AOI != aoi:
-            self.computed_value, _ = compute_aoi(self.groups_graft, aoi, **kwargs)
+            groups = self._catalog_groups(aoi)
+            if groups is not None:
+                self.computed_value = groups
+            elif self.key is None:
+                self.computed_value, _ = compute_aoi(self.groups_graft, aoi, **kwargs)
+            else:
+                # Declarative keys are evaluated over the images' properties
+                _, properties = compute_aoi(
+                    self.groups_graft, aoi, metadata_only=True, **kwargs
+                )
+                self.computed_value = group_ids(properties, self.key)
             self.computed_AOI = aoi
+        return self.computed_value
 
-        for group_name, id_list in self.computed_value:
-            compute_map = self.image_stack.filter_by_id(id_list)
-            if (
-                self.reducer
-                and isinstance(self.reducer.func, str)
-                and self.reducer.func in BUILT_IN_REDUCERS
-            ):
-                compute_map = getattr(compute_map, self.reducer.func)(
-                    axis=self.reducer.axis
-                )
-            elif (
-                self.reducer
-                and isinstance(self.reducer.func, str)
-                and self.reducer.func not in BUILT_IN_REDUCERS
-            ):
-
-                compute_map = reduction(
-                    self.image_stack, self.reducer.func, axis=self.reducer.axis
+    def _catalog_groups(self, aoi: AOI) -> Optional[list]:
+        """
+        The groups of a simple stack from a catalog search, or None to compute
+        them, see `scene_search`.
+        """
+        if self.key is None and self.grouping_func is None:
+            return None
+
+        auth = self.image_stack._auth
+        try:
+            return catalog_groups(
+                dict(self.image_stack),
+                aoi,
+                key=self.key,
+                key_func=self.grouping_func,
+                catalog_client=eo.catalog.CatalogClient(auth=auth) if auth else None,
+            )
+        except Exception:
+            # E.g. the catalog is unavailable, or the grouping function expects
+            # properties the catalog doesn't have; computing the groups may work
+            return None
+
+    def _reduce(self, image_stack: ImageStack) -> ComputeMap:
+        """Apply the reducer, if any, to the ImageStack of one group"""
+        if not self.reducer:
+            return image_stack
+        if self.reducer.func in BUILT_IN_REDUCERS:
+            return getattr(image_stack, self.reducer.func)(axis=self.reducer.axis)
+        return reduction(image_stack, self.reducer.func, axis=self.reducer.axis)
+
+    def reduced(self, aoi: AOI, **kwargs) -> tuple:
+        """
+        Build a single Mosaic holding the reduction of every group, with the bands
+        of each group concatenated in the order of the group keys.
+
+        All groups are filtered from the same ImageStack graft, so the scenes are
+        selected and stacked once when the Mosaic is computed, rather than once
+        per group.
+
+        Parameters
+        ----------
+        aoi : earthdaily.earthone.geo.GeoContext
+            GeoContext for which to compute the groups
+
+        Returns
+        -------
+        keys, mosaic : Tuple[List, Mosaic]
+            The group keys, and the Mosaic of their reductions in the same order
+        """
+
+        if not self.reducer or self.reducer.axis != "images":
+            raise ValueError(
+                "Groups can only be computed together once reduced over images, "
+                "e.g. with `.max(axis='images')`. Compute `.groups` instead."
+            )
+
+        groups = self._groups(aoi, **kwargs)
+        if not groups:
+            raise ValueError("The ImageStack has no groups for this AOI")
+
+        keys = [group_name for group_name, _ in groups]
+        mosaics = [
+            self._reduce(self.image_stack.filter_by_id(id_list))
+            for _, id_list in groups
+        ]
+        mosaic = mosaics[0]
+        for other in mosaics[1:]:
+            mosaic = mosaic.concat_bands(other)
+        return keys, mosaic
+
+    def iter_computed(
+        self,
+        aoi: AOI,
+        max_workers: Optional[int] = None,
+        directory: Optional[str] = None,
+        progress: bool = False,
+        **kwargs,
+    ) -> Iterator[Tuple[Any, Union[DotDict, MaterializedStack]]]:
+        """
+        Compute the groups for `aoi` concurrently, yielding each group key and its
+        computed DotDict as soon as it is done, in the order the groups finish.
+
+        At most `max_workers` groups are computed, or waiting to be consumed, at a
+        time, so stopping early leaves the remaining groups uncomputed.
+
+        Parameters
+        ----------
+            aoi (AOI): earthdaily.earthone.geo.GeoContext
+        GeoContext for which to compute evaluate these groups
+            max_workers (Optional[int]): Maximum number of groups computed
+        concurrently, by default GROUPS_MAX_WORKERS
+            directory (Optional[str]): If given, each group is written to a
+        subdirectory of it, numbered in the order of the groups, and yielded as a
+        memory mapped MaterializedStack rather than held in memory
+            progress (bool): Display a progress bar of the groups computed
+
+        Returns
+        -------
+            Iterator[Tuple[Any, Union[DotDict, MaterializedStack]]]: iterator
+            yielding a tuple: (group key, computed group)
+        """
+
+        groups = list(self.compute(aoi, **kwargs))
+        workers = max(1, min(max_workers or GROUPS_MAX_WORKERS, len(groups) or 1))
+
+        def run(index: int):
+            group_name, compute_map = groups[index]
+            result = compute_map.compute(aoi, **kwargs)
+            if directory is not None:
+                result = MaterializedStack.save(
+                    os.path.join(directory, str(index)),
+                    result["ndarray"],
+                    result["properties"],
                 )
-            yield group_name, compute_map
+            return group_name, result
 
-    def compute_all(self, aoi: AOI, **kwargs) -> dict:
+        pbar = tqdm(
+            total=len(groups),
+            desc="Processing groups",
+            bar_format="{desc:<18}{percentage:3.0f}%|{bar:10}{r_bar}",
+            unit=" groups",
+            disable=not progress,
+        )
+        traced_run = tracing.propagate(run)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = set()
+        remaining = iter(range(len(groups)))
+        try:
+            for index in itertools.islice(remaining, workers):
+                pending.add(executor.submit(traced_run, index))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pbar.update()
+                    yield future.result()
+                    # Only start another group once this one has been consumed
+                    for index in itertools.islice(remaining, 1):
+                        pending.add(executor.submit(traced_run, index))
+        finally:
+            pbar.close()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def compute_all(
+        self,
+        aoi: AOI,
+        max_workers: Optional[int] = None,
+        directory: Optional[str] = None,
+        **kwargs,
+    ) -> dict:
         """
         Compute the groups for `aoi`, compute each resulting key/ComputeMap pair for the supplied AOI,
         and return a dictionary containing a key for each unique group and its computed DotDict. This
-        function, potentially long running, features a progressbar display.
+        function, potentially long running, features a progressbar display. Groups are computed
+        concurrently, see `iter_computed`.
 
         Parameters
         ----------
             aoi (AOI): earthdaily.earthone.geo.GeoContext
         GeoContext for which to compute evaluate these groups
+            max_workers (Optional[int]): Maximum number of groups computed
+        concurrently, by default GROUPS_MAX_WORKERS
+            directory (Optional[str]): If given, groups are written to disk and
+        returned as memory mapped MaterializedStacks, see `iter_computed`
 
         Returns
         -------
@@ -85,17 +271,16 @@ class ImageStackGroups:
             values are the computed DotDict corresponding to each key
         """
 
-        uncomputed_groups = list(self.compute(aoi, **kwargs))
-        pbar = tqdm(
-            uncomputed_groups,
-            desc="Processing groups",
-            bar_format="{desc:<18}{percentage:3.0f}%|{bar:10}{r_bar}",
-            unit=" groups",
+        computed_groups = dict(
+            self.iter_computed(
+                aoi, max_workers, directory=directory, progress=True, **kwargs
+            )
         )
-        computed_groups = {
-            group_id: value.compute(aoi, **kwargs) for group_id, value in pbar
+        # In the order of the groups rather than the order they finished in
+        return {
+            group_name: computed_groups[group_name]
+            for group_name, _ in self._groups(aoi, **kwargs)
         }
-        return computed_groups
 
     def one(self, aoi: AOI, **kwargs) -> tuple:
         """
@@ -119,6 +304,7 @@ class ImageStackGroupBySerializationModel(BaseSerializationModel):
     image_stack_json: str
     groups_graft: dict
     reducer: ImageStackReducer = None
+    key: Optional[GroupKeySpec] = None
 
     @classmethod
     def from_json(cls, data: str) -> ImageStackGroupBySerializationModel:
@@ -134,18 +320,82 @@ class ImageStackGroupBy(ComputeMap):
 
     """
 
-    def __init__(self, image_stack: ImageStack, groups_graft: dict):
+    def __init__(
+        self,
+        image_stack: ImageStack,
+        groups_graft: dict,
+        key: Optional[GroupKeySpec] = None,
+        grouping_func: Optional[Callable[[dict], Hashable]] = None,
+    ):
         set_cache_id(groups_graft)
         super().__init__(groups_graft)
         self.image_stack = image_stack
         self.groups_graft = groups_graft
-        self.groups = ImageStackGroups(image_stack, groups_graft)
+        self.key = key
+        self.grouping_func = grouping_func
+        self.groups = ImageStackGroups(image_stack, groups_graft, key, grouping_func)
+
+    def compute(
+        self,
+        aoi: AOI,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+        mask_format: Optional[str] = None,
+        nodata: Optional[Union[int, float]] = None,
+        **kwargs,
+    ) -> Union[np.ma.MaskedArray, List, Dict, DotDict]:
+        """
+        Compute the reduction of every group for a particular AOI, e.g.
+        `image_stack.groupby(func).max().compute(aoi)`.
+
+        The group keys are computed first, from the images' metadata only, then
+        the reductions of all groups are computed in a single request.
+
+        Parameters
+        ----------
+        aoi : earthdaily.earthone.geo.GeoContext
+            GeoContext for which to compute the groups
+        dtype : Optional[Union[str, numpy.dtype, type]]
+            Data type to cast the result to before it is transferred
+        mask_format : Optional[str]
+            How the mask is transferred, see `ComputeMap.compute`
+        nodata : Optional[Union[int, float]]
+            Fill value for masked pixels when mask_format is "nodata"
+
+        Returns
+        -------
+        results : Union[Array, List, Dict, DotDict]
+            A DotDict with the groups x bands x rows x cols "ndarray", the
+            "properties" of the reductions and the "group_keys", in the same
+            order as the groups in the array. Or just the array or properties
+            for `.ndarray` or `.properties`.
+        """
+
+        if not self.groups.reducer:
+            raise Exception(
+                "ImageStackGroupBy cannot be computed directly. "
+                "Instead, compute `.groups`, or use `.max` or `.mean`, etc. to "
+                "reduce the groups and compute that"
+            )
 
-    def compute(self, *args, **kwargs):
-        raise Exception(
-            "ImageStackGroupBy cannot be computed directly. "
-            "Instead, compute `.groups`, use `.max` or `.mean`, etc. to "
-            "composite the groups into a single ImageStack and compute that "
+        keys, mosaic = self.groups.reduced(aoi, **kwargs)
+        if self.return_val == "properties":
+            # Skip evaluating and transferring the array
+            kwargs.setdefault("metadata_only", True)
+        result = mosaic.compute(
+            aoi, dtype=dtype, mask_format=mask_format, nodata=nodata, **kwargs
+        )
+        value = result["ndarray"]
+        if value is not None:
+            value = value.reshape((len(keys), -1) + value.shape[1:])
+
+        if self.return_val == "ndarray":
+            return value
+
+        if self.return_val == "properties":
+            return result["properties"]
+
+        return DotDict(
+            {"ndarray": value, "properties": result["properties"], "group_keys": keys}
         )
 
     def max(self, axis="images"):
@@ -264,7 +514,9 @@ class ImageStackGroupBy(ComputeMap):
         elif isinstance(function, Callable):
             function = encode_function(function)
 
-        new_imagestackgroupby = ImageStackGroupBy(self.image_stack, self.groups_graft)
+        new_imagestackgroupby = ImageStackGroupBy(
+            self.image_stack, self.groups_graft, self.key, self.grouping_func
+        )
         groups = deepcopy(self.groups)
         groups.reducer = ImageStackReducer(function, axis)
 
@@ -279,6 +531,7 @@ class ImageStackGroupBy(ComputeMap):
             image_stack_json=self.image_stack.serialize(),
             groups_graft=self.groups_graft,
             reducer=self.groups.reducer,
+            key=self.key,
         ).json()
 
     @classmethod
@@ -301,6 +554,8 @@ class ImageStackGroupBy(ComputeMap):
         imagestack_groupby = cls(
             ComputeMap.__SUBCLASSES__["ImageStack"].deserialize(model.image_stack_json),
             model.groups_graft,
+            # JSON turns tuples of keys into lists
+            model.key if isinstance(model.key, (str, type(None))) else tuple(model.key),
         )
         imagestack_groupby.groups.reducer = (
             ImageStackReducer(*model.reducer) if model.reducer else None
@@ -309,17 +564,22 @@ class ImageStackGroupBy(ComputeMap):
 
 
 def image_stack_groupby(
-    image_stack: ImageStack, grouping_func: Callable[[dict], Hashable]
+    image_stack: ImageStack,
+    grouping_func: Union[GroupKeySpec, Callable[[dict], Hashable]],
 ) -> ImageStackGroupBy:
     """
     Perform a grouping function over either images or bands and return an ImageStackGroupBy object.
 
     Parameters
     ----------
-    grouping_func: Callable[[dict], Hashable]
-        Function to pick out the values to group by. The function should take as
-        input a dotted-dict representing metadata for an image and should return a
-        hashable value upon which groups will be build.
+    grouping_func: Union[str, Tuple[str, ...], Callable[[dict], Hashable]]
+        What to group by. Either a declarative key, such as "acquired:month",
+        "acquired:year-doy//16", a property name, or a tuple of these, see
+        `group_keys`. Or a function to pick out the values to group by. The function
+        should take as input a dotted-dict representing metadata for an image and
+        should return a hashable value upon which groups will be build.
+        Declarative keys are evaluated over the images' metadata, without
+        uploading any code, and are preferred.
 
     Returns
     -------
@@ -334,16 +594,24 @@ def image_stack_groupby(
             "esa:sentinel-1:sigma0v:v1", "vv", "20230101", "20230401" # doctest: +SKIP
         ) # doctest: +SKIP
     >>> # group by acquired month
-    >>> grouped_sigma = sigma0_vv.groupby(lambda x: x.acquired.month) # doctest: +SKIP
+    >>> grouped_sigma = sigma0_vv.groupby("acquired:month") # doctest: +SKIP
     >>> # loop through each grouping, applying a max reducer and visualize it on the map
     >>> for group_name, image_stack in grouped_sigma.groups.compute(m.geocontext()): # doctest: +SKIP
             image_stack.max(axis="images").visualize(str(group_name), m, colormap="turbo") # doctest: +SKIP
 
     """
+    if not callable(grouping_func):
+        # Fail early on invalid keys
+        parse_group_key(grouping_func)
+        key = (
+            grouping_func if isinstance(grouping_func, str) else tuple(grouping_func)
+        )
+        return ImageStackGroupBy(image_stack, deepcopy(dict(image_stack)), key)
+
     encoded_grouping_func = encode_function(grouping_func)
     groups = groupby(dict(image_stack), encoded_grouping_func)
 
-    return ImageStackGroupBy(image_stack, groups)
+    return ImageStackGroupBy(image_stack, groups, grouping_func=grouping_func)
 
 
 ImageStack.groupby = image_stack_groupby
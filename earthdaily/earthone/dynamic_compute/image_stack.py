@@ -8,6 +8,7 @@ from numbers import Number
 from typing import Dict, Hashable, List, Optional, Tuple, Union
 
 import earthdaily.earthone as eo
+import numpy as np
 
 from .compute_map import (
     AddMixin,
@@ -23,8 +24,12 @@ from .compute_map import (
     TrueDivMixin,
     as_compute_map,
 )
+from .chunked_reduction import ChunkedReduction
+from .columnar import ColumnarProperties
 from .datetime_utils import normalize_datetime
 from .eo_utils import get_product_or_fail
+from .incremental import IncrementalComposite
+from .materialize import MaterializedStack, StackMaterializer
 from .mosaic import Mosaic
 from .operations import (
     _band_op,
@@ -49,6 +54,7 @@ from .operations import (
 )
 from .proxies import Datetime, parameter
 from .reductions import reduction
+from .result_cache import ResultCache
 from .serialization import BaseSerializationModel
 
 AXIS_NAME_TO_INDEX_MAP = {"images": (0,), "bands": (1,), "pixels": (2, 3)}
@@ -713,6 +719,135 @@ class ImageStack(
 
         return reduction(self, reducer, axis, auth=self._auth, **kwargs)
 
+    def reduce_chunked(
+        self,
+        reducer: str,
+        window: Union[str, datetime.timedelta] = "90D",
+        start_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        end_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        max_workers: Optional[int] = None,
+    ) -> ChunkedReduction:
+        """
+        Reduce over images in date windows, so that long stacks are reduced
+        within bounded memory. Each window is reduced separately to partial
+        aggregates, which are merged locally into the exact result. This does
+        not mutate self.
+
+        Parameters
+        ----------
+        reducer: str
+            One of "sum", "mean", "std", "min" or "max"
+        window: Union[str, datetime.timedelta]
+            Length of the windows, as a timedelta or a pandas frequency, e.g.
+            "90D" or "QS"
+        start_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+            Start of the range to reduce, by default that of this ImageStack
+        end_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+            End of the range to reduce, by default that of this ImageStack
+        max_workers: Optional[int]
+            Maximum number of partials computed concurrently
+
+        Returns
+        -------
+        reduction: ChunkedReduction
+            Reduction to evaluate with `compute`, which returns a bands x rows x
+            columns masked array
+        """
+        return ChunkedReduction(
+            self, reducer, window, start_datetime, end_datetime, max_workers
+        )
+
+    def reduce_incremental(
+        self,
+        reducer: str,
+        period: Union[str, datetime.timedelta] = "MS",
+        store: Optional[Union[str, ResultCache]] = None,
+        recheck: Optional[Union[str, datetime.timedelta]] = "30D",
+        start_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        end_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        max_workers: Optional[int] = None,
+    ) -> IncrementalComposite:
+        """
+        Reduce over images from per-period partials cached in a local store, so
+        that recomputing a composite over a growing date range only computes the
+        periods that are new or whose images changed. This does not mutate self.
+
+        Parameters
+        ----------
+        reducer: str
+            One of "sum", "mean", "std", "min" or "max"
+        period: Union[str, datetime.timedelta]
+            Length of the periods, as a timedelta or a pandas frequency, e.g.
+            "MS" for calendar months
+        store: Optional[Union[str, ResultCache]]
+            Store of partials, or the directory of one, by default
+            `incremental.PARTIALS_DIR`
+        recheck: Optional[Union[str, datetime.timedelta]]
+            Periods that ended within this time of the end of the range are
+            recomputed if their images changed, with None every period is checked
+        start_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+            Start of the range to reduce, by default that of this ImageStack
+        end_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+            End of the range to reduce, by default that of this ImageStack
+        max_workers: Optional[int]
+            Maximum number of partials computed concurrently
+
+        Returns
+        -------
+        composite: IncrementalComposite
+            Composite to evaluate with `compute`, which returns a bands x rows x
+            columns masked array
+        """
+        return IncrementalComposite(
+            self,
+            reducer,
+            period,
+            store,
+            recheck,
+            start_datetime,
+            end_datetime,
+            max_workers,
+        )
+
+    def materialize(
+        self,
+        aoi: eo.geo.AOI,
+        directory: str,
+        partition: Union[int, str, datetime.timedelta] = 256,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+        max_workers: Optional[int] = None,
+        **kwargs,
+    ) -> MaterializedStack:
+        """
+        Compute this ImageStack for an AOI in partitions, concurrently, into
+        memory mapped arrays in a directory, so that stacks larger than memory
+        can be computed. The mask is stored packed, one bit per pixel.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.GeoContext
+            GeoContext for which to compute this ImageStack
+        directory: str
+            Directory to write the arrays to, created if it doesn't exist
+        partition: Union[int, str, datetime.timedelta]
+            Partition the stack into groups of this many images or, with a
+            timedelta or a pandas frequency, e.g. "90D", into date windows
+        dtype: Optional[Union[str, np.dtype, type]]
+            Data type to cast the images to, by the server before transfer
+        max_workers: Optional[int]
+            Maximum number of partitions computed concurrently
+        **kwargs:
+            Further arguments of `compute`, e.g. parameter values
+
+        Returns
+        -------
+        stack: MaterializedStack
+            The images, as memory mapped arrays, and their properties
+        """
+        return StackMaterializer(self, partition, max_workers=max_workers).compute(
+            aoi, directory, dtype=dtype, **kwargs
+        )
+
     def visualize(*args, **kwargs):
         raise NotImplementedError(
             "ImageStacks cannot be visualized. You must reduce this to a Mosaic before calling visualize."
@@ -808,20 +943,25 @@ def dot_propagation_for_two_image_stacks(
     return properties
 
 
-def keys_with_fixed_values(list_of_dict: List[Dict]) -> List[Hashable]:
+def keys_with_fixed_values(
+    list_of_dict: Union[List[Dict], ColumnarProperties],
+) -> List[Hashable]:
     """
     Given a list of dictionaries return a list of keys that are
     present in all dictionaries and for which the value is the same
     for all dictionaries.
     Parameters
     ----------
-    list_of_dicts: List[Dict]
+    list_of_dicts: Union[List[Dict], ColumnarProperties]
         List of dictionaries for which we should find "stable" keys
     Returns
     -------
     stable_keys: List[Hashable]
         List of keys that were present in all dictionaries and had the same value.
     """
+    if isinstance(list_of_dict, ColumnarProperties):
+        return list(list_of_dict.fixed_values())
+
     stable_keys = []
 
     for key, value in list_of_dict[0].items():
@@ -847,8 +987,8 @@ def keys_with_fixed_values(list_of_dict: List[Dict]) -> List[Hashable]:
 
 
 def dot_property_propagation_for_image_stack_and_matrix(
-    properties: List[dict], size: int
-) -> List[dict]:
+    properties: Union[List[dict], ColumnarProperties], size: int
+) -> Union[List[dict], ColumnarProperties]:
     """
     Handle property propagation for the case that the input to dot is an ImageStacks and
     a matrix.
@@ -858,16 +998,19 @@ def dot_property_propagation_for_image_stack_and_matrix(
     input properties.
     Parameters
     ----------
-    properties: List[dict]
+    properties: Union[List[dict], ColumnarProperties]
         Per image properties of the ImageStack
     size: int
         Number of scenes in the output image stack
     Returns
     -------
-    properties: List[dict]
-        Properties for the resulting ImageStack
+    properties: Union[List[dict], ColumnarProperties]
+        Properties for the resulting ImageStack, columnar if the input is
     """
 
+    if isinstance(properties, ColumnarProperties):
+        return ColumnarProperties.from_constants(properties.fixed_values(), size)
+
     property_base = {
         key: properties[0][key] for key in keys_with_fixed_values(properties)
     }
@@ -0,0 +1,288 @@
+"""Incremental temporal composites with cached per-period partials.
+
+An `IncrementalComposite` is a `ChunkedReduction` whose per-period partial
+aggregates are kept in a local store, a `ResultCache`, so that recomputing a
+composite, e.g. "the mean since 2020-01-01" every night, only computes the
+periods that are missing from the store or whose images changed.
+
+Partials are stored per AOI, keyed by the fingerprint of the period's graft,
+which includes the period's dates, and by the parameters and the API host the
+composite is computed with. The last period of a range that grows is
+recomputed whenever the range ends later. Periods that ended within `recheck`
+of the end of the range are also checked for changed images: their image
+properties are fetched, which doesn't read pixels, and compared with those the
+partials were computed from.
+"""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+from earthdaily.earthone.geo import AOI
+
+from . import operations, tracing
+from .chunked_reduction import PARTIALS, ChunkedReduction
+from .graft import client as graft_client
+from .operations import _normalize_aoi, graft_fingerprint
+from .result_cache import DEFAULT_MAX_BYTES, ResultCache
+
+if TYPE_CHECKING:
+    from .compute_map import ComputeMap
+    from .image_stack import ImageStack
+
+# Directory of the default store of partials
+PARTIALS_DIR = os.environ.get(
+    "DYNAMIC_COMPUTE_PARTIALS_DIR",
+    os.path.join("~", ".cache", "earthdaily", "dynamic_compute", "partials"),
+)
+# Total size of the default store above which old partials are evicted
+PARTIALS_MAX_BYTES = int(
+    os.environ.get("DYNAMIC_COMPUTE_PARTIALS_MAX_BYTES", DEFAULT_MAX_BYTES)
+)
+
+
+def scenes_signature(properties: List[Dict]) -> str:
+    """
+    Identify the images of a period by their properties, so that reprocessed,
+    added or removed images are noticed.
+
+    Parameters
+    ----------
+    properties: List[Dict]
+        Per image properties of the period's ImageStack
+
+    Returns
+    -------
+    signature: str
+        Hex digest of the properties, independent of the order of the images
+    """
+    encoded = sorted(
+        json.dumps(image, sort_keys=True, default=str) for image in properties
+    )
+    return hashlib.sha256("\n".join(encoded).encode("utf-8")).hexdigest()
+
+
+class IncrementalComposite(ChunkedReduction):
+    """
+    A temporal reduction of an ImageStack assembled from per-period partials
+    that are cached between computations, see `ImageStack.reduce_incremental`.
+
+    Parameters
+    ----------
+    image_stack: ImageStack
+        The stack to reduce over images
+    reducer: str
+        One of "sum", "mean", "std", "min" or "max"
+    period: Union[str, datetime.timedelta]
+        Length of the periods, as a timedelta or a pandas frequency, e.g. "MS"
+        for calendar months. Periods start at `start_datetime`, so keep it fixed
+        between computations for periods to be reused.
+    store: Optional[Union[str, ResultCache]]
+        Store of partials, or the directory of one. By default PARTIALS_DIR.
+    recheck: Optional[Union[str, datetime.timedelta]]
+        Periods that ended within this time of the end of the range are
+        recomputed if their images changed. With None every cached period is
+        checked, with a zero timedelta none are.
+    start_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        Start of the range to reduce, by default that of the stack
+    end_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        End of the range to reduce, by default that of the stack
+    max_workers: Optional[int]
+        Maximum number of partials computed concurrently
+    """
+
+    def __init__(
+        self,
+        image_stack: ImageStack,
+        reducer: str,
+        period: Union[str, datetime.timedelta] = "MS",
+        store: Optional[Union[str, ResultCache]] = None,
+        recheck: Optional[Union[str, datetime.timedelta]] = "30D",
+        start_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        end_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        max_workers: Optional[int] = None,
+    ):
+        super().__init__(
+            image_stack, reducer, period, start_datetime, end_datetime, max_workers
+        )
+        if store is None:
+            store = PARTIALS_DIR
+        if not isinstance(store, ResultCache):
+            store = ResultCache(store, PARTIALS_MAX_BYTES)
+        self.store = store
+        self.recheck = recheck
+        # Indices of the windows computed and reused by the last computation
+        self.computed: List[int] = []
+        self.reused: List[int] = []
+
+    def _rechecked(self) -> List[int]:
+        """Indices of the windows to check for changed images"""
+        import pandas as pd
+
+        if self.recheck is None:
+            return list(range(len(self.windows)))
+
+        end = pd.Timestamp(self.windows[-1][1])
+        cutoff = end - pd.Timedelta(self.recheck)
+        return [
+            index
+            for index, (_, window_end) in enumerate(self.windows)
+            if pd.Timestamp(window_end) > cutoff
+        ]
+
+    def _key(self, index: int, aoi_fields: Dict, source: str, parameters: Dict):
+        graft = graft_client.unset_all_cache_ids(dict(self.window_stack(index)))
+        return self.store.make_key(
+            graft_fingerprint(graft),
+            aoi_fields,
+            parameters=parameters,
+            period=list(self.windows[index]),
+            reducer=self.reducer,
+            partials=list(PARTIALS[self.reducer]),
+            source=source,
+        )
+
+    def _store(
+        self,
+        key: str,
+        partials: Optional[Dict[str, np.ma.MaskedArray]],
+        signature: Optional[str],
+    ):
+        properties = {"scenes": signature, "partials": list(PARTIALS[self.reducer])}
+        if partials is None:
+            # The window has no images
+            self.store.put(key, None, properties)
+            return
+
+        value = np.ma.stack([partials[name] for name in PARTIALS[self.reducer]])
+        self.store.put(key, value, properties)
+
+    @tracing.traced("reduce_incremental")
+    def _evaluate_incremental(
+        self,
+        evaluate: Callable[[ComputeMap], Any],
+        aoi: AOI,
+        source: str,
+        parameters: Dict,
+    ) -> np.ma.MaskedArray:
+        """
+        Evaluate the composite from stored partials, computing the missing ones.
+        `evaluate` returns the whole result of a ComputeMap, as the properties
+        of periods are evaluated too, and `source` and `parameters` are part of
+        the keys of the stored partials.
+        """
+        _, aoi_fields = _normalize_aoi(aoi)
+        indices = range(len(self.windows))
+        keys = {
+            index: self._key(index, aoi_fields, source, parameters)
+            for index in indices
+        }
+        cached = {index: self.store.get(keys[index]) for index in indices}
+
+        # Signatures of the images of the periods to recheck, and of those to
+        # compute, which are stored with their partials
+        rechecked = set(self._rechecked())
+        signed = [
+            index for index in indices if cached[index] is None or index in rechecked
+        ]
+        signatures: Dict[int, str] = {}
+        if signed:
+            workers = max(1, min(self.max_workers, len(signed)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                properties = executor.map(
+                    tracing.propagate(
+                        lambda index: evaluate(self.window_stack(index).properties)
+                    ),
+                    signed,
+                )
+                signatures = dict(zip(signed, map(scenes_signature, properties)))
+
+        by_window: Dict[int, Optional[Dict[str, np.ma.MaskedArray]]] = {}
+        missing = []
+        for index in indices:
+            entry = cached[index]
+            if entry is None or (
+                index in signatures and entry[1].get("scenes") != signatures[index]
+            ):
+                missing.append(index)
+                continue
+
+            value, _ = entry
+            by_window[index] = (
+                None
+                if value is None
+                else dict(zip(PARTIALS[self.reducer], np.ma.masked_array(value)))
+            )
+
+        computed = (
+            self._compute_partials(
+                missing, lambda compute_map: evaluate(compute_map).ndarray
+            )
+            if missing
+            else {}
+        )
+        for index, partials in computed.items():
+            self._store(keys[index], partials, signatures.get(index))
+        by_window.update(computed)
+
+        self.computed = missing
+        self.reused = [index for index in indices if index not in computed]
+        return self._merge(by_window)
+
+    def compute(self, aoi: AOI, **kwargs) -> np.ma.MaskedArray:
+        """
+        Evaluate the composite for an AOI, computing only the partials of
+        periods that are missing from the store or whose images changed.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.GeoContext
+            GeoContext for which to evaluate the composite
+        **kwargs:
+            Further arguments of `ComputeMap.compute`, e.g. parameter values
+
+        Returns
+        -------
+        reduced: np.ma.MaskedArray
+            Bands x rows x columns array, masked where no image is unmasked
+        """
+        return self._evaluate_incremental(
+            lambda compute_map: compute_map.compute(aoi, **kwargs),
+            aoi,
+            operations.API_HOST,
+            kwargs,
+        )
+
+    def compute_local(self, aoi: AOI, provider=None, **kwargs) -> np.ma.MaskedArray:
+        """
+        Evaluate the composite for an AOI in process, see `local`. Partials
+        are stored separately from those computed by the API.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.GeoContext
+            GeoContext for which to evaluate the composite
+        provider: Optional[local.LocalProvider]
+            Source of imagery, by default deterministic synthetic imagery
+        **kwargs:
+            Values of the graft's parameters
+
+        Returns
+        -------
+        reduced: np.ma.MaskedArray
+            Bands x rows x columns array, masked where no image is unmasked
+        """
+        return self._evaluate_incremental(
+            lambda compute_map: compute_map.compute_local(
+                aoi, provider=provider, **kwargs
+            ),
+            aoi,
+            f"local:{type(provider).__name__}",
+            kwargs,
+        )
@@ -8,7 +8,6 @@ import threading
 import uuid
 import warnings
 from datetime import date, datetime
-from importlib.metadata import version
 from urllib.parse import urlencode
 
 import earthdaily.earthone as eo
@@ -18,17 +17,16 @@ import ipyleaflet
 import ipywidgets as widgets
 import matplotlib as mpl
 import numpy as np
-import requests
 import traitlets
 from earthdaily.earthone.core.vector.tiles import create_layer
 from pandas.api.types import is_numeric_dtype
 
+from .. import tracing
 from ..datetime_utils import normalize_datetime_or_none
-from ..eo_utils import add_bearer
 from ..operations import (
     API_HOST,
-    UnauthorizedUserError,
     _python_major_minor_version,
+    _register_layer,
     set_cache_id,
 )
 from .clearable import ClearableOutput
@@ -560,6 +558,7 @@ class DynamicComputeLayer(ipyleaflet.TileLayer):
 
         return name in self._trait_values
 
+    @tracing.traced()
     def make_url(self):
         """
         Generate the URL for this layer.
@@ -610,44 +609,12 @@ class DynamicComputeLayer(ipyleaflet.TileLayer):
         set_cache_id(self.imagery, self._auth)
 
         # Create a layer from the graft
-        response = requests.post(
-            f"{API_HOST}/layers/",
-            headers={"Authorization": add_bearer(self._auth.token)},
-            json={
-                "graft": self.imagery,
-                "python_version": _python_major_minor_version,
-                "dynamic_compute_version": version(
-                    "earthdaily-earthone-dynamic-compute"
-                ),
-            },
-        )
-        try:
-            response.raise_for_status()
-        except Exception as e:
-            if e.response.status_code == 403:
-                raise UnauthorizedUserError(
-                    "User does not have access to dynamic-compute. "
-                    "If you believe this to be an error, contact support@earthdaily.com"
-                )
-            else:
-                raise e
+        layer_id = _register_layer(self.imagery, self._auth)
 
         if self.alpha:
             # Create an alpha layer from the graft
-            alpha_response = requests.post(
-                f"{API_HOST}/layers/",
-                headers={"Authorization": add_bearer(self._auth.token)},
-                json={
-                    "graft": self.alpha,
-                    "python_version": _python_major_minor_version,
-                    "dynamic_compute_version": version(
-                        "earthdaily-earthone-dynamic-compute"
-                    ),
-                },
-            )
-            alpha = json.loads(alpha_response.content.decode("utf-8"))["layer_id"]
+            alpha = _register_layer(self.alpha, self._auth)
 
-        layer_id = json.loads(response.content.decode("utf-8"))["layer_id"]
         self.set_trait("layer_id", layer_id)
         # URL encode query parameters
         params = {}
@@ -987,6 +954,7 @@ class VectorRasterLayer(DynamicComputeLayer):
         self._known_logs = set()
         self._known_logs_lock = threading.Lock()
 
+    @tracing.traced()
     def make_url(self):
         """
         Generate the URL for this layer.
@@ -1026,29 +994,8 @@ class VectorRasterLayer(DynamicComputeLayer):
         set_cache_id(self.imagery, self._auth)
 
         # Create a layer from the graft
-        response = requests.post(
-            f"{API_HOST}/layers/",
-            headers={"Authorization": add_bearer(self._auth.token)},
-            json={
-                "graft": self.imagery,
-                "python_version": _python_major_minor_version,
-                "dynamic_compute_version": version(
-                    "earthdaily-earthone-dynamic-compute"
-                ),
-            },
-        )
-        try:
-            response.raise_for_status()
-        except Exception as e:
-            if e.response.status_code == 403:
-                raise UnauthorizedUserError(
-                    "User does not have access to dynamic-compute. "
-                    "If you believe this to be an error, contact support@earthdaily.com"
-                )
-            else:
-                raise e
+        layer_id = _register_layer(self.imagery, self._auth)
 
-        layer_id = json.loads(response.content.decode("utf-8"))["layer_id"]
         self.set_trait("layer_id", layer_id)
         # URL encode query parameters
         params = {}
@@ -0,0 +1,906 @@
+"""Evaluate grafts locally with NumPy.
+
+Every ComputeMap is normally evaluated by the compute service. A
+`LocalEvaluator` instead interprets the graft in process, implementing the
+builtins with vectorised NumPy masked-array kernels and reading imagery from a
+pluggable `LocalProvider`. This is meant for small AOIs: previews, tests, and
+benchmarking graft optimisations offline.
+
+Two providers are included:
+
+* `SyntheticProvider`, deterministic random imagery of the AOI's shape,
+* `ArrayProvider`, in-memory arrays per product and band.
+
+Builtins that need the catalog or user code (``code``, ``groupby``,
+``filter_data``, ``groupby_data``, ``mask_by_vector`` and ``rasterization``)
+raise `NotImplementedError`.
+
+Example
+-------
+>>> from earthdaily.earthone.dynamic_compute.local import SyntheticProvider
+>>> ndvi = (nir - red) / (nir + red) # doctest: +SKIP
+>>> ndvi.compute_local(aoi, provider=SyntheticProvider(seed=1)) # doctest: +SKIP
+"""
+
+from __future__ import annotations
+
+import base64
+import dataclasses
+import datetime
+import json
+import operator
+import zlib
+from abc import ABC, abstractmethod
+from copy import deepcopy
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import earthdaily.earthone as eo
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import tracing
+from .columnar import ColumnarProperties
+from .graft import client as graft_client
+from .graft.interpreter import interpret
+from .image_stack import (
+    dot_propagation_for_two_image_stacks,
+    dot_property_propagation_for_image_stack_and_matrix,
+    keys_with_fixed_values,
+)
+from .mosaic import property_propagation_for_dot
+from .operations import (
+    _default_property_propagation,
+    _get_pid_bands_pad,
+    adaptive_mask,
+    masked_einsum,
+)
+from .reductions import BUILT_IN_REDUCERS
+
+Properties = Union[Dict, List[Dict], ColumnarProperties]
+
+# Synthetic scenes are acquired every revisit before and after this date
+SYNTHETIC_EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+_BINARY_OPS = {
+    "add": operator.add,
+    "sub": operator.sub,
+    "mul": operator.mul,
+    "truediv": operator.truediv,
+    "floordiv": operator.floordiv,
+    "_pow": operator.pow,
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "lt": operator.lt,
+    "le": operator.le,
+    "_and": operator.and_,
+    "_or": operator.or_,
+    "arctan2": np.ma.arctan2,
+}
+
+# Reflected operations, e.g. ``2 - m``, apply the operation with swapped operands
+_REFLECTED_OPS = {
+    "radd": "add",
+    "rsub": "sub",
+    "rmul": "mul",
+    "rtruediv": "truediv",
+    "rfloordiv": "floordiv",
+    "rpow": "_pow",
+    "rand": "_and",
+    "ror": "_or",
+}
+
+_FUNCTIONAL_OPS = (
+    "sqrt",
+    "cos",
+    "sin",
+    "tan",
+    "arccos",
+    "arcsin",
+    "arctan",
+    "log",
+    "log10",
+)
+
+_REDUCERS = tuple(BUILT_IN_REDUCERS) + ("argmax", "argmin")
+
+
+@dataclasses.dataclass
+class LocalRaster:
+    """
+    An evaluated Mosaic or ImageStack.
+
+    Attributes
+    ----------
+    ndarray: np.ma.MaskedArray
+        Data, bands x rows x cols for a Mosaic and scenes x bands x rows x cols
+        for an ImageStack.
+    properties: Union[Dict, ColumnarProperties]
+        Properties, a dict for a Mosaic and columnar properties, with a row per
+        scene, for an ImageStack.
+    """
+
+    ndarray: np.ma.MaskedArray
+    properties: Properties
+
+
+def _format_bands(bands: Union[str, List[str]]) -> List[str]:
+    if isinstance(bands, str):
+        return bands.split()
+    return list(bands)
+
+
+def _aoi_shape(aoi: eo.geo.AOI) -> Tuple[int, int]:
+    if aoi.shape is not None:
+        return tuple(aoi.shape)
+    if aoi.resolution is None or aoi.bounds is None:
+        raise ValueError("A local evaluation needs an AOI with a shape or resolution")
+    x0, y0, x1, y1 = aoi.bounds
+    return (
+        max(1, int(round((y1 - y0) / aoi.resolution))),
+        max(1, int(round((x1 - x0) / aoi.resolution))),
+    )
+
+
+def _aoi_resolution(aoi: eo.geo.AOI) -> Tuple[float, float]:
+    if aoi.resolution is not None:
+        return aoi.resolution, aoi.resolution
+    x0, y0, x1, y1 = aoi.bounds
+    rows, cols = _aoi_shape(aoi)
+    return (x1 - x0) / cols, (y1 - y0) / rows
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime.datetime]:
+    if value is None:
+        return None
+    parsed = datetime.datetime.fromisoformat(str(value))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+class LocalProvider(ABC):
+    """
+    Source of imagery for a `LocalEvaluator`, standing in for the catalog.
+
+    Providers implement the data-source builtins of a graft. Each receives the
+    AOI being evaluated and the options of the builtin, e.g. ``pad``,
+    ``start_datetime`` or ``resampler``, which it may ignore.
+    """
+
+    @abstractmethod
+    def mosaic(
+        self, product_id: str, bands: List[str], aoi: eo.geo.AOI, **options
+    ) -> Tuple[np.ma.MaskedArray, Dict]:
+        """
+        Mosaic a product.
+
+        Returns
+        -------
+        mosaic: Tuple[np.ma.MaskedArray, Dict]
+            A bands x rows x cols array and its properties
+        """
+
+    @abstractmethod
+    def select_scenes(
+        self, product_id: str, bands: List[str], aoi: eo.geo.AOI, **options
+    ) -> List[Dict]:
+        """
+        Select the scenes of a product.
+
+        Returns
+        -------
+        scenes: List[Dict]
+            Properties of each scene, including at least an "id"
+        """
+
+    @abstractmethod
+    def stack_scenes(
+        self, scenes: List[Dict], bands: List[str], aoi: eo.geo.AOI, **options
+    ) -> Tuple[np.ma.MaskedArray, List[Dict]]:
+        """
+        Stack selected scenes.
+
+        Returns
+        -------
+        stack: Tuple[np.ma.MaskedArray, List[Dict]]
+            A scenes x bands x rows x cols array and the properties of each scene
+        """
+
+    def from_image_ids(
+        self, ids: List[str], bands: List[str], aoi: eo.geo.AOI, **options
+    ) -> Tuple[np.ma.MaskedArray, List[Dict]]:
+        """Stack scenes by id, by default with `stack_scenes`"""
+        product_ids = [image_id.rsplit(":", 1)[0] for image_id in ids]
+        scenes = [
+            {"id": image_id, "product_id": product_id}
+            for image_id, product_id in zip(ids, product_ids)
+        ]
+        return self.stack_scenes(scenes, bands, aoi, **options)
+
+
+class SyntheticProvider(LocalProvider):
+    """
+    Deterministic random imagery in the shape of the AOI.
+
+    The same product, band and scene always give the same pixels for a given
+    seed and AOI shape, so evaluations can be compared across runs. Scenes are
+    acquired every `revisit` on fixed dates, whatever the selected range, so
+    that a range split into windows selects the same scenes as the whole.
+
+    Parameters
+    ----------
+    seed: int
+        Seed for the imagery.
+    scenes: int
+        Number of scenes selected from each product when the selection has no
+        end date. Otherwise every scene of the range is selected.
+    dtype: Union[str, np.dtype]
+        Data type of the imagery, floats are in [0, 1).
+    masked_fraction: float
+        Fraction of pixels that are masked.
+    revisit: datetime.timedelta
+        Time between the acquisitions of the scenes of a product.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        scenes: int = 4,
+        dtype: Union[str, np.dtype] = "float64",
+        masked_fraction: float = 0.0,
+        revisit: datetime.timedelta = datetime.timedelta(days=5),
+    ):
+        self.seed = seed
+        self.scenes = scenes
+        self.dtype = np.dtype(dtype)
+        self.masked_fraction = masked_fraction
+        self.revisit = revisit
+
+    def _band(self, shape: Tuple[int, ...], *names: str) -> np.ma.MaskedArray:
+        rng = np.random.default_rng(
+            [self.seed] + [zlib.crc32(name.encode("utf-8")) for name in names]
+        )
+        if self.dtype.kind == "b":
+            data = rng.random(shape) < 0.5
+        elif self.dtype.kind in "iu":
+            info = np.iinfo(self.dtype)
+            data = rng.integers(max(info.min, 0), min(info.max, 10000), shape)
+        else:
+            data = rng.random(shape)
+        mask = rng.random(shape) < self.masked_fraction
+        return np.ma.masked_array(data.astype(self.dtype), mask)
+
+    def mosaic(self, product_id, bands, aoi, **options):
+        shape = _aoi_shape(aoi)
+        data = np.ma.stack([self._band(shape, product_id, band) for band in bands])
+        properties = {
+            "product_id": product_id,
+            "bands": list(bands),
+            "pad": options.get("pad") or 0,
+        }
+        return data, properties
+
+    def select_scenes(self, product_id, bands, aoi, **options):
+        start = _parse_datetime(options.get("start_datetime")) or SYNTHETIC_EPOCH
+        end = _parse_datetime(options.get("end_datetime"))
+
+        # Numbers of the first acquisition at or after the start, and of the
+        # first at or after the end, which is excluded
+        first = -((SYNTHETIC_EPOCH - start) // self.revisit)
+        stop = (
+            first + self.scenes
+            if end is None
+            else -((SYNTHETIC_EPOCH - end) // self.revisit)
+        )
+        acquisitions = [
+            SYNTHETIC_EPOCH + number * self.revisit for number in range(first, stop)
+        ]
+        return [
+            {
+                "id": f"{product_id}:synthetic_{acquired:%Y%m%dT%H%M%S}",
+                "product_id": product_id,
+                "acquired": acquired.isoformat(),
+            }
+            for acquired in acquisitions
+        ]
+
+    def stack_scenes(self, scenes, bands, aoi, **options):
+        shape = _aoi_shape(aoi)
+        if not scenes:
+            return np.ma.masked_array(np.zeros((0, len(bands)) + shape)), []
+        data = np.ma.stack(
+            [
+                np.ma.stack(
+                    [self._band(shape, scene["id"], band) for band in bands]
+                )
+                for scene in scenes
+            ]
+        )
+        properties = [
+            dict(scene, bands=list(bands), pad=options.get("pad") or 0)
+            for scene in scenes
+        ]
+        return data, properties
+
+
+class ArrayProvider(LocalProvider):
+    """
+    Imagery from in-memory arrays.
+
+    Parameters
+    ----------
+    products: Dict[str, Dict[str, np.ndarray]]
+        Arrays per product and band name. A rows x cols array is a single
+        image, a scenes x rows x cols array holds one image per scene, which
+        are mosaicked with later scenes on top.
+    scenes: Optional[Dict[str, List[Dict]]]
+        Properties of the scenes of each product, e.g. with an "acquired"
+        date used to filter by ``start_datetime`` and ``end_datetime``. By
+        default scenes are numbered.
+    """
+
+    def __init__(
+        self,
+        products: Dict[str, Dict[str, np.ndarray]],
+        scenes: Optional[Dict[str, List[Dict]]] = None,
+    ):
+        self.products = products
+        self.scenes = scenes or {}
+
+    def _stack(self, product_id: str, bands: List[str], aoi) -> np.ma.MaskedArray:
+        try:
+            arrays = [np.ma.asarray(self.products[product_id][band]) for band in bands]
+        except KeyError as e:
+            raise KeyError(f"No array for {e} of product {product_id}") from None
+        # scenes x bands x rows x cols
+        data = np.ma.stack([a if a.ndim == 3 else a[np.newaxis] for a in arrays], 1)
+        if data.shape[-2:] != _aoi_shape(aoi):
+            raise ValueError(
+                f"Arrays of {product_id} have shape {data.shape[-2:]}, "
+                f"the AOI has shape {_aoi_shape(aoi)}"
+            )
+        return np.ma.masked_array(data.data, np.ma.getmaskarray(data))
+
+    def _all_scenes(self, product_id: str) -> List[Dict]:
+        scenes = self.scenes.get(product_id)
+        if scenes is None:
+            arrays = list(self.products[product_id].values())
+            count = len(arrays[0]) if arrays and np.ndim(arrays[0]) == 3 else 1
+            scenes = [{"id": f"{product_id}:{i}"} for i in range(count)]
+        return [
+            dict(scene, product_id=product_id, _index=i)
+            for i, scene in enumerate(scenes)
+        ]
+
+    def mosaic(self, product_id, bands, aoi, **options):
+        stack = self._stack(product_id, bands, aoi)
+        # Take each pixel from the last scene in which it isn't masked
+        data = stack[-1].copy()
+        for scene in stack[-2::-1]:
+            missing = np.ma.getmaskarray(data)
+            data[missing] = scene[missing]
+        properties = {
+            "product_id": product_id,
+            "bands": list(bands),
+            "pad": options.get("pad") or 0,
+        }
+        return data, properties
+
+    def select_scenes(self, product_id, bands, aoi, **options):
+        start = _parse_datetime(options.get("start_datetime"))
+        end = _parse_datetime(options.get("end_datetime"))
+        selected = []
+        for scene in self._all_scenes(product_id):
+            acquired = _parse_datetime(scene.get("acquired"))
+            if acquired is not None and (
+                (start is not None and acquired < start)
+                or (end is not None and acquired >= end)
+            ):
+                continue
+            selected.append(scene)
+        return selected
+
+    def from_image_ids(self, ids, bands, aoi, **options):
+        scenes = {
+            scene["id"]: scene
+            for product_id in self.products
+            for scene in self._all_scenes(product_id)
+        }
+        missing = [image_id for image_id in ids if image_id not in scenes]
+        if missing:
+            raise KeyError(f"No scenes with ids {missing}")
+        return self.stack_scenes(
+            [scenes[image_id] for image_id in ids], bands, aoi, **options
+        )
+
+    def stack_scenes(self, scenes, bands, aoi, **options):
+        if not scenes:
+            return np.ma.masked_array(np.zeros((0, len(bands)) + _aoi_shape(aoi))), []
+        product_id = scenes[0]["product_id"]
+        stack = self._stack(product_id, bands, aoi)
+        data = stack[[scene["_index"] for scene in scenes]]
+        properties = [
+            dict(
+                {k: v for k, v in scene.items() if k != "_index"},
+                bands=list(bands),
+                pad=options.get("pad") or 0,
+            )
+            for scene in scenes
+        ]
+        return data, properties
+
+
+def _unwrap(obj: Any) -> Tuple[Any, Properties]:
+    if isinstance(obj, LocalRaster):
+        return obj.ndarray, obj.properties
+    return obj, {}
+
+
+def _align(value: Any, raster: np.ndarray) -> Any:
+    # Numpy arrays combined with rasters are per band
+    if isinstance(value, np.ndarray) and value.ndim == 1 and raster.ndim >= 3:
+        return value.reshape(-1, 1, 1)
+    return value
+
+
+def _gradient(data: np.ma.MaskedArray, axis: int) -> np.ma.MaskedArray:
+    data = np.ma.asarray(data)
+    if data.shape[axis] < 2:
+        gradient = np.zeros(data.shape)
+    else:
+        gradient = np.gradient(np.ma.getdata(data).astype(float), axis=axis)
+    # A gradient is masked where it depends on a masked pixel
+    mask = np.ma.getmaskarray(data)
+    grown = mask.copy()
+    lower = [slice(None)] * data.ndim
+    upper = [slice(None)] * data.ndim
+    lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+    grown[tuple(lower)] |= mask[tuple(upper)]
+    grown[tuple(upper)] |= mask[tuple(lower)]
+    return np.ma.masked_array(gradient, grown)
+
+
+def _windows(
+    data: np.ma.MaskedArray, shape: Tuple[int, int], fill: Any
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Views of the rows x cols windows centred on each pixel, edges are extended
+    ky, kx = shape
+    pad = [(0, 0)] * (data.ndim - 2) + [
+        (ky // 2, ky - 1 - ky // 2),
+        (kx // 2, kx - 1 - kx // 2),
+    ]
+    values = np.pad(np.ma.filled(data, fill), pad, mode="edge")
+    mask = np.pad(np.ma.getmaskarray(data), pad, mode="edge")
+    return (
+        sliding_window_view(values, shape, axis=(-2, -1)),
+        sliding_window_view(mask, shape, axis=(-2, -1)),
+    )
+
+
+def _resample_kernel(kernel: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    rows = (np.arange(shape[0]) + 0.5) * kernel.shape[0] / shape[0]
+    cols = (np.arange(shape[1]) + 0.5) * kernel.shape[1] / shape[1]
+    resampled = kernel[rows.astype(int)][:, cols.astype(int)]
+    return resampled * (kernel.sum() / resampled.sum())
+
+
+class LocalEvaluator:
+    """
+    Evaluate grafts in process, with imagery from a `LocalProvider`.
+
+    Parameters
+    ----------
+    provider: Optional[LocalProvider]
+        Source of imagery, by default a `SyntheticProvider`.
+    """
+
+    def __init__(self, provider: Optional[LocalProvider] = None):
+        self.provider = provider if provider is not None else SyntheticProvider()
+
+    def builtins(self, aoi: eo.geo.AOI) -> Dict[str, Callable]:
+        """
+        The builtins for evaluating a graft over an AOI.
+
+        Parameters
+        ----------
+        aoi: eo.geo.AOI
+            AOI being evaluated
+
+        Returns
+        -------
+        builtins: Dict[str, Callable]
+        """
+        provider = self.provider
+        res_x, res_y = _aoi_resolution(aoi)
+
+        def mosaic(product_id, bands, **options):
+            data, properties = provider.mosaic(
+                product_id, _format_bands(bands), aoi, **options
+            )
+            return LocalRaster(data, properties)
+
+        def select_scenes(product_id, bands, **options):
+            return provider.select_scenes(
+                product_id, _format_bands(bands), aoi, **options
+            )
+
+        def stack_scenes(scenes, bands, **options):
+            data, properties = provider.stack_scenes(
+                scenes, _format_bands(bands), aoi, **options
+            )
+            return LocalRaster(data, ColumnarProperties.from_records(properties))
+
+        def from_image_ids(ids, bands, **options):
+            data, properties = provider.from_image_ids(
+                list(ids), _format_bands(bands), aoi, **options
+            )
+            return LocalRaster(data, ColumnarProperties.from_records(properties))
+
+        def unsupported(name):
+            def builtin(*args, **kwargs):
+                raise NotImplementedError(f"{name} can't be evaluated locally")
+
+            return builtin
+
+        builtins = {
+            "mosaic": mosaic,
+            "select_scenes": select_scenes,
+            "stack_scenes": stack_scenes,
+            "from_image_ids": from_image_ids,
+            "filter_by_id": _filter_by_id,
+            "array": _array,
+            "math": _math,
+            "functional": _functional,
+            "reduction": _reduction,
+            "clip": _clip,
+            "filled": _filled,
+            "mask": _mask,
+            "band_op": _band_op,
+            "index": _index,
+            "length": _length,
+            "dot": _dot,
+            "convolve": _convolve,
+            "morphology": _morphology,
+            "resolution_x": lambda: res_x,
+            "resolution_y": lambda: res_y,
+        }
+        for name in (
+            "code",
+            "groupby",
+            "filter_data",
+            "groupby_data",
+            "mask_by_vector",
+            "rasterization",
+        ):
+            builtins[name] = unsupported(name)
+        return builtins
+
+    @tracing.traced("local_evaluate")
+    def evaluate(
+        self, graft: Dict, aoi: eo.geo.AOI, debug=False, **parameters
+    ) -> Tuple[Any, Properties]:
+        """
+        Evaluate a graft over an AOI.
+
+        Parameters
+        ----------
+        graft: Dict
+            Graft to evaluate
+        aoi: eo.geo.AOI
+            AOI to evaluate the graft over
+        debug: bool, callable, or list of callables
+            Profile the evaluation, see `interpret`
+        **parameters:
+            Values of the graft's parameters
+
+        Returns
+        -------
+        result: Tuple[Any, Union[Dict, List[Dict]]]
+            The value and properties, as from `operations.compute_aoi`
+        """
+        # Cache ids are for the server, not arguments of the builtins
+        graft = graft_client.unset_all_cache_ids(dict(graft))
+        result = interpret(graft, self.builtins(aoi), debug=debug)(**parameters)
+        if isinstance(result, list) and all(isinstance(s, dict) for s in result):
+            # Selected scenes
+            return None, result
+        value, properties = _unwrap(result)
+        if isinstance(properties, ColumnarProperties):
+            properties = properties.to_records()
+        return value, properties
+
+
+def evaluate_local(
+    graft: Dict,
+    aoi: eo.geo.AOI,
+    provider: Optional[LocalProvider] = None,
+    debug=False,
+    **parameters,
+) -> Tuple[Any, Properties]:
+    """
+    Evaluate a graft in process, see `LocalEvaluator`.
+
+    Parameters
+    ----------
+    graft: Dict
+        Graft to evaluate
+    aoi: eo.geo.AOI
+        AOI to evaluate the graft over
+    provider: Optional[LocalProvider]
+        Source of imagery, by default a `SyntheticProvider`
+    debug: bool, callable, or list of callables
+        Profile the evaluation, see `interpret`
+    **parameters:
+        Values of the graft's parameters
+
+    Returns
+    -------
+    result: Tuple[Any, Union[Dict, List[Dict]]]
+        The value and properties
+    """
+    return LocalEvaluator(provider).evaluate(graft, aoi, debug=debug, **parameters)
+
+
+#
+# Builtins
+#
+
+
+def _with_key(properties: Properties, key: str, value: Any) -> Properties:
+    # A copy of the properties with a key set for a Mosaic or every scene
+    properties = deepcopy(properties)
+    if isinstance(properties, ColumnarProperties):
+        properties.set_constant(key, value)
+    else:
+        properties[key] = value
+    return properties
+
+
+def _array(encoded: str) -> np.ndarray:
+    return np.load(BytesIO(base64.b64decode(encoded)))
+
+
+def _filter_by_id(obj, id_list: str):
+    ids = set(json.loads(id_list))
+    if isinstance(obj, LocalRaster):
+        keep = np.isin(obj.properties.column("id"), list(ids))
+        return LocalRaster(obj.ndarray[keep], obj.properties.take(keep))
+    return [scene for scene in obj if scene.get("id") in ids]
+
+
+def _math(operation: str, main_obj, other_obj=None) -> LocalRaster:
+    main, main_properties = _unwrap(main_obj)
+
+    if operation in ("_abs", "neg", "invert", "gradient_x", "gradient_y"):
+        if operation == "gradient_x":
+            value = _gradient(main, -1)
+        elif operation == "gradient_y":
+            value = _gradient(main, -2)
+        else:
+            value = {"_abs": abs, "neg": operator.neg, "invert": operator.invert}[
+                operation
+            ](main)
+        return LocalRaster(value, deepcopy(main_properties))
+
+    other, other_properties = _unwrap(other_obj)
+    if isinstance(main_obj, LocalRaster):
+        other = _align(other, main)
+    elif isinstance(other_obj, LocalRaster):
+        main = _align(main, other)
+    if operation in _REFLECTED_OPS:
+        name = _REFLECTED_OPS[operation]
+        value = _BINARY_OPS[name](other, main)
+        properties = _default_property_propagation(
+            other_properties, main_properties, "same", name
+        )
+    elif operation in _BINARY_OPS:
+        value = _BINARY_OPS[operation](main, other)
+        properties = _default_property_propagation(
+            main_properties, other_properties, "same", operation
+        )
+    else:
+        raise NotImplementedError(f"Math operation {operation} isn't supported")
+    return LocalRaster(np.ma.asarray(value), properties)
+
+
+def _functional(obj, operation: str) -> LocalRaster:
+    if operation not in _FUNCTIONAL_OPS:
+        raise NotImplementedError(f"Function {operation} isn't supported")
+    value, properties = _unwrap(obj)
+    return LocalRaster(getattr(np.ma, operation)(value), deepcopy(properties))
+
+
+def _reduction(obj, reducer: str, axis: Optional[str], obj_type_str: str):
+    if reducer not in _REDUCERS:
+        raise NotImplementedError(f"Reducer {reducer} can't be evaluated locally")
+    value, properties = _unwrap(obj)
+    reduce = getattr(np.ma, reducer)
+
+    if axis is None:
+        return reduce(value)
+
+    if axis == "bands":
+        reduced = reduce(value, axis=-3, keepdims=True)
+        return LocalRaster(
+            np.ma.asarray(reduced), _with_key(properties, "bands", [reducer])
+        )
+
+    if axis == "images":
+        reduced = reduce(value, axis=0)
+        properties = {k: properties[0][k] for k in keys_with_fixed_values(properties)}
+        return LocalRaster(np.ma.asarray(reduced), properties)
+
+    if axis == "pixels":
+        if reducer in ("argmax", "argmin"):
+            raise NotImplementedError(f"{reducer} reduction over pixels not supported")
+        reduced = reduce(value, axis=(-2, -1), keepdims=True)
+        return LocalRaster(np.ma.asarray(reduced), deepcopy(properties))
+
+    raise ValueError(f"Unknown reduction axis {axis}")
+
+
+def _clip(obj, lo, hi) -> LocalRaster:
+    value, properties = _unwrap(obj)
+    return LocalRaster(np.ma.clip(value, lo, hi), deepcopy(properties))
+
+
+def _filled(obj, fill_val) -> LocalRaster:
+    value, properties = _unwrap(obj)
+    return LocalRaster(
+        np.ma.masked_array(np.ma.filled(value, fill_val), False), deepcopy(properties)
+    )
+
+
+def _mask(data_obj, mask_obj) -> LocalRaster:
+    data, properties = _unwrap(data_obj)
+    mask, _ = _unwrap(mask_obj)
+    # Masked pixels of the mask also mask the data
+    mask = np.asarray(np.ma.filled(mask, True), dtype=bool)
+    masked = adaptive_mask(mask, np.ma.masked_array(data, copy=True))
+    return LocalRaster(masked, deepcopy(properties))
+
+
+def _band_op(main_obj, operation: str, bands=None, other_obj=None) -> LocalRaster:
+    value, properties = _unwrap(main_obj)
+
+    if operation == "concat_bands":
+        other, other_properties = _unwrap(other_obj)
+        return LocalRaster(
+            np.ma.concatenate([value, other], axis=-3),
+            _default_property_propagation(properties, other_properties, "concat"),
+        )
+
+    bands = json.loads(bands) if isinstance(bands, str) else list(bands)
+
+    if operation == "pick_bands":
+        current = _get_pid_bands_pad(properties)[1] or []
+        missing = [band for band in bands if band not in current]
+        if missing:
+            raise ValueError(f"Bands {missing} are not among {current}")
+        value = value[..., [current.index(band) for band in bands], :, :]
+    elif operation == "rename_bands":
+        if value.shape[-3] != len(bands):
+            raise ValueError(
+                f"Cannot rename {value.shape[-3]} bands with {len(bands)} names"
+            )
+    else:
+        raise NotImplementedError(f"Band operation {operation} isn't supported")
+
+    return LocalRaster(value, _with_key(properties, "bands", bands))
+
+
+def _index(arr, idx: int) -> LocalRaster:
+    value, properties = _unwrap(arr)
+    return LocalRaster(value[idx], deepcopy(properties[idx]))
+
+
+def _length(image_stack) -> int:
+    value, properties = _unwrap(image_stack)
+    return len(properties) if isinstance(properties, list) else len(value)
+
+
+# einsum signatures by operand types, with the number of dimensions of arrays
+_DOT_SIGNATURES = {
+    ("Mosaic", "ndarray", 1): "bij,b->ij",
+    ("Mosaic", "ndarray", 2): "bij,bm->mij",
+    ("ndarray", "Mosaic", 1): "b,bij->ij",
+    ("ndarray", "Mosaic", 2): "mb,bij->mij",
+    ("Mosaic", "Mosaic", None): "bij,bij->ij",
+    ("ImageStack", "ndarray", 1): "nbij,n->bij",
+    ("ImageStack", "ndarray", 2): "nbij,nm->mbij",
+    ("ndarray", "ImageStack", 1): "n,nbij->bij",
+    ("ndarray", "ImageStack", 2): "mn,nbij->mbij",
+    ("ImageStack", "ImageStack", None): "nbij,nbij->bij",
+}
+
+
+def _dot(op1, op2, type1: str, type2: str) -> LocalRaster:
+    a, properties_a = _unwrap(op1)
+    b, properties_b = _unwrap(op2)
+
+    matrix = a if type1 == "ndarray" else b if type2 == "ndarray" else None
+    ndim = None if matrix is None else np.ndim(matrix)
+    try:
+        signature = _DOT_SIGNATURES[(type1, type2, ndim)]
+    except KeyError:
+        raise NotImplementedError(f"dot not implemented for {type1}, {type2}") from None
+
+    product = np.ma.asarray(masked_einsum(signature, a, b))
+    if signature.endswith("->ij"):
+        # Keep the band axis of a Mosaic
+        product = product[np.newaxis]
+
+    if "ImageStack" not in (type1, type2):
+        properties = property_propagation_for_dot(properties_a, properties_b)
+    elif type1 == type2:
+        properties = dot_propagation_for_two_image_stacks(properties_a, properties_b)
+    elif ndim == 1:
+        stack_properties = properties_a if type1 == "ImageStack" else properties_b
+        properties = dot_property_propagation_for_image_stack_and_matrix(
+            stack_properties, 1
+        )[0]
+    else:
+        stack_properties = properties_a if type1 == "ImageStack" else properties_b
+        properties = dot_property_propagation_for_image_stack_and_matrix(
+            stack_properties, len(product)
+        )
+    return LocalRaster(product, deepcopy(properties))
+
+
+def _convolve(
+    graft, knl, size_x=None, size_y=None, res_x=None, res_y=None
+) -> LocalRaster:
+    value, properties = _unwrap(graft)
+    kernel = np.asarray(_unwrap(knl)[0], dtype=float)
+
+    if size_x and size_y and res_x and res_y:
+        shape = (
+            max(1, int(round(size_y / res_y))),
+            max(1, int(round(size_x / res_x))),
+        )
+        kernel = _resample_kernel(kernel, shape)
+
+    windows, masks = _windows(np.ma.asarray(value), kernel.shape, 0)
+    # A convolution flips the kernel
+    convolved = np.einsum("...kl,kl->...", windows, kernel[::-1, ::-1])
+    return LocalRaster(
+        np.ma.masked_array(convolved, masks.any(axis=(-2, -1))), deepcopy(properties)
+    )
+
+
+def _morphology(graft, method: str, size, res_x=None, res_y=None) -> LocalRaster:
+    value, properties = _unwrap(graft)
+    value = np.ma.asarray(value)
+
+    if res_x and res_y:
+        shape = (max(1, int(round(size / res_y))), max(1, int(round(size / res_x))))
+    else:
+        shape = (max(1, int(round(size))),) * 2
+
+    if method == "erosion":
+        reduce, fill = np.min, _extreme(value.dtype, np.inf)
+    elif method == "dilation":
+        reduce, fill = np.max, _extreme(value.dtype, -np.inf)
+    else:
+        raise NotImplementedError(f"Morphological operation {method} isn't supported")
+
+    # Masked pixels are ignored, windows that are entirely masked are masked
+    windows, masks = _windows(value, shape, fill)
+    return LocalRaster(
+        np.ma.masked_array(
+            reduce(windows, axis=(-2, -1)), masks.all(axis=(-2, -1))
+        ),
+        deepcopy(properties),
+    )
+
+
+def _extreme(dtype: np.dtype, infinity: float):
+    if dtype.kind == "f":
+        return infinity
+    if dtype.kind == "b":
+        return infinity > 0
+    info = np.iinfo(dtype)
+    return info.max if infinity > 0 else info.min
@@ -0,0 +1,366 @@
+"""Out-of-core materialisation of long ImageStacks.
+
+Computing an ImageStack returns a single scenes x bands x rows x cols masked
+array, which has to fit in memory and arrive in a single response.
+`StackMaterializer` instead partitions the stack, either into groups of a fixed
+number of images or into date windows, computes the partitions concurrently and
+writes each into its place in arrays on disk:
+
+* ``data.npy``, the data, memory mapped,
+* ``mask.npy``, the mask packed to one bit per pixel along the columns,
+* ``properties.json``, the properties of each image, in order.
+
+Only a few partitions are held in memory at a time. The result is a
+`MaterializedStack`, which can be reopened later with `MaterializedStack.open`.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from earthdaily.earthone.geo import AOI
+
+from . import tracing
+from .chunked_reduction import restrict_dates, stack_windows
+
+if TYPE_CHECKING:
+    from .compute_map import ComputeMap
+    from .image_stack import ImageStack
+
+# Number of partitions computed concurrently
+MATERIALIZE_MAX_WORKERS = int(
+    os.environ.get("DYNAMIC_COMPUTE_MATERIALIZE_MAX_WORKERS", 4)
+)
+
+DATA_FILE = "data.npy"
+MASK_FILE = "mask.npy"
+PROPERTIES_FILE = "properties.json"
+
+
+class MaterializedStack:
+    """
+    An ImageStack computed to arrays on disk, see `StackMaterializer`.
+
+    Parameters
+    ----------
+    directory: str
+        Directory holding the arrays
+    data: np.ndarray
+        Scenes x bands x rows x cols data, usually memory mapped
+    packed_mask: np.ndarray
+        The mask, packed along the columns with `np.packbits`
+    properties: Union[List[Dict], Dict]
+        Properties of each image, or of the array for one saved with `save`
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        data: np.ndarray,
+        packed_mask: np.ndarray,
+        properties: Union[List[Dict], Dict],
+    ):
+        self.directory = directory
+        self.data = data
+        self.packed_mask = packed_mask
+        self.properties = properties
+
+    @classmethod
+    def open(cls, directory: str, mode: str = "r") -> MaterializedStack:
+        """
+        Open a materialized stack.
+
+        Parameters
+        ----------
+        directory: str
+            Directory the stack was materialized to
+        mode: str
+            Mode to memory map the arrays with, see `np.load`
+
+        Returns
+        -------
+        stack: MaterializedStack
+        """
+        with open(os.path.join(directory, PROPERTIES_FILE)) as f:
+            properties = json.load(f)
+        return cls(
+            directory,
+            np.load(os.path.join(directory, DATA_FILE), mmap_mode=mode),
+            np.load(os.path.join(directory, MASK_FILE), mmap_mode=mode),
+            properties,
+        )
+
+    @classmethod
+    def save(
+        cls,
+        directory: str,
+        value: np.ndarray,
+        properties: Union[List[Dict], Dict],
+    ) -> MaterializedStack:
+        """
+        Write a computed array and its properties to a directory, and reopen
+        them memory mapped.
+
+        Parameters
+        ----------
+        directory: str
+            Directory to write the arrays to, created if it doesn't exist
+        value: np.ndarray
+            The array, masked or not
+        properties: Union[List[Dict], Dict]
+            Its properties
+
+        Returns
+        -------
+        stack: MaterializedStack
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, DATA_FILE), np.ma.getdata(value))
+        np.save(
+            os.path.join(directory, MASK_FILE),
+            np.packbits(np.ma.getmaskarray(value), axis=-1),
+        )
+        with open(os.path.join(directory, PROPERTIES_FILE), "w") as f:
+            json.dump(properties, f, default=str)
+        return cls.open(directory)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Scenes x bands x rows x cols"""
+        return self.data.shape
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def mask(self, index: Any = slice(None)) -> np.ndarray:
+        """
+        The unpacked mask of some images.
+
+        Parameters
+        ----------
+        index: Any
+            Index, slice or indices of the images
+
+        Returns
+        -------
+        mask: np.ndarray
+        """
+        return np.unpackbits(
+            self.packed_mask[index], axis=-1, count=self.shape[-1]
+        ).astype(bool)
+
+    def __getitem__(self, index: Any) -> np.ma.MaskedArray:
+        # Images are read from disk only when indexed
+        return np.ma.masked_array(np.asarray(self.data[index]), self.mask(index))
+
+    def __repr__(self) -> str:
+        return (
+            f"MaterializedStack({self.directory!r}, shape={self.shape}, "
+            f"dtype={self.data.dtype})"
+        )
+
+
+class StackMaterializer:
+    """
+    Computes an ImageStack in partitions into arrays on disk, see
+    `ImageStack.materialize`.
+
+    Parameters
+    ----------
+    image_stack: ImageStack
+        The stack to compute
+    partition: Union[int, str, datetime.timedelta]
+        Partition the stack into groups of this many images, in order, or, with
+        a timedelta or a pandas frequency, e.g. "90D", into date windows
+    start_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        Start of the range for date windows, by default that of the stack
+    end_datetime: Optional[Union[str, datetime.date, datetime.datetime]]
+        End of the range for date windows, by default that of the stack
+    max_workers: Optional[int]
+        Maximum number of partitions computed concurrently
+    """
+
+    def __init__(
+        self,
+        image_stack: ImageStack,
+        partition: Union[int, str, datetime.timedelta] = 256,
+        start_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        end_datetime: Optional[Union[str, datetime.date, datetime.datetime]] = None,
+        max_workers: Optional[int] = None,
+    ):
+        if isinstance(partition, int) and partition < 1:
+            raise ValueError(
+                f"Partitions must hold at least one image, not {partition}"
+            )
+
+        self.image_stack = image_stack
+        self.partition = partition
+        self.windows = (
+            None
+            if isinstance(partition, int)
+            else stack_windows(image_stack, partition, start_datetime, end_datetime)
+        )
+        self.max_workers = max_workers or MATERIALIZE_MAX_WORKERS
+
+    def _partitions(
+        self, evaluate: Callable[[ComputeMap], Any], workers: int
+    ) -> List[Tuple[ImageStack, int]]:
+        """The partitions and their numbers of images, from the stack's metadata"""
+        if self.windows is None:
+            properties = evaluate(self.image_stack.properties)
+            ids = [image["id"] for image in properties]
+            return [
+                (
+                    self.image_stack.filter_by_id(ids[i : i + self.partition]),
+                    len(ids[i : i + self.partition]),
+                )
+                for i in range(0, len(ids), self.partition)
+            ]
+
+        stacks = [restrict_dates(self.image_stack, *window) for window in self.windows]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            counts = list(
+                executor.map(
+                    tracing.propagate(lambda stack: len(evaluate(stack.properties))),
+                    stacks,
+                )
+            )
+        return [(stack, count) for stack, count in zip(stacks, counts) if count]
+
+    @tracing.traced("materialize")
+    def _materialize(
+        self,
+        evaluate: Callable[[ComputeMap], Any],
+        directory: str,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+    ) -> MaterializedStack:
+        os.makedirs(directory, exist_ok=True)
+        workers = max(1, self.max_workers)
+        partitions = self._partitions(evaluate, workers)
+        if not partitions:
+            raise ValueError("The ImageStack has no images")
+
+        offsets = np.cumsum([0] + [count for _, count in partitions])
+        total = int(offsets[-1])
+        properties: List[Optional[List[Dict]]] = [None] * len(partitions)
+        arrays: Dict[str, np.ndarray] = {}
+        lock = threading.Lock()
+
+        def allocate(value: np.ndarray):
+            # The shape and type of the images are only known from a result
+            with lock:
+                if arrays:
+                    return
+                shape = (total,) + value.shape[1:]
+                arrays["data"] = np.lib.format.open_memmap(
+                    os.path.join(directory, DATA_FILE),
+                    mode="w+",
+                    dtype=np.dtype(dtype) if dtype is not None else value.dtype,
+                    shape=shape,
+                )
+                arrays["mask"] = np.lib.format.open_memmap(
+                    os.path.join(directory, MASK_FILE),
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=shape[:-1] + ((shape[-1] + 7) // 8,),
+                )
+
+        def run(index: int):
+            stack, count = partitions[index]
+            result = evaluate(stack)
+            value, partition_properties = result["ndarray"], result["properties"]
+            if len(value) != count:
+                raise RuntimeError(
+                    f"Partition {index} has {len(value)} images, "
+                    f"its metadata listed {count}"
+                )
+
+            allocate(value)
+            start, end = offsets[index], offsets[index + 1]
+            arrays["data"][start:end] = np.ma.getdata(value)
+            arrays["mask"][start:end] = np.packbits(np.ma.getmaskarray(value), axis=-1)
+            properties[index] = list(partition_properties)
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(partitions))) as executor:
+            list(executor.map(tracing.propagate(run), range(len(partitions))))
+
+        for array in arrays.values():
+            array.flush()
+        merged = [image for partition in properties for image in partition]
+        with open(os.path.join(directory, PROPERTIES_FILE), "w") as f:
+            json.dump(merged, f, default=str)
+
+        return MaterializedStack(directory, arrays["data"], arrays["mask"], merged)
+
+    def compute(
+        self,
+        aoi: AOI,
+        directory: str,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+        **kwargs,
+    ) -> MaterializedStack:
+        """
+        Compute the stack for an AOI into a directory.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.GeoContext
+            GeoContext for which to compute the stack
+        directory: str
+            Directory to write the arrays to, created if it doesn't exist
+        dtype: Optional[Union[str, np.dtype, type]]
+            Data type to cast the images to, by the server before transfer
+        **kwargs:
+            Further arguments of `ComputeMap.compute`, e.g. parameter values
+
+        Returns
+        -------
+        stack: MaterializedStack
+        """
+        return self._materialize(
+            lambda compute_map: compute_map.compute(aoi, dtype=dtype, **kwargs),
+            directory,
+            dtype,
+        )
+
+    def compute_local(
+        self,
+        aoi: AOI,
+        directory: str,
+        dtype: Optional[Union[str, np.dtype, type]] = None,
+        provider=None,
+        **kwargs,
+    ) -> MaterializedStack:
+        """
+        Compute the stack for an AOI into a directory in process, see `local`.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.GeoContext
+            GeoContext for which to compute the stack
+        directory: str
+            Directory to write the arrays to, created if it doesn't exist
+        dtype: Optional[Union[str, np.dtype, type]]
+            Data type to cast the images to
+        provider: Optional[local.LocalProvider]
+            Source of imagery, by default deterministic synthetic imagery
+        **kwargs:
+            Values of the graft's parameters
+
+        Returns
+        -------
+        stack: MaterializedStack
+        """
+        return self._materialize(
+            lambda compute_map: compute_map.compute_local(
+                aoi, provider=provider, **kwargs
+            ),
+            directory,
+            dtype,
+        )
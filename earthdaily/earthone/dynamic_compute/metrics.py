@@ -0,0 +1,377 @@
+"""Process-wide metrics of requests to the dynamic-compute API.
+
+The library records into a single `MetricsRegistry`, `REGISTRY`:
+
+* ``dynamic_compute_requests_total``, requests by endpoint and status code,
+* ``dynamic_compute_retries_total``, retried requests by endpoint,
+* ``dynamic_compute_hedges_total``, hedged requests by endpoint,
+* ``dynamic_compute_requests_in_flight``, requests being sent or read,
+* ``dynamic_compute_request_seconds``, request latency by endpoint,
+* ``dynamic_compute_request_bytes`` and ``dynamic_compute_response_bytes``,
+  body sizes by endpoint,
+* ``dynamic_compute_phase_seconds``, client-side time by phase: graft, building
+  and fingerprinting grafts, encode, serializing request bodies, read and
+  decode,
+* ``dynamic_compute_cache_requests_total``, cache lookups by cache and result.
+
+Metrics can be exported as a pandas DataFrame with `MetricsRegistry.to_dataframe`,
+in the Prometheus text format with `MetricsRegistry.to_prometheus`, or to any
+callback registered with `MetricsRegistry.add_exporter` whenever
+`MetricsRegistry.export` is called.
+
+Example
+-------
+>>> from earthdaily.earthone.dynamic_compute import metrics
+>>> image.compute(aoi) # doctest: +SKIP
+>>> metrics.REGISTRY.to_dataframe() # doctest: +SKIP
+"""
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    """A monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        """Increase the count"""
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """A value that can go up and down"""
+
+    kind = "gauge"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def set(self, value: float):
+        """Set the value"""
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount: float = 1.0):
+        """Increase the value"""
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        """Decrease the value"""
+        with self._lock:
+            self.value -= amount
+
+
+class Histogram:
+    """
+    A histogram with logarithmically spaced buckets, each `growth` times wider
+    than the previous, so quantiles have a bounded relative error.
+
+    Parameters
+    ----------
+    min_value: float
+        Upper bound of the first bucket
+    growth: float
+        Ratio of the upper bounds of consecutive buckets
+    buckets: int
+        Number of bounded buckets, larger values go into a final unbounded bucket
+    """
+
+    kind = "summary"
+
+    def __init__(
+        self, min_value: float = 1e-3, growth: float = 1.1, buckets: int = 160
+    ):
+        self.min_value = min_value
+        self.growth = growth
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def bucket_bounds(self) -> List[float]:
+        """Upper bounds of the buckets, the last bucket is unbounded"""
+        return [self.min_value * self.growth**i for i in range(self.buckets)] + [
+            float("inf")
+        ]
+
+    def record(self, value: float):
+        """Record a value"""
+        if value <= self.min_value:
+            bucket = 0
+        else:
+            bucket = min(
+                self.buckets,
+                math.ceil(math.log(value / self.min_value, self.growth)),
+            )
+        with self._lock:
+            self._counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        """Record the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - start)
+
+    def counts(self) -> List[int]:
+        """Number of values recorded in each bucket"""
+        with self._lock:
+            return list(self._counts)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile of the recorded values.
+
+        Parameters
+        ----------
+        q: float
+            Quantile to estimate, between 0 and 1
+
+        Returns
+        -------
+        value: Optional[float]
+            Upper bound of the bucket holding the quantile, or None if nothing has
+            been recorded
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            cumulative = 0
+            for bucket, count in enumerate(self._counts):
+                cumulative += count
+                if cumulative >= rank and count:
+                    break
+
+        return self.min_value * self.growth ** min(bucket, self.buckets - 1)
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+@dataclasses.dataclass
+class Sample:
+    """The state of a metric at the time it was collected"""
+
+    name: str
+    kind: str
+    labels: Dict[str, str]
+    value: Optional[float] = None
+    count: Optional[int] = None
+    sum: Optional[float] = None
+    quantiles: Dict[float, Optional[float]] = dataclasses.field(default_factory=dict)
+
+
+class MetricsRegistry:
+    """A collection of named, labelled metrics and the exporters to send them to"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[Tuple[str, Labels], Metric] = {}
+        self._descriptions: Dict[str, str] = {}
+        self._exporters: List[Callable[[List[Sample]], None]] = []
+
+    def _get(self, cls, name: str, description: str, labels: Dict, **kwargs):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(**kwargs)
+                if description:
+                    self._descriptions.setdefault(name, description)
+            elif not isinstance(metric, cls):
+                raise TypeError(f"Metric {name} is a {metric.kind}, not a {cls.kind}")
+        return metric
+
+    def counter(self, name: str, description: str = "", **labels) -> Counter:
+        """Get or create the counter with a name and labels"""
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str = "", **labels) -> Gauge:
+        """Get or create the gauge with a name and labels"""
+        return self._get(Gauge, name, description, labels)
+
+    def histogram(
+        self,
+        name: str,
+        description: str = "",
+        min_value: float = 1e-3,
+        growth: float = 1.1,
+        buckets: int = 160,
+        **labels,
+    ) -> Histogram:
+        """Get or create the histogram with a name and labels"""
+        return self._get(
+            Histogram,
+            name,
+            description,
+            labels,
+            min_value=min_value,
+            growth=growth,
+            buckets=buckets,
+        )
+
+    def collect(self) -> List[Sample]:
+        """Collect the current state of every metric"""
+        with self._lock:
+            metrics = list(self._metrics.items())
+
+        samples = []
+        for (name, labels), metric in sorted(metrics, key=lambda item: item[0]):
+            sample = Sample(name=name, kind=metric.kind, labels=dict(labels))
+            if isinstance(metric, Histogram):
+                sample.count = metric.count
+                sample.sum = metric.sum
+                sample.quantiles = {q: metric.quantile(q) for q in QUANTILES}
+            else:
+                sample.value = metric.value
+            samples.append(sample)
+        return samples
+
+    def reset(self):
+        """Remove every metric"""
+        with self._lock:
+            self._metrics.clear()
+
+    def add_exporter(self, exporter: Callable[[List[Sample]], None]):
+        """Register a callback to receive the collected samples on `export`"""
+        self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter: Callable[[List[Sample]], None]):
+        """Unregister a callback added with `add_exporter`"""
+        self._exporters.remove(exporter)
+
+    def export(self):
+        """Collect the metrics and pass them to every registered exporter"""
+        samples = self.collect()
+        for exporter in list(self._exporters):
+            exporter(samples)
+
+    def to_dataframe(self):
+        """
+        Snapshot the metrics as a pandas DataFrame, with a row per metric and label
+        set, and columns for the labels, value, count, sum and quantiles.
+        """
+        import pandas as pd
+
+        rows = []
+        for sample in self.collect():
+            row = {"name": sample.name, "kind": sample.kind, **sample.labels}
+            row["value"] = sample.value
+            row["count"] = sample.count
+            row["sum"] = sample.sum
+            for q, value in sample.quantiles.items():
+                row[f"p{q * 100:g}"] = value
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+
+        def format_labels(labels: Dict[str, str], **extra) -> str:
+            labels = {**labels, **extra}
+            if not labels:
+                return ""
+            pairs = (
+                '{}="{}"'.format(
+                    k,
+                    str(v)
+                    .replace("\\", "\\\\")
+                    .replace('"', '\\"')
+                    .replace("\n", "\\n"),
+                )
+                for k, v in sorted(labels.items())
+            )
+            return "{" + ",".join(pairs) + "}"
+
+        lines = []
+        seen = set()
+        for sample in self.collect():
+            if sample.name not in seen:
+                seen.add(sample.name)
+                description = self._descriptions.get(sample.name)
+                if description:
+                    lines.append(f"# HELP {sample.name} {description}")
+                lines.append(f"# TYPE {sample.name} {sample.kind}")
+
+            if sample.kind != "summary":
+                labels = format_labels(sample.labels)
+                lines.append(f"{sample.name}{labels} {sample.value}")
+                continue
+
+            for q, value in sample.quantiles.items():
+                value = "NaN" if value is None else value
+                labels = format_labels(sample.labels, quantile=f"{q:g}")
+                lines.append(f"{sample.name}{labels} {value}")
+            labels = format_labels(sample.labels)
+            lines.append(f"{sample.name}_sum{labels} {sample.sum}")
+            lines.append(f"{sample.name}_count{labels} {sample.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        Atomically write the metrics in the Prometheus text format to a file, e.g.
+        for the node exporter's textfile collector.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.to_prometheus())
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, description: str = "", **labels) -> Counter:
+    """Get or create a counter in the default registry"""
+    return REGISTRY.counter(name, description, **labels)
+
+
+def gauge(name: str, description: str = "", **labels) -> Gauge:
+    """Get or create a gauge in the default registry"""
+    return REGISTRY.gauge(name, description, **labels)
+
+
+def histogram(name: str, description: str = "", **kwargs) -> Histogram:
+    """Get or create a histogram in the default registry"""
+    return REGISTRY.histogram(name, description, **kwargs)
+
+
+def byte_histogram(name: str, description: str = "", **labels) -> Histogram:
+    """Get or create a histogram of sizes in bytes, from 1 byte to about 10 TB"""
+    return REGISTRY.histogram(
+        name, description, min_value=1.0, growth=1.1, buckets=320, **labels
+    )
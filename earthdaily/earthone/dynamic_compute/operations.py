@@ -2,10 +2,10 @@ import base64
 import copy
 import functools
 import hashlib
-import io
 import json
 import os
-import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from importlib.metadata import version
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
@@ -18,6 +18,14 @@ import ipyleaflet  # type: ignore
 import numpy as np
 import requests
 
+from . import (
+    result_cache,
+    result_format,
+    spatial_cache,
+    tracing,
+    transport,
+)
+from .columnar import ColumnarProperties
 from .eo_utils import add_bearer
 from .graft import client as graft_client
 from .pyversions import PythonVersion
@@ -28,6 +36,10 @@ API_HOST = os.getenv(
 
 SINGLE_POINT_BUFFER_VALUE = 0.0000001
 WGS84_CRS = "EPSG:4326"
+
+# Operations whose results are derived from scene metadata alone
+METADATA_OPS = ("length", "groupby_data")
+
 _python_major_minor_version = PythonVersion.from_sys().major_minor
 
 
@@ -35,6 +47,14 @@ class UnauthorizedUserError(requests.exceptions.HTTPError):
     """Raised when a user does not have the dynamic-compute-user group"""
 
 
+def _apply_graft(function: Union[str, Dict], *args, **kwargs) -> Dict:
+    """Build the graft of a function application, see `graft.client.apply_graft`,
+    traced as graft construction."""
+    op = function if isinstance(function, str) else "graft"
+    with tracing.span("apply_graft", op=op):
+        return graft_client.apply_graft(function, *args, **kwargs)
+
+
 def operation(func: Callable):
     """
     Decorator that defines a Python function as an operation that can be executed as part of a graft.
@@ -43,7 +63,7 @@ def operation(func: Callable):
     @functools.wraps(func)
     def wrapper_operation(*args, **kwargs):
         encoded_func = encode_function(func)
-        graft = graft_client.apply_graft("code", encoded_func, *args, **kwargs)
+        graft = _apply_graft("code", encoded_func, *args, **kwargs)
         return graft
 
     return wrapper_operation
@@ -94,7 +114,7 @@ def _get_pid_bands_pad(
         Padding associated with this properties object if it's available,
         otherwise None
     """
-    if isinstance(properties, List):
+    if isinstance(properties, (list, ColumnarProperties)):
         if len(properties) > 0:
             return _get_pid_bands_pad(properties[0])
         else:
@@ -108,7 +128,7 @@ def _get_pid_bands_pad(
 
 
 def _index(idx, arr, **kwargs):
-    return graft_client.apply_graft(
+    return _apply_graft(
         "index",
         arr,
         idx,
@@ -116,7 +136,7 @@ def _index(idx, arr, **kwargs):
 
 
 def _length(image_stack, **kwargs):
-    return graft_client.apply_graft(
+    return _apply_graft(
         "length",
         image_stack,
     )
@@ -215,6 +235,26 @@ def reset_graft(graft: Dict) -> Dict:
     return _normalize_graft(graft, counter=graft_client.guid)
 
 
+@tracing.traced()
+def graft_fingerprint(graft: Dict) -> str:
+    """
+    Compute a fingerprint of a graft that is independent of the keys used in it.
+
+    Parameters
+    ----------
+    graft: Dict
+        Graft to fingerprint
+
+    Returns
+    -------
+    fingerprint: str
+        Hex digest identifying the graft
+    """
+    normalized_graft = _normalize_graft(graft)
+    return hashlib.sha256(bytes(json.dumps(normalized_graft), "utf-8")).hexdigest()
+
+
+@tracing.traced()
 def set_cache_id(graft: Dict, auth=None):
     """Set the cache ID of an operation.
 
@@ -230,12 +270,7 @@ def set_cache_id(graft: Dict, auth=None):
         auth = eo.auth.Auth.get_default_auth()
     org = auth.payload["org"]
 
-    normalized_graft = _normalize_graft(graft)
-    cache_id = (
-        hashlib.sha256(bytes(json.dumps(normalized_graft), "utf-8")).hexdigest()
-        + "-"
-        + org
-    )
+    cache_id = graft_fingerprint(graft) + "-" + org
 
     returned_key = graft["returns"]
     returned_op = graft[returned_key]
@@ -253,6 +288,7 @@ def set_cache_id(graft: Dict, auth=None):
         graft[returned_key].append({"cache_id": key})
 
 
+@tracing.traced()
 def create_layer(
     name: str,
     graft: dict,
@@ -291,29 +327,7 @@ def create_layer(
 
     # Create a layer from the graft
     auth = kwargs.pop("auth", None) or eo.auth.Auth.get_default_auth()
-    response = requests.post(
-        f"{API_HOST}/layers/",
-        headers={"Authorization": add_bearer(auth.token)},
-        json={
-            "graft": graft,
-            "python_version": _python_major_minor_version,
-            "dynamic_compute_version": version("earthdaily-earthone-dynamic-compute"),
-        },
-        timeout=60,
-    )
-
-    try:
-        response.raise_for_status()
-    except Exception as e:
-        if e.response.status_code == 403:
-            raise UnauthorizedUserError(
-                "User does not have access to dynamic-compute. "
-                "If you believe this to be an error, contact support@earthdaily.com"
-            )
-        else:
-            raise e
-
-    layer_id = json.loads(response.content.decode("utf-8"))["layer_id"]
+    layer_id = _register_layer(graft, auth)
 
     # URL encode query parameters
     params = {}
@@ -369,7 +383,7 @@ def create_rasterization(
         A graft whose result is the rasterized catalog product.
     """
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "rasterization",
         product_id,
         columns,
@@ -414,7 +428,7 @@ def create_mosaic(
         A graft who's result is the mosaiced catalog product.
     """
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "mosaic",
         product_id,
         bands,
@@ -430,7 +444,7 @@ def create_mosaic(
 
 def _mask_op(data, mask, **kwargs):
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "mask",
         data,
         mask,
@@ -457,7 +471,7 @@ def _mask_by_vector_op(data, vector, invert: bool = False, **kwargs):
     if not isinstance(vector, str):
         vector = json.dumps(vector)
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "mask_by_vector",
         data,
         vector,
@@ -486,7 +500,7 @@ def _resolution_graft_x() -> dict:
     resolution_graft_x: dict
         Graft that evaluates to resolution_x.
     """
-    return graft_client.apply_graft("resolution_x")
+    return _apply_graft("resolution_x")
 
 
 def _resolution_graft_y() -> dict:
@@ -496,7 +510,7 @@ def _resolution_graft_y() -> dict:
     resolution_graft_y: dict
         Graft that evaluates to resolution_y.
     """
-    return graft_client.apply_graft("resolution_y")
+    return _apply_graft("resolution_y")
 
 
 def _math_op(main_obj, operation, other_obj=None, **kwargs):
@@ -525,7 +539,7 @@ def _math_op(main_obj, operation, other_obj=None, **kwargs):
 
         assert main_pad == other_pad, "Operands have different padding"
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "math",
         operation,
         main_obj,
@@ -550,7 +564,7 @@ def _reduction_op(reducer, axis, obj_type_str, obj, **kwargs):
     graft encoding the reduction
     """
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "reduction",
         obj,
         reducer,
@@ -574,7 +588,7 @@ def _dot_op(op1: dict, op2: dict, type1: str, type2: str) -> dict:
     type2: str
         String of the type of the second operand
     """
-    return graft_client.apply_graft("dot", op1, op2, type1, type2)
+    return _apply_graft("dot", op1, op2, type1, type2)
 
 
 def _func_op(obj, operation, **kwargs):
@@ -591,7 +605,7 @@ def _func_op(obj, operation, **kwargs):
     graft encoding the operation
     """
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "functional",
         obj,
         operation,
@@ -613,7 +627,7 @@ def _clip_data(obj, lo, hi, **kwargs):
     graft encoding the clipping
     """
 
-    return graft_client.apply_graft("clip", obj, lo, hi)
+    return _apply_graft("clip", obj, lo, hi)
 
 
 def _fill_mask(obj, fill_val, **kwargs):
@@ -629,7 +643,7 @@ def _fill_mask(obj, fill_val, **kwargs):
     graft encoding the filling
     """
 
-    return graft_client.apply_graft("filled", obj, fill_val)
+    return _apply_graft("filled", obj, fill_val)
 
 
 def _band_op(main_obj, operation, bands=None, other_obj=None, **kwargs):
@@ -658,7 +672,7 @@ def _band_op(main_obj, operation, bands=None, other_obj=None, **kwargs):
 
         assert main_pad == other_pad, "Operands have different padding"
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "band_op",
         main_obj,
         operation,
@@ -696,7 +710,7 @@ def select_scenes(
     dict
         A graft whose evaluation is an ImageCollection object.
     """
-    return graft_client.apply_graft(
+    return _apply_graft(
         "select_scenes",
         product_id,
         bands,
@@ -738,7 +752,7 @@ def stack_scenes(
         the ImageCollection
 
     """
-    return graft_client.apply_graft(
+    return _apply_graft(
         "stack_scenes", scenes_graft, bands, pad=pad, resampler=resampler
     )
 
@@ -750,7 +764,7 @@ def from_image_ids(
     resampler: eo.catalog.ResampleAlgorithm = eo.catalog.ResampleAlgorithm.NEAR,
 ) -> Dict:
 
-    return graft_client.apply_graft(
+    return _apply_graft(
         "from_image_ids", ids, bands, pad=pad, resampler=resampler
     )
 
@@ -773,7 +787,7 @@ def filter_by_id(stack_graft: Dict, id_list: str) -> Dict:
         Graft, which when evaluated results in an ImageCollection object containing images
         for which the filter function evaluates to true.
     """
-    return graft_client.apply_graft("filter_by_id", stack_graft, id_list)
+    return _apply_graft("filter_by_id", stack_graft, id_list)
 
 
 def filter_data(stack_graft: Dict, encoded_filter_func: str) -> Dict:
@@ -796,49 +810,75 @@ def filter_data(stack_graft: Dict, encoded_filter_func: str) -> Dict:
         Graft, which when evaluated results in an ImageCollection object containing images
         for which the filter function evaluates to true.
     """
-    return graft_client.apply_graft("filter_data", stack_graft, encoded_filter_func)
+    return _apply_graft("filter_data", stack_graft, encoded_filter_func)
 
 
 def gradient_x(graft: Dict):
 
-    return graft_client.apply_graft("math", "gradient_x", graft, None)
+    return _apply_graft("math", "gradient_x", graft, None)
 
 
 def gradient_y(graft: Dict):
 
-    return graft_client.apply_graft("math", "gradient_y", graft, None)
+    return _apply_graft("math", "gradient_y", graft, None)
 
 
 def groupby(scenes_graft: Dict, encoded_key_func: str):
-    return graft_client.apply_graft("groupby_data", scenes_graft, encoded_key_func)
+    return _apply_graft("groupby_data", scenes_graft, encoded_key_func)
 
 
-def compute_aoi(
-    graft: Dict, aoi: eo.geo.AOI, layer_id: str = None, **kwargs
-) -> np.ma.MaskedArray:
-    """Compute an AOI of a layer.
+def _raise_for_status(response: requests.Response):
+    """Raise for an unsuccessful response, distinguishing unauthorized users."""
+    try:
+        response.raise_for_status()
+    except Exception as e:
+        if e.response.status_code == 403:
+            raise UnauthorizedUserError(
+                "User does not have access to dynamic-compute. "
+                "If you believe this to be an error, contact support@earthdaily.com"
+            )
+        else:
+            raise e
 
-    Currently, only rasters are supported.
+
+@tracing.traced("register_layer")
+def _register_layer(graft: Dict, auth) -> str:
+    """Register a graft with the API and return its layer id."""
+
+    def handle(response: requests.Response) -> str:
+        _raise_for_status(response)
+        return json.loads(response.content.decode("utf-8"))["layer_id"]
+
+    return transport.get_transport().post(
+        f"{API_HOST}/layers/",
+        handle,
+        endpoint="layers",
+        headers={"Authorization": add_bearer(auth.token)},
+        json={
+            "graft": graft,
+            "python_version": _python_major_minor_version,
+            "dynamic_compute_version": version("earthdaily-earthone-dynamic-compute"),
+        },
+        timeout=60,
+    )
+
+
+def _normalize_aoi(aoi: eo.geo.AOI) -> Tuple[eo.geo.AOI, Dict]:
+    """
+    Convert a GeoContext to an AOI, and the fields describing it in the body of
+    an ``/aoi`` request.
 
     Parameters
     ----------
-    graft : dict
-        The graft (ie. the directed acyclic graph) that describes how this tile layer should be formed.
     aoi : earthdaily.earthone.geo.GeoContext
-        GeoContext for which to compute evaluate this ComputeMap
-    layer_id: Optional str
-        layer id to reuse if supplied
+        An AOI, DLTile or XYZTile
 
     Returns
     -------
-    arr : numpy.ma.MaskedArray
-        The computed AOI.
+    aoi, aoi_fields : Tuple[earthdaily.earthone.geo.AOI, Dict]
     """
-
     import earthdaily.earthone
 
-    auth = kwargs.pop("auth", None) or eo.auth.Auth.get_default_auth()
-
     if isinstance(
         aoi,
         (
@@ -860,71 +900,200 @@ def compute_aoi(
     else:
         raise TypeError(f"compute not implemented for AOIs of type {type(aoi)}")
 
+    aoi_fields = {
+        "geometry": geojson.Feature(geometry=aoi.geometry)["geometry"],
+        "resolution": aoi.resolution,
+        "crs": aoi.crs,
+        "align_pixels": aoi.align_pixels,
+        "bounds": aoi.bounds,
+        "bounds_crs": aoi.bounds_crs,
+        "shape": aoi.shape,
+        "all_touched": aoi.all_touched,
+    }
+
+    return aoi, aoi_fields
+
+
+@tracing.traced()
+def compute_aoi(
+    graft: Dict,
+    aoi: eo.geo.AOI,
+    layer_id: str = None,
+    dtype: Optional[Union[str, np.dtype, type]] = None,
+    mask_format: Optional[str] = None,
+    nodata: Optional[Union[int, float]] = None,
+    use_cache: bool = True,
+    tiled: Optional[bool] = None,
+    metadata_only: Optional[bool] = None,
+    **kwargs,
+) -> np.ma.MaskedArray:
+    """Compute an AOI of a layer.
+
+    Currently, only rasters are supported.
+
+    Parameters
+    ----------
+    graft : dict
+        The graft (ie. the directed acyclic graph) that describes how this tile layer should be formed.
+    aoi : earthdaily.earthone.geo.GeoContext
+        GeoContext for which to compute evaluate this ComputeMap
+    layer_id: Optional str
+        layer id to reuse if supplied
+    dtype: Optional[Union[str, numpy.dtype, type]]
+        Data type the result should be cast to by the server before transfer.
+    mask_format: Optional[str]
+        How the mask should be transferred, one of "packbits", "bool" or "nodata".
+        See `result_format.output_options`.
+    nodata: Optional[Union[int, float]]
+        Fill value for masked pixels when mask_format is "nodata".
+    use_cache: bool
+        Whether to use the persistent result cache, if one is configured.
+        See `result_cache.configure_result_cache`.
+    tiled: Optional[bool]
+        Whether to assemble the result from tiles of the spatial cache, if one is
+        configured. By default, the spatial cache is used for AOIs it supports.
+        See `spatial_cache.configure_spatial_cache`.
+    metadata_only: Optional[bool]
+        Only evaluate and transfer the properties, and values that aren't arrays,
+        e.g. scene metadata or counts. Array values are returned as None. By
+        default, only grafts returning metadata operations are evaluated this way,
+        see `is_metadata_graft`.
+
+    Returns
+    -------
+    arr : numpy.ma.MaskedArray
+        The computed AOI.
+    """
+
+    auth = kwargs.pop("auth", None) or eo.auth.Auth.get_default_auth()
+    output = result_format.output_options(dtype, mask_format, nodata)
+    if metadata_only is None:
+        metadata_only = is_metadata_graft(graft)
+
+    aoi, aoi_fields = _normalize_aoi(aoi)
+
+    cache = result_cache.get_result_cache() if use_cache else None
+    fingerprint = None
+    if cache is not None:
+        with transport.phase("graft"):
+            fingerprint = graft_fingerprint(graft)
+        cache_key = cache.make_key(
+            fingerprint,
+            aoi_fields,
+            parameters=kwargs,
+            output=output,
+            api_host=API_HOST,
+            org=auth.payload.get("org"),
+            metadata_only=metadata_only,
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    spatial = (
+        spatial_cache.get_spatial_cache()
+        if tiled is not False and not metadata_only
+        else None
+    )
+    if spatial is not None and spatial_cache.SpatialCache.supports(aoi):
+        if fingerprint is None:
+            with transport.phase("graft"):
+                fingerprint = graft_fingerprint(graft)
+        layer_ids = [layer_id] if layer_id else []
+        layer_lock = threading.Lock()
+
+        def compute_tile(tile_aoi):
+            # Only register the layer once, and only if a tile isn't cached
+            with layer_lock:
+                if not layer_ids:
+                    layer_ids.append(_register_layer(graft, auth))
+            return compute_aoi(
+                graft,
+                tile_aoi,
+                layer_ids[0],
+                dtype=dtype,
+                mask_format=mask_format,
+                nodata=nodata,
+                use_cache=use_cache,
+                tiled=False,
+                auth=auth,
+                **kwargs,
+            )
+
+        result = spatial.compute(
+            aoi,
+            json.dumps(
+                [
+                    fingerprint,
+                    kwargs,
+                    output,
+                    API_HOST,
+                    auth.payload.get("org"),
+                ],
+                sort_keys=True,
+                default=str,
+            ),
+            compute_tile,
+        )
+        if result is not None:
+            if cache is not None:
+                cache.put(cache_key, *result)
+            return result
+        layer_id = layer_ids[0] if layer_ids else None
+
     if not layer_id:
         # Create a layer from the graft if an id isn't supplied
         # NOTE: This is sort of redundant, but layer IDs are hashes so it won't
         # result in duplicates of existing layers
-        response = requests.post(
-            f"{API_HOST}/layers/",
-            headers={"Authorization": add_bearer(auth.token)},
-            json={
-                "graft": graft,
-                "python_version": _python_major_minor_version,
-                "dynamic_compute_version": version(
-                    "earthdaily-earthone-dynamic-compute"
-                ),
-            },
-            timeout=60,
-        )
+        layer_id = _register_layer(graft, auth)
 
-        try:
-            response.raise_for_status()
-        except Exception as e:
-            if e.response.status_code == 403:
-                raise UnauthorizedUserError(
-                    "User does not have access to dynamic-compute. "
-                    "If you believe this to be an error, contact support@earthdaily.com"
-                )
-            else:
-                raise e
+    def handle(response: requests.Response) -> Tuple[Any, Union[Dict, List]]:
+        with response:
+            _raise_for_status(response)
+
+            if metadata_only:
+                # Servers that predate metadata-only evaluation send the array
+                # anyway, it is skipped rather than read when possible.
+                return result_format.read_response_metadata(response)
+
+            with transport.phase("read"):
+                body = result_format.read_response_body(response)
+
+        with transport.phase("decode"):
+            value, properties = result_format.decode_any(body)
 
-        layer_id = json.loads(response.content.decode("utf-8"))["layer_id"]
+        # Servers that predate output negotiation ignore the requested dtype.
+        return result_format.apply_output_options(value, output), properties
 
-    # Compute the AOI
-    response = requests.post(
+    # Compute the AOI. The result is streamed into a single buffer and decoded
+    # in place; see `result_format` for the negotiated response formats.
+    value, properties = transport.get_transport().post(
         f"{API_HOST}/layers/{layer_id}/aoi",
-        headers={"Authorization": add_bearer(auth.token)},
+        handle,
+        endpoint="aoi",
+        hedge=True,
+        headers={
+            "Authorization": add_bearer(auth.token),
+            "Accept": result_format.accept_header(),
+        },
+        stream=True,
         json={
-            "geometry": geojson.Feature(geometry=aoi.geometry)["geometry"],
-            "resolution": aoi.resolution,
-            "crs": aoi.crs,
-            "align_pixels": aoi.align_pixels,
-            "bounds": aoi.bounds,
-            "bounds_crs": aoi.bounds_crs,
-            "shape": aoi.shape,
-            "all_touched": aoi.all_touched,
+            **aoi_fields,
             "python_version": _python_major_minor_version,
             "dynamic_compute_version": version("earthdaily-earthone-dynamic-compute"),
             "parameters": kwargs,
+            **({"output": output} if output else {}),
+            **({"metadata_only": True} if metadata_only else {}),
         },
     )
 
-    try:
-        response.raise_for_status()
-    except Exception as e:
-        if e.response.status_code == 403:
-            raise UnauthorizedUserError(
-                "User does not have access to dynamic-compute. "
-                "If you believe this to be an error, contact support@earthdaily.com"
-            )
-        else:
-            raise e
+    if cache is not None:
+        cache.put(cache_key, value, properties)
 
-    buf = io.BytesIO(response.content)
-    payload = pickle.load(buf)
-    return payload["array"], payload["properties"]
+    return value, properties
 
 
+@tracing.traced()
 def value_at(
     graft: Dict,
     lat: float,
@@ -953,12 +1122,18 @@ def value_at(
     if kwargs.get("parameters"):
         kwargs = kwargs["parameters"]
 
+    aoi = _geocontext_from_latlon(lat, lon)
+    value_array, _ = compute_aoi(graft, aoi, layer_id, **kwargs)
+    return _point_values(value_array)
+
+
+def _point_values(value_array) -> List:
+    """Reduce the array computed for a point to one value per band."""
+
     def _get_most_common_value(array) -> int:
         arr, counts = np.unique(array, return_counts=True)
         return int(arr[counts == counts.max()][0])
 
-    aoi = _geocontext_from_latlon(lat, lon)
-    value_array, _ = compute_aoi(graft, aoi, layer_id, **kwargs)
     if len(value_array.shape) > 1:
         if np.issubdtype(value_array.dtype.type, np.bool_):
             # if we're dealing with booleans, return the most common value
@@ -968,6 +1143,131 @@ def value_at(
     return list(value_array)
 
 
+@tracing.traced()
+def value_at_many(
+    graft: Dict,
+    lats: Union[List[float], np.ndarray],
+    lons: Union[List[float], np.ndarray],
+    layer_id: Optional[str] = None,
+    resolution: Optional[float] = None,
+    cell_size: int = 64,
+    max_workers: int = 8,
+    **kwargs,
+) -> np.ma.MaskedArray:
+    """
+    Return the values for each band of a graft at many locations
+
+    By default every point is evaluated like `value_at`, at its own 1x1 pixel AOI,
+    but the layer is only registered once, duplicate points are only computed
+    once and the AOIs are computed concurrently.
+
+    If a resolution is given, points are instead sampled from a grid with that
+    resolution, in degrees. The grid is divided into cells of cell_size x cell_size
+    pixels, and each cell containing points is computed once.
+
+    Parameters
+    ----------
+    graft : dict
+        The graft (ie. the directed acyclic graph) that describes how this tile layer should be formed.
+    lats
+        latitudes of the points to evaluate
+    lons
+        longitudes of the points to evaluate
+    layer_id: Optional str
+        layer id to reuse if supplied
+    resolution: Optional float
+        resolution of the grid to sample points from, in degrees
+    cell_size: int
+        width and height in pixels of the AOIs points are grouped into when a
+        resolution is given
+    max_workers: int
+        maximum number of AOIs computed concurrently
+
+    Returns
+    -------
+    values : numpy.ma.MaskedArray
+        Array with a row of values per point. Rows of points with fewer values
+        than others, and masked values, are masked.
+    """
+    import shapely
+
+    if kwargs.get("parameters"):
+        kwargs = kwargs["parameters"]
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if lats.shape != lons.shape or lats.ndim != 1:
+        raise ValueError("lats and lons must be one dimensional and of equal length")
+
+    if resolution is None:
+        points = shapely.points(lons, lats)
+        bounds = shapely.bounds(shapely.buffer(points, SINGLE_POINT_BUFFER_VALUE))
+        # Points sharing bounds share an AOI
+        unique_bounds, group_of_point = np.unique(bounds, axis=0, return_inverse=True)
+        aois = [
+            eo.geo.AOI(
+                bounds=tuple(aoi_bounds),
+                crs=WGS84_CRS,
+                shape=(1, 1),
+                all_touched=True,
+                align_pixels=True,
+            )
+            for aoi_bounds in unique_bounds
+        ]
+    else:
+        columns = np.floor(lons / resolution).astype(np.int64)
+        rows = np.floor(lats / resolution).astype(np.int64)
+        cells = np.stack([columns // cell_size, rows // cell_size], axis=1)
+        unique_cells, group_of_point = np.unique(cells, axis=0, return_inverse=True)
+        extent = cell_size * resolution
+        aois = [
+            eo.geo.AOI(
+                bounds=(cx * extent, cy * extent, (cx + 1) * extent, (cy + 1) * extent),
+                crs=WGS84_CRS,
+                resolution=resolution,
+                align_pixels=False,
+                all_touched=True,
+            )
+            for cx, cy in unique_cells
+        ]
+        # Row and column of each point in its cell, rows running southwards
+        point_rows = (unique_cells[group_of_point, 1] + 1) * cell_size - rows - 1
+        point_columns = columns - unique_cells[group_of_point, 0] * cell_size
+
+    group_of_point = group_of_point.reshape(-1)
+    if not aois:
+        return np.ma.masked_all((0, 0))
+
+    auth = kwargs.pop("auth", None) or eo.auth.Auth.get_default_auth()
+    if not layer_id:
+        layer_id = _register_layer(graft, auth)
+
+    def _compute(aoi):
+        value_array, _ = compute_aoi(graft, aoi, layer_id, auth=auth, **kwargs)
+        return value_array
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(aois))) as executor:
+        value_arrays = list(executor.map(tracing.propagate(_compute), aois))
+
+    values = []
+    for point, group in enumerate(group_of_point):
+        value_array = value_arrays[group]
+        if resolution is not None and len(value_array.shape) > 1:
+            value_array = value_array[
+                ...,
+                point_rows[point] : point_rows[point] + 1,
+                point_columns[point] : point_columns[point] + 1,
+            ]
+        values.append(_point_values(value_array))
+
+    result = np.ma.masked_all((len(values), max(map(len, values))))
+    for point, point_values in enumerate(values):
+        for band, value in enumerate(point_values):
+            if value is not np.ma.masked:
+                result[point, band] = value
+    return result
+
+
 def _geocontext_from_latlon(lat: float, lon: float) -> eo.geo.AOI:
     """
     Creates a tiny AOI from a lat/lon location. Private helper method for value_at, should only be called internally.
@@ -993,6 +1293,26 @@ def _geocontext_from_latlon(lat: float, lon: float) -> eo.geo.AOI:
     )
 
 
+def is_metadata_graft(graft: Dict) -> bool:
+    """
+    Determine if a graft returns only metadata, and so can be evaluated without
+    reading any pixels.
+
+    Parameters
+    ----------
+    graft: Dict
+        Graft to check
+
+    Returns
+    -------
+    is_metadata: bool
+        True if the graft returns the result of a metadata operation
+    """
+
+    returned = graft.get(graft.get("returns"))
+    return is_op(returned) and op_type(returned) in METADATA_OPS
+
+
 def is_op(graft_node: Any) -> bool:
     """
     Determine if a node in a graft is an operation.
@@ -1076,17 +1396,6 @@ def _adaptive_mask(mask, data):
             )
         )
 
-    if (
-        mask.ndim == 2
-    ):  # this is a Mosiac with one band, that for whatever reason didn't come back as (1,row,cols)
-
-        masked_data = np.ma.masked_array(data, False)
-        index = tuple(
-            [np.newaxis for _ in range(len(data.shape) - len(mask.shape))] + [...]
-        )
-        masked_data.mask |= mask[index]
-        return masked_data
-
     if (
         mask.ndim == 3
     ):  # the mask is a Mosaic with multiple bands or a single band in an ImageStack
@@ -1110,14 +1419,7 @@ def _adaptive_mask(mask, data):
                 )
 
         if mask.shape[0] == 1:
-            mask = np.squeeze(mask, axis=0)
-
-        masked_data = np.ma.masked_array(data, False)
-        index = tuple(
-            [np.newaxis for _ in range(len(data.shape) - len(mask.shape))] + [...]
-        )
-        masked_data.mask |= mask[index]
-        return masked_data
+            mask = mask[0]
 
     if mask.ndim == 4:  # the mask is an ImageStack
         if (
@@ -1143,28 +1445,29 @@ def _adaptive_mask(mask, data):
                     )
                 )
 
-    if isinstance(data, np.ma.MaskedArray):
-        masked_data = data
-    else:
-        masked_data = np.ma.masked_array(data, False)
-    if mask.shape[1] == 1:
-
-        # The computational intent of the following three lines of code is
-        #
-        # for i in range(masked_data.shape[1]):
-        #     masked_data.mask[:, i, :, :] = mask[:, 0, :, :]
-        #
-        # The conventional wisdom is that iteration is bad. However,
-        # I can only seem to get the desired broadcast behavior by swapping
-        # the fist two axes, doing the assignment, and then swapping back.
-
-        temp = np.moveaxis(masked_data, (0, 1, 2, 3), (1, 0, 2, 3))
-        temp.mask |= np.moveaxis(mask, (0, 1, 2, 3), (1, 0, 2, 3))
-        masked_data = np.moveaxis(temp, (0, 1, 2, 3), (1, 0, 2, 3))
-    else:
-        masked_data.mask |= mask
+    # Missing leading dimensions of the mask, and a single band of an ImageStack
+    # mask, are broadcast across the data as a view, without copying the mask.
+    in_place = mask.ndim == 4
+    index = tuple(np.newaxis for _ in range(data.ndim - mask.ndim)) + (...,)
+    mask = np.broadcast_to(mask[index], data.shape)
+
+    data_mask = np.ma.getmask(data)
+
+    if data_mask is np.ma.nomask:
+        if not mask.any():
+            # Nothing is masked, so don't allocate a mask
+            return np.ma.masked_array(data, copy=False)
+        return np.ma.masked_array(data, mask=np.array(mask), copy=False)
+
+    if in_place:
+        # As ImageStacks are large, an ImageStack mask updates the mask of
+        # masked data in place.
+        np.logical_or(data_mask, mask, out=data_mask)
+        return data
 
-    return masked_data
+    return np.ma.masked_array(
+        np.ma.getdata(data), mask=np.logical_or(data_mask, mask), copy=False
+    )
 
 
 def adaptive_mask(mask, data):
@@ -1187,6 +1490,8 @@ def adaptive_mask(mask, data):
     Note if the trailing dimensions of `data` don't match the dimensions of `mask`,
     this will fail -- we  don't check that present dimensions agree, we only add
     missing dimensions.
+    The mask is extended with broadcast views rather than copies, and the result
+    has no mask (`np.ma.nomask`) if neither `data` nor `mask` masks anything.
     Parmaters
     ---------
     mask: numpy.ndarray
@@ -1198,20 +1503,17 @@ def adaptive_mask(mask, data):
     md : numpy.ma.core.MaskedArray
         Masked array.
     """
-    try:
-        return _adaptive_mask(mask, data)
-    except Exception as e:
-        if str(e).find("'bitwise_or' not supported for the input types") >= 0:
-            raise Exception(
-                f"Encountered an error applying a mask of type {mask.dtype} to an array of type {data.dtype}"
-            )
-        else:
-            raise e
+    if mask.dtype != bool:
+        raise Exception(
+            f"Encountered an error applying a mask of type {mask.dtype} to an array of type {data.dtype}"
+        )
+
+    return _adaptive_mask(mask, data)
 
 
 def _default_property_propagation(
-    props0: Union[List[dict], dict],
-    props1: Union[List[dict], dict],
+    props0: Union[List[dict], dict, ColumnarProperties],
+    props1: Union[List[dict], dict, ColumnarProperties],
     band_op: Optional[str] = "same",
     op_name: Optional[str] = None,
 ) -> Union[List[Dict], Dict]:
@@ -1234,9 +1536,9 @@ def _default_property_propagation(
 
     Parameters
     ----------
-    props0: Union[List[dict], dict]
+    props0: Union[List[dict], dict, ColumnarProperties]
         Properties (metadata for the first operand)
-    props1: Union[List[dict], dict]
+    props1: Union[List[dict], dict, ColumnarProperties]
         Properties (metadata for the second operand)
     band_op: Optional[str] = "same"
         Either "same" meaning that bands are to be operated on together or
@@ -1321,10 +1623,15 @@ def _default_property_propagation(
         new_pid = pid0
         other_pid = pid1
 
-    if isinstance(props0, dict) and isinstance(props1, list):
+    if isinstance(props0, dict) and isinstance(props1, (list, ColumnarProperties)):
         props0, props1 = props1, props0
 
-    props0 = deepcopy(props0)
+    if isinstance(props0, ColumnarProperties):
+        # Only whole columns are replaced below, so the copy can share the
+        # others until they are written to
+        props0 = props0.copy()
+    else:
+        props0 = deepcopy(props0)
 
     if isinstance(props0, dict):
 
@@ -1377,38 +1684,126 @@ def _default_property_propagation(
 
         return props0
 
+    elif isinstance(props0, ColumnarProperties):
+
+        # As for a list, but setting each key once for every image
+
+        props0.discard("shape")
+
+        props0.discard("pad")
+        props0.set_constant("pad", new_pad if new_pad else 0)
+
+        props0.discard("bands")
+        if new_bands:
+            props0.set_constant("bands", new_bands)
+
+        props0.discard("product_id")
+        if new_pid:
+            props0.set_constant("product_id", new_pid)
+
+        props0.discard("other_product_id")
+        if other_pid:
+            props0.set_constant("other_product_id", other_pid)
+
+        return props0
+
     return {}
 
 
-def _nan_mask(op: Union[np.ndarray, np.ma.MaskedArray]) -> np.ndarray:
+def _count_dtype(
+    signature: str,
+    op1: Union[np.ndarray, np.ma.MaskedArray],
+    op2: Union[np.ndarray, np.ma.MaskedArray],
+) -> np.dtype:
     """
-    Create an array where masked values are nans and non-masked values are zero
+    The smallest unsigned integer type that can count the contributors to an
+    element of an einsum of both operands, i.e. twice the product of the sizes
+    of the contracted axes.
+    """
+    signature = signature.replace(" ", "")
+    if "->" not in signature or "." in signature:
+        return np.dtype(np.intp)
+
+    inputs, output = signature.split("->")
+    sizes = {}
+    for spec, op in zip(inputs.split(","), (op1, op2)):
+        sizes.update(zip(spec, np.shape(op)))
+
+    bound = 2
+    for letter, size in sizes.items():
+        if letter not in output:
+            bound *= size
+
+    return np.min_scalar_type(bound) if bound > 255 else np.dtype(np.uint8)
+
+
+def _einsum_mask(
+    signature: str,
+    op1: Union[np.ndarray, np.ma.MaskedArray],
+    op2: Union[np.ndarray, np.ma.MaskedArray],
+    optimize: Union[bool, str] = False,
+) -> Union[np.ndarray, np.ma.MaskType]:
+    """
+    Compute the mask of an einsum of two masked operands. An element of the
+    result is masked if any masked element contributes to it.
+
     Parameters
     ----------
-    op: Union[np.ndarray, np.ma.MaskedArray]
-        Operand for which we want the nan-mask
+    signature: str
+        `np.einsum` signature
+    op1: Union[np.ndarray, np.ma.MaskedArray]
+        First operand
+    op2: Union[np.ndarray, np.ma.MaskedArray]
+        Second operand
+    optimize: Union[bool, str]
+        Contraction path optimization, passed to `np.einsum`
+
     Returns
     -------
-    nan_mask: np.ndarray
-        Nan-mask for operand
+    mask: Union[np.ndarray, np.ma.MaskType]
+        Mask for the einsum, or `np.ma.nomask` if neither operand has a mask
     """
-    mask = np.zeros(op.shape)
+    mask1 = np.ma.getmask(op1)
+    mask2 = np.ma.getmask(op2)
 
-    if not isinstance(op, np.ma.MaskedArray):
-        return mask
+    if mask1 is np.ma.nomask and mask2 is np.ma.nomask:
+        return np.ma.nomask
 
-    mask[op.mask] = np.nan
+    # Implementation idea: einsum is akin to matrix multiplication in that it
+    # uses multiplication and addition to get a result. Contracting the boolean
+    # mask of one operand against ones in place of the other, as integers,
+    # counts the masked elements contributing to each element of the result.
+    #
+    # The ones are a broadcast view, and einsum casts the boolean masks as it
+    # iterates, so nothing the size of the operands is allocated.
+
+    dtype = _count_dtype(signature, op1, op2)
+    count = None
+
+    if mask1 is not np.ma.nomask:
+        ones2 = np.broadcast_to(np.uint8(1), np.shape(op2))
+        count = np.einsum(signature, mask1, ones2, dtype=dtype, optimize=optimize)
+
+    if mask2 is not np.ma.nomask:
+        ones1 = np.broadcast_to(np.uint8(1), np.shape(op1))
+        count2 = np.einsum(signature, ones1, mask2, dtype=dtype, optimize=optimize)
+        if count is None:
+            count = count2
+        else:
+            count += count2
 
-    return mask
+    return count > 0
 
 
 def masked_einsum(
     signature: str,
     op1: Union[np.ndarray, np.ma.MaskedArray],
     op2: Union[np.ndarray, np.ma.MaskedArray],
+    optimize: Union[bool, str] = False,
 ) -> Union[np.ndarray, np.ma.MaskedArray]:
     """
     Compute an einsum that respects masks.
+
     Parameters
     ----------
     signature: str
@@ -1417,40 +1812,126 @@ def masked_einsum(
         First operand
     op2: Union[np.ndarray, np.ma.MaskedArray]
         Second operand
+    optimize: Union[bool, str]
+        Contraction path optimization, passed to `np.einsum`, e.g. True or
+        "greedy" to allow BLAS for large contractions
+
     Returns
     -------
     product: Union[np.ndarray, np.ma.MaskedArray]
-        Masked result for einsum
+        Masked result for einsum. The result has no mask (`np.ma.nomask`) if
+        neither operand has one.
     """
-    unmasked_result = np.einsum(signature, op1, op2)
+    unmasked_result = np.einsum(
+        signature, np.ma.getdata(op1), np.ma.getdata(op2), optimize=optimize
+    )
 
     if not isinstance(op1, np.ma.MaskedArray) and not isinstance(
         op2, np.ma.MaskedArray
     ):
         return unmasked_result
 
-    # Implementation idea: einsum is akin to matrix multiplicataion in that
-    # it uses multiplication and addition to get a result. Masks are booleans
-    # and for booleans multiplication is "and" and addition is "or", applying
-    # einsum directly to the masks may not give the desired result.
-    #
-    # For each operatnd, we create a new mask where False (not masked) is 0 and
-    # True (masked) is nan, and then take advantage that nans propagate as desired,
-    # e.g.
-    #
-    #     nan + anything == anything + nan == nan
-    #     nan * anything == anything * nan == nan
-    #
-    # We apply einsum on the two nan-masks, then mask the result for any nan result
+    mask = _einsum_mask(signature, op1, op2, optimize=optimize)
 
-    nan_mask1 = _nan_mask(op1)
-    nan_mask2 = _nan_mask(op2)
+    return np.ma.masked_array(unmasked_result, mask)
 
-    mask = np.isnan(np.einsum(signature, nan_mask1, nan_mask2))
 
-    return np.ma.masked_array(unmasked_result, mask)
+def masked_einsum_chunked(
+    signature: str,
+    op1: Union[np.ndarray, np.ma.MaskedArray],
+    op2: Union[np.ndarray, np.ma.MaskedArray],
+    chunk_size: int = 256,
+    optimize: Union[bool, str] = False,
+) -> Union[np.ndarray, np.ma.MaskedArray]:
+    """
+    Compute an einsum that respects masks, in blocks of pixel rows.
+
+    This is `masked_einsum`, but temporaries are only ever the size of a block
+    of `chunk_size` rows, which bounds peak memory for large image stacks. The
+    rows are the second to last axis of the result, e.g. ``i`` in
+    ``"nbij,nm->mbij"``. Signatures without an explicit result, or using
+    ellipses, are computed in one block.
+
+    Parameters
+    ----------
+    signature: str
+        `np.einsum` signature
+    op1: Union[np.ndarray, np.ma.MaskedArray]
+        First operand
+    op2: Union[np.ndarray, np.ma.MaskedArray]
+        Second operand
+    chunk_size: int
+        Number of rows per block
+    optimize: Union[bool, str]
+        Contraction path optimization, passed to `np.einsum`
+
+    Returns
+    -------
+    product: Union[np.ndarray, np.ma.MaskedArray]
+        Masked result for einsum
+    """
+    signature = signature.replace(" ", "")
+    if "->" not in signature or "." in signature:
+        return masked_einsum(signature, op1, op2, optimize=optimize)
+
+    inputs, output = signature.split("->")
+    specs = inputs.split(",")
+    if len(output) < 2:
+        return masked_einsum(signature, op1, op2, optimize=optimize)
+
+    rows = output[-2]
+    ops = (op1, op2)
+    sizes = [
+        np.shape(op)[spec.index(rows)] for op, spec in zip(ops, specs) if rows in spec
+    ]
+    if not sizes:
+        return masked_einsum(signature, op1, op2, optimize=optimize)
+
+    def block(op, spec, start):
+        if rows not in spec:
+            return op
+        index = [slice(None)] * len(spec)
+        index[spec.index(rows)] = slice(start, start + chunk_size)
+        return op[tuple(index)]
+
+    result = None
+    mask = None
+    out_axis = output.index(rows)
+
+    for start in range(0, sizes[0], chunk_size):
+        product = masked_einsum(
+            signature,
+            block(op1, specs[0], start),
+            block(op2, specs[1], start),
+            optimize=optimize,
+        )
+
+        if result is None:
+            shape = list(product.shape)
+            shape[out_axis] = sizes[0]
+            result = np.empty(shape, dtype=product.dtype)
+            if isinstance(product, np.ma.MaskedArray):
+                mask = np.zeros(shape, dtype=bool)
+
+        index = [slice(None)] * result.ndim
+        index[out_axis] = slice(start, start + chunk_size)
+        index = tuple(index)
+
+        result[index] = np.ma.getdata(product)
+        if mask is not None:
+            mask[index] = np.ma.getmaskarray(product)
+
+    if result is None:
+        # No rows
+        return masked_einsum(signature, op1, op2, optimize=optimize)
+
+    if mask is None:
+        return result
+
+    return np.ma.masked_array(result, mask if mask.any() else np.ma.nomask)
 
 
+@transport.phase("graft")
 def update_kwarg(graft: dict, node_type: str, kwarg: str, value: str) -> dict:
     """
     Update, or set, a particular keyword argument within a type of graft node.
@@ -1565,7 +2046,7 @@ def convolve(
     convolution_graft: dict
         Dictionry encoding the convolution of the two arguments
     """
-    return graft_client.apply_graft(
+    return _apply_graft(
         "convolve", graft, knl, size_x=size_x, size_y=size_y, res_x=res_x, res_y=res_y
     )
 
@@ -1598,6 +2079,6 @@ def morphology(
     morphology_graft: dict
         Dictionary encoding the result of the operation
     """
-    return graft_client.apply_graft(
+    return _apply_graft(
         "morphology", graft, method, size, res_x=res_x, res_y=res_y
     )
@@ -0,0 +1,328 @@
+"""Persistent, content-addressed cache of compute results.
+
+Entries are stored on disk in the binary result format (see `result_format`),
+uncompressed, so that a cache hit is a memory map of the entry rather than a
+read and decode. Mapped entries are copy-on-write, so the returned arrays may
+be modified without affecting the cache.
+
+The cache is safe to share between processes, e.g. several notebook kernels
+pointing at the same directory:
+
+* entries are written to a temporary file and atomically renamed into place,
+  so readers never observe a partially written entry,
+* hits refresh the entry's modification time, which is used as the LRU clock,
+* eviction is serialized with an advisory lock on a lock file, and an entry
+  removed while mapped by another process stays valid for that process.
+
+The cache is disabled by default. Enable it with `configure_result_cache`, or
+by setting the DYNAMIC_COMPUTE_CACHE_DIR environment variable, and optionally
+DYNAMIC_COMPUTE_CACHE_MAX_BYTES.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+from importlib.metadata import version
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from . import metrics, result_format
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover, not available on Windows
+    fcntl = None
+
+DEFAULT_MAX_BYTES = 10 * 2**30
+ENTRY_SUFFIX = ".dcr"
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def _json_roundtrips(obj: Any) -> bool:
+    # Values that don't survive a JSON round trip unchanged, e.g. tuples or
+    # datetimes, would be returned differently on a cache hit, so aren't cached.
+    try:
+        return json.loads(json.dumps(obj)) == obj
+    except (TypeError, ValueError):
+        return False
+
+
+class ResultCache:
+    """
+    A size-bounded, least-recently-used cache of compute results on disk.
+
+    Parameters
+    ----------
+    directory: str
+        Directory in which entries are stored, created if it doesn't exist.
+    max_bytes: int
+        Total size of entries above which the least recently used are evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(
+        self,
+        graft_fingerprint: str,
+        aoi_fields: Dict,
+        parameters: Optional[Dict] = None,
+        output: Optional[Dict] = None,
+        **extra,
+    ) -> str:
+        """
+        Compute the key for a result.
+
+        Parameters
+        ----------
+        graft_fingerprint: str
+            Fingerprint of the graft, see `operations.graft_fingerprint`.
+        aoi_fields: Dict
+            Normalized AOI fields, as sent in the body of an ``/aoi`` request.
+        parameters: Optional[Dict]
+            Parameter values the graft is evaluated with.
+        output: Optional[Dict]
+            Requested output options, see `result_format.output_options`.
+        **extra:
+            Anything else the result depends on.
+
+        Returns
+        -------
+        key: str
+            Hex digest identifying the result
+        """
+        description = {
+            "graft": graft_fingerprint,
+            "aoi": aoi_fields,
+            "parameters": parameters or {},
+            "output": output or {},
+            "dynamic_compute_version": version("earthdaily-earthone-dynamic-compute"),
+            **extra,
+        }
+        encoded = json.dumps(description, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[Tuple[Any, Union[Dict, List]]]:
+        """
+        Look up a result.
+
+        Parameters
+        ----------
+        key: str
+            Key of the result, see `make_key`
+
+        Returns
+        -------
+        result: Optional[Tuple[Any, Union[Dict, List]]]
+            The cached ``(value, properties)``, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # Missing, evicted since, or empty because of a crashed writer.
+            self._count(hit=False)
+            return None
+
+        try:
+            result = result_format.decode_result(buffer)
+        except result_format.ResultFormatError:
+            self._count(hit=False)
+            self._remove(path)
+            return None
+
+        self._count(hit=True)
+        return result
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.counter(
+            "dynamic_compute_cache_requests_total",
+            "Cache lookups",
+            cache="result",
+            result="hit" if hit else "miss",
+        ).inc()
+
+    def put(self, key: str, value: Any, properties: Union[Dict, List]) -> bool:
+        """
+        Store a result. Results that can't be represented exactly in the binary
+        result format are not stored.
+
+        Parameters
+        ----------
+        key: str
+            Key of the result, see `make_key`
+        value: Any
+            Array or value of the result
+        properties: Union[Dict, List]
+            Properties of the result
+
+        Returns
+        -------
+        stored: bool
+            True if the result was stored
+        """
+        if not _json_roundtrips(properties):
+            return False
+        if not isinstance(value, np.ndarray) and not _json_roundtrips(value):
+            return False
+
+        try:
+            payload = result_format.encode_result(value, properties)
+        except result_format.ResultFormatError:
+            return False
+
+        if len(payload) > self.max_bytes:
+            return False
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+        self.evict()
+        return True
+
+    def _entries(self) -> Iterator[os.DirEntry]:
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    yield entry
+
+    @staticmethod
+    def _remove(path: str):
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+    @contextlib.contextmanager
+    def _exclusive(self) -> Iterator[bool]:
+        # Only one process evicts at a time; others skip eviction rather than wait.
+        if fcntl is None:
+            yield True
+            return
+
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def size(self) -> int:
+        """Total size of the cached entries, in bytes"""
+        total = 0
+        for entry in self._entries():
+            with contextlib.suppress(FileNotFoundError):
+                total += entry.stat().st_size
+        return total
+
+    def evict(self, max_bytes: Optional[int] = None):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+
+        Parameters
+        ----------
+        max_bytes: Optional[int]
+            Size to evict down to, defaults to the cache's max_bytes.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        with self._exclusive() as acquired:
+            if not acquired:
+                return
+
+            entries = []
+            for entry in self._entries():
+                with contextlib.suppress(FileNotFoundError):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        self.evict(max_bytes=0)
+
+
+def configure_result_cache(
+    directory: Optional[str], max_bytes: int = DEFAULT_MAX_BYTES
+) -> Optional[ResultCache]:
+    """
+    Enable, reconfigure or, with a directory of None, disable the result cache used
+    by `compute_aoi`.
+
+    Parameters
+    ----------
+    directory: Optional[str]
+        Directory in which to store cached results. Several processes may share
+        the same directory.
+    max_bytes: int
+        Maximum total size of the cached results, defaults to 10 GiB.
+
+    Returns
+    -------
+    cache: Optional[ResultCache]
+        The configured cache
+    """
+    global _cache
+
+    with _cache_lock:
+        _cache = ResultCache(directory, max_bytes) if directory else None
+
+    return _cache
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Return the configured result cache, or None if caching is disabled"""
+    return _cache
+
+
+if os.getenv("DYNAMIC_COMPUTE_CACHE_DIR"):
+    configure_result_cache(
+        os.environ["DYNAMIC_COMPUTE_CACHE_DIR"],
+        int(os.getenv("DYNAMIC_COMPUTE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    )
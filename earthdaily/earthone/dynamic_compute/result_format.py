@@ -0,0 +1,729 @@
+"""Versioned binary encoding of compute results.
+
+Results of an ``/aoi`` compute used to be transferred exclusively as pickles,
+which are unsafe to load, tie the client to the server's Python and NumPy
+versions, and require the payload to be copied before decoding. This module
+defines a small, self-describing container instead::
+
+    +-------------------------------------------------------------+
+    | preamble: magic (4 bytes), version (u16), flags (u16),      |
+    |           header length (u64), all little-endian            |
+    +-------------------------------------------------------------+
+    | header: utf-8 JSON describing the sections and properties   |
+    +-------------------------------------------------------------+
+    | padding to a multiple of SECTION_ALIGNMENT                  |
+    +-------------------------------------------------------------+
+    | array section: raw C-ordered array bytes (or blosc2 chunks) |
+    +-------------------------------------------------------------+
+    | mask section: bit-packed mask bytes (or blosc2 chunks)      |
+    +-------------------------------------------------------------+
+
+Uncompressed sections are decoded with `numpy.frombuffer`, so the returned
+arrays are views onto the received buffer and no intermediate copies are made.
+Compressed sections are decompressed directly into their final allocation.
+
+Pickle remains supported as a fallback for servers, or results, that can't be
+represented in this format.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import pickle
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import blosc2
+import numpy as np
+
+MAGIC = b"DCRF"
+FORMAT_VERSION = 1
+
+# Media types used to negotiate the result format with the server.
+BINARY_MEDIA_TYPE = "application/vnd.earthdaily.dynamic-compute.result"
+PICKLE_MEDIA_TYPE = "application/x-python-pickle"
+
+# The formats the client is willing to accept, in order of preference. This may
+# be overridden with the DYNAMIC_COMPUTE_RESULT_FORMATS environment variable, e.g.
+# "pickle" to disable the binary format entirely.
+RESULT_FORMATS = tuple(
+    os.getenv("DYNAMIC_COMPUTE_RESULT_FORMATS", "binary pickle").split()
+)
+
+# Encodings of the mask that can be requested with `output_options`.
+MASK_FORMATS = ("packbits", "bool", "nodata")
+
+SECTION_ALIGNMENT = 64
+COMPRESSION_CHUNK_SIZE = 256 * 2**20
+READ_CHUNK_SIZE = 2**20
+METADATA_READ_CHUNK_SIZE = 2**16
+
+_PREAMBLE = struct.Struct("<4sHHQ")
+
+_MEDIA_TYPES = {"binary": BINARY_MEDIA_TYPE, "pickle": PICKLE_MEDIA_TYPE}
+
+
+class ResultFormatError(ValueError):
+    """Raised when a result payload cannot be encoded or decoded"""
+
+
+def accept_header(formats: Optional[Tuple[str, ...]] = None) -> str:
+    """
+    Build an HTTP Accept header advertising the result formats the client supports.
+
+    Parameters
+    ----------
+    formats: Optional[Tuple[str, ...]]
+        Formats in order of preference, defaults to RESULT_FORMATS.
+
+    Returns
+    -------
+    accept: str
+        Value for the Accept header
+    """
+    if formats is None:
+        formats = RESULT_FORMATS
+
+    media_ranges = []
+    for i, result_format in enumerate(formats):
+        if result_format not in _MEDIA_TYPES:
+            raise ResultFormatError(f"Unrecognized result format {result_format}")
+
+        media_range = _MEDIA_TYPES[result_format]
+        if result_format == "binary":
+            media_range += f"; version={FORMAT_VERSION}"
+        if i > 0:
+            media_range += f"; q={max(0.1, 1 - i / 10):.1f}"
+        media_ranges.append(media_range)
+
+    return ", ".join(media_ranges)
+
+
+def preferred_format(accept: Optional[str]) -> str:
+    """
+    Pick the result format to respond with given an Accept header. This is the
+    server side of the negotiation and is used by the local stub server.
+
+    Parameters
+    ----------
+    accept: Optional[str]
+        Value of the request's Accept header
+
+    Returns
+    -------
+    result_format: str
+        Either "binary" or "pickle"
+    """
+    if not accept:
+        return "pickle"
+
+    best_format, best_q = "pickle", -1.0
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                q = float(value)
+        for result_format, candidate in _MEDIA_TYPES.items():
+            if media_type == candidate and q > best_q:
+                best_format, best_q = result_format, q
+
+    return best_format
+
+
+def is_binary_result(buffer: Union[bytes, bytearray, memoryview]) -> bool:
+    """Return True if buffer holds a result in the binary format"""
+    return bytes(memoryview(buffer)[: len(MAGIC)]) == MAGIC
+
+
+def _json_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _align(offset: int) -> int:
+    return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+def _compress(data: memoryview, typesize: int) -> List[bytes]:
+    return [
+        blosc2.compress(
+            data[start : start + COMPRESSION_CHUNK_SIZE],
+            typesize=typesize,
+            clevel=5,
+        )
+        for start in range(0, len(data), COMPRESSION_CHUNK_SIZE)
+    ]
+
+
+def _encode_section(
+    data: np.ndarray, compression: Optional[str]
+) -> Tuple[Dict, List[memoryview]]:
+    raw = memoryview(np.ascontiguousarray(data)).cast("B")
+
+    if compression is None:
+        return {"codec": None, "nbytes": len(raw)}, [raw]
+
+    if compression != "blosc2":
+        raise ResultFormatError(f"Unsupported compression {compression}")
+
+    chunks = _compress(raw, data.dtype.itemsize)
+    return (
+        {
+            "codec": "blosc2",
+            "nbytes": sum(map(len, chunks)),
+            "raw_nbytes": len(raw),
+            "chunks": list(map(len, chunks)),
+        },
+        [memoryview(chunk) for chunk in chunks],
+    )
+
+
+def output_options(
+    dtype: Optional[Union[str, np.dtype, type]] = None,
+    mask_format: Optional[str] = None,
+    nodata: Optional[Union[int, float]] = None,
+) -> Dict:
+    """
+    Validate the requested output encoding of a compute and build the "output"
+    entry sent with an ``/aoi`` request.
+
+    Parameters
+    ----------
+    dtype: Optional[Union[str, numpy.dtype, type]]
+        Data type the server should cast the result to before sending it.
+    mask_format: Optional[str]
+        How the server should send the mask, one of MASK_FORMATS. "packbits"
+        sends one bit per pixel, "bool" one byte per pixel, and "nodata" sends
+        no mask at all; masked pixels are filled with `nodata` instead.
+    nodata: Optional[Union[int, float]]
+        Fill value for masked pixels when mask_format is "nodata". Defaults to
+        NaN, which requires a floating point dtype and is not sent explicitly.
+
+    Returns
+    -------
+    options: Dict
+        Output options, empty if nothing was requested
+    """
+    options: Dict[str, Any] = {}
+
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if dtype.hasobject or dtype.fields is not None:
+            raise ResultFormatError(f"Unsupported dtype {dtype}")
+        options["dtype"] = dtype.name
+
+    if mask_format is not None:
+        if mask_format not in MASK_FORMATS:
+            raise ResultFormatError(
+                f"mask_format must be one of {MASK_FORMATS}, not {mask_format!r}"
+            )
+        options["mask_format"] = mask_format
+
+    if nodata is not None and mask_format != "nodata":
+        raise ResultFormatError('nodata can only be used with mask_format="nodata"')
+
+    if mask_format == "nodata":
+        if nodata is None:
+            if dtype is not None and not np.issubdtype(dtype, np.floating):
+                raise ResultFormatError(
+                    f"A nodata value must be provided for dtype {dtype}"
+                )
+        elif dtype is not None and not np.can_cast(
+            np.min_scalar_type(nodata), dtype, casting="same_kind"
+        ):
+            raise ResultFormatError(
+                f"nodata value {nodata} cannot be represented as {dtype}"
+            )
+        if nodata is not None:
+            # Omitted, NaN isn't valid JSON and is the default
+            options["nodata"] = nodata
+
+    return options
+
+
+def apply_output_options(value: Any, options: Optional[Dict]) -> Any:
+    """
+    Cast a result according to the output options sent with an ``/aoi`` request.
+    This is what a server does before encoding the result.
+
+    Parameters
+    ----------
+    value: Any
+        Result of an evaluation
+    options: Optional[Dict]
+        Output options as built by `output_options`
+
+    Returns
+    -------
+    value: Any
+        The cast result
+    """
+    if not options or not isinstance(value, np.ndarray):
+        return value
+
+    if "dtype" in options and value.dtype != options["dtype"]:
+        # Cast the data and mask separately, the fill value of the input may not be
+        # representable in the new dtype.
+        data = np.ma.getdata(value).astype(options["dtype"])
+        if isinstance(value, np.ma.MaskedArray):
+            value = np.ma.masked_array(data, np.ma.getmask(value))
+        else:
+            value = data
+
+    return value
+
+
+def encode_result(
+    value: Any,
+    properties: Union[Dict, List],
+    compression: Optional[str] = None,
+    mask_format: str = "packbits",
+    nodata: Optional[Union[int, float]] = None,
+) -> bytearray:
+    """
+    Encode a compute result in the binary result format.
+
+    Parameters
+    ----------
+    value: Any
+        Either an array (masked or not) or a JSON serializable value, e.g.
+        the integer result of `length`.
+    properties: Union[Dict, List]
+        Properties associated with the result.
+    compression: Optional[str]
+        Either None or "blosc2".
+    mask_format: str
+        One of MASK_FORMATS, see `output_options`.
+    nodata: Optional[Union[int, float]]
+        Fill value for masked pixels when mask_format is "nodata", defaults to NaN,
+        which is only valid for floating point arrays.
+
+    Returns
+    -------
+    payload: bytearray
+        Encoded result
+
+    Raises
+    ------
+    ResultFormatError
+        If the result can't be represented in the binary format, in which case
+        callers should fall back to `encode_pickle`.
+    """
+    if mask_format not in MASK_FORMATS:
+        raise ResultFormatError(f"Unsupported mask format {mask_format}")
+
+    header: Dict[str, Any] = {}
+    sections: List[Tuple[Dict, List[memoryview]]] = []
+
+    if isinstance(value, np.ndarray):
+        array = np.ma.getdata(value)
+        mask = np.ma.getmask(value)
+
+        if array.dtype.hasobject or array.dtype.fields is not None:
+            raise ResultFormatError(f"Unsupported dtype {array.dtype}")
+
+        if mask_format == "nodata":
+            if nodata is None and not np.issubdtype(array.dtype, np.inexact):
+                # NaN, the default, can't be represented
+                raise ResultFormatError(
+                    f"A nodata value must be provided for dtype {array.dtype}"
+                )
+            if mask is not np.ma.nomask:
+                fill = np.nan if nodata is None else nodata
+                array = np.where(mask, np.asarray(fill, dtype=array.dtype), array)
+            # NaN isn't valid JSON, so it is represented by null
+            header["nodata"] = None if nodata is None or np.isnan(nodata) else nodata
+            mask = np.ma.nomask
+
+        array_info, array_chunks = _encode_section(array, compression)
+        array_info.update({"dtype": array.dtype.str, "shape": list(array.shape)})
+        header["array"] = array_info
+        sections.append((array_info, array_chunks))
+
+        if mask is not np.ma.nomask:
+            if mask_format == "packbits":
+                mask_data = np.packbits(mask, axis=None)
+            else:
+                mask_data = mask.view(np.uint8)
+            mask_info, mask_chunks = _encode_section(mask_data, compression)
+            mask_info["encoding"] = mask_format
+            header["mask"] = mask_info
+            sections.append((mask_info, mask_chunks))
+        elif isinstance(value, np.ma.MaskedArray):
+            # Decode a masked array without a mask to a masked array, as a pickle
+            header["masked"] = True
+
+        if isinstance(value, np.ma.MaskedArray):
+            fill_value = value.fill_value.item()
+            if fill_value != np.ma.default_fill_value(array.dtype):
+                header["fill_value"] = fill_value
+    else:
+        header["value"] = value
+
+    header["properties"] = properties
+
+    # Offsets depend on the header length, and the header contains the offsets,
+    # so reserve space generously and pad the header with whitespace.
+    try:
+        encoded_header = json.dumps(header, default=_json_default).encode("utf-8")
+    except (TypeError, ValueError) as e:
+        raise ResultFormatError(str(e)) from e
+
+    header_size = _align(_PREAMBLE.size + len(encoded_header) + 64 * len(sections))
+    offset = header_size
+    for info, chunks in sections:
+        info["offset"] = offset
+        offset = _align(offset + info["nbytes"])
+
+    encoded_header = json.dumps(header, default=_json_default).encode("utf-8")
+    if _PREAMBLE.size + len(encoded_header) > header_size:
+        raise ResultFormatError("Result header exceeds its reserved size")
+    encoded_header = encoded_header.ljust(header_size - _PREAMBLE.size)
+
+    buffer = bytearray(offset)
+    buffer[:header_size] = (
+        _PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(encoded_header)) + encoded_header
+    )
+    for info, chunks in sections:
+        position = info["offset"]
+        for chunk in chunks:
+            buffer[position : position + len(chunk)] = chunk
+            position += len(chunk)
+
+    return buffer
+
+
+def encode_pickle(value: Any, properties: Union[Dict, List]) -> bytes:
+    """Encode a compute result with the legacy pickle format"""
+    return pickle.dumps({"array": value, "properties": properties})
+
+
+def _decode_section(
+    buffer: memoryview, info: Dict, dtype: np.dtype, count: int
+) -> np.ndarray:
+    if info["codec"] is None:
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=info["offset"])
+
+    if info["codec"] != "blosc2":
+        raise ResultFormatError(f"Unsupported codec {info['codec']}")
+
+    out = np.empty(count, dtype=dtype)
+    out_bytes = memoryview(out).cast("B")
+    position, written = info["offset"], 0
+    for chunk_size in info["chunks"]:
+        raw_size = min(COMPRESSION_CHUNK_SIZE, info["raw_nbytes"] - written)
+        blosc2.decompress(
+            buffer[position : position + chunk_size],
+            dst=out_bytes[written : written + raw_size],
+        )
+        position += chunk_size
+        written += raw_size
+
+    return out
+
+
+def decode_header(buffer: Union[bytes, bytearray, memoryview]) -> Dict:
+    """
+    Decode the header of a binary result without touching its data sections.
+
+    Parameters
+    ----------
+    buffer: Union[bytes, bytearray, memoryview]
+        Buffer holding a binary result
+
+    Returns
+    -------
+    header: Dict
+        The decoded header
+    """
+    view = memoryview(buffer)
+    magic, format_version, _, header_length = _PREAMBLE.unpack_from(view)
+
+    if magic != MAGIC:
+        raise ResultFormatError("Buffer does not contain a binary result")
+
+    if format_version > FORMAT_VERSION:
+        raise ResultFormatError(
+            f"Result format version {format_version} is newer than the supported "
+            f"version {FORMAT_VERSION}, please upgrade earthdaily-earthone-dynamic-compute"
+        )
+
+    return json.loads(
+        bytes(view[_PREAMBLE.size : _PREAMBLE.size + header_length]).decode("utf-8")
+    )
+
+
+class DecodedResult:
+    """
+    A decoded binary result whose mask is only reconstructed when first needed.
+
+    Bit-packed masks take an eighth of the space of boolean masks, so keeping
+    them packed until the masked array is requested saves memory for callers
+    that only need the data, or that store the mask packed, e.g. in a cache.
+
+    Parameters
+    ----------
+    header: Dict
+        Decoded result header
+    array: Optional[numpy.ndarray]
+        The result's data, None if the result is a value
+    mask_data: Optional[numpy.ndarray]
+        The mask as sent, either bit-packed or one byte per pixel
+    """
+
+    def __init__(
+        self,
+        header: Dict,
+        array: Optional[np.ndarray],
+        mask_data: Optional[np.ndarray],
+    ):
+        self.header = header
+        self.array = array
+        self.mask_data = mask_data
+        self._mask = None
+
+    @property
+    def properties(self) -> Union[Dict, List]:
+        return self.header["properties"]
+
+    @property
+    def mask_encoding(self) -> Optional[str]:
+        if "nodata" in self.header:
+            return "nodata"
+        mask_info = self.header.get("mask")
+        return mask_info["encoding"] if mask_info else None
+
+    @property
+    def packed_mask(self) -> Optional[np.ndarray]:
+        """The mask packed one bit per pixel, None if the result has no mask"""
+        if self.mask_encoding == "packbits":
+            return self.mask_data
+        mask = self.mask
+        return None if mask is np.ma.nomask else np.packbits(mask, axis=None)
+
+    @property
+    def mask(self) -> Union[np.ndarray, np.ma.MaskType]:
+        """The boolean mask of the result, reconstructed on first access"""
+        if self._mask is not None:
+            return self._mask
+
+        encoding = self.mask_encoding
+        if self.array is None or encoding is None:
+            self._mask = np.ma.nomask
+        elif encoding == "nodata":
+            nodata = self.header["nodata"]
+            if nodata is None:
+                self._mask = np.isnan(self.array)
+            else:
+                self._mask = self.array == nodata
+        elif encoding == "packbits":
+            self._mask = (
+                np.unpackbits(self.mask_data, count=self.array.size)
+                .view(bool)
+                .reshape(self.array.shape)
+            )
+        elif encoding == "bool":
+            self._mask = self.mask_data.view(bool).reshape(self.array.shape)
+        else:
+            raise ResultFormatError(f"Unsupported mask encoding {encoding}")
+
+        return self._mask
+
+    @property
+    def value(self) -> Any:
+        """The result as it would have been returned by the server"""
+        if self.array is None:
+            return self.header.get("value")
+
+        if self.mask_encoding is None:
+            if not self.header.get("masked"):
+                return self.array
+            masked = np.ma.MaskedArray(self.array, copy=False)
+            if "fill_value" in self.header:
+                masked.fill_value = self.header["fill_value"]
+            return masked
+
+        masked = np.ma.MaskedArray(self.array, mask=self.mask, copy=False)
+        if "fill_value" in self.header:
+            masked.fill_value = self.header["fill_value"]
+        elif "nodata" in self.header:
+            nodata = self.header["nodata"]
+            if nodata is not None:
+                masked.fill_value = nodata
+            elif np.issubdtype(self.array.dtype, np.inexact):
+                masked.fill_value = np.nan
+
+        return masked
+
+
+def decode_lazy(buffer: Union[bytes, bytearray, memoryview]) -> DecodedResult:
+    """
+    Decode a binary result, deferring reconstruction of the mask. Uncompressed
+    sections are views of `buffer`, which must therefore outlive them; they are
+    writable when `buffer` is.
+
+    Parameters
+    ----------
+    buffer: Union[bytes, bytearray, memoryview]
+        Buffer holding a binary result, e.g. an HTTP response body or a memmap.
+
+    Returns
+    -------
+    result: DecodedResult
+        The decoded result
+    """
+    view = memoryview(buffer).cast("B")
+    header = decode_header(view)
+
+    if "array" not in header:
+        return DecodedResult(header, None, None)
+
+    array_info = header["array"]
+    dtype = np.dtype(array_info["dtype"])
+    shape = tuple(array_info["shape"])
+    size = int(np.prod(shape, dtype=np.int64))
+
+    array = _decode_section(view, array_info, dtype, size).reshape(shape)
+
+    mask_info = header.get("mask")
+    mask_data = None
+    if mask_info is not None:
+        count = -(-size // 8) if mask_info["encoding"] == "packbits" else size
+        mask_data = _decode_section(view, mask_info, np.uint8, count)
+
+    return DecodedResult(header, array, mask_data)
+
+
+def decode_result(
+    buffer: Union[bytes, bytearray, memoryview],
+) -> Tuple[Any, Union[Dict, List]]:
+    """
+    Decode a binary result. Uncompressed arrays are views of `buffer`, which
+    must therefore outlive them; they are writable when `buffer` is.
+
+    Parameters
+    ----------
+    buffer: Union[bytes, bytearray, memoryview]
+        Buffer holding a binary result, e.g. an HTTP response body or a memmap.
+
+    Returns
+    -------
+    value: Any
+        The decoded array, as a masked array if a mask was sent, or value
+    properties: Union[Dict, List]
+        Properties associated with the result
+    """
+    result = decode_lazy(buffer)
+    return result.value, result.properties
+
+
+def decode_pickle(buffer: Union[bytes, bytearray, memoryview]) -> Tuple[Any, Any]:
+    """Decode a result encoded with the legacy pickle format"""
+    payload = pickle.loads(buffer)
+    return payload["array"], payload["properties"]
+
+
+def decode_any(buffer: Union[bytes, bytearray, memoryview]) -> Tuple[Any, Any]:
+    """Decode a result in either the binary or pickle format"""
+    if is_binary_result(buffer):
+        return decode_result(buffer)
+    return decode_pickle(buffer)
+
+
+def read_response_body(response) -> bytearray:
+    """
+    Read a streamed `requests.Response` body into a single writable buffer.
+
+    When the length of the body is known the buffer is allocated once and
+    filled in place, so the received bytes are copied exactly once.
+
+    Parameters
+    ----------
+    response: requests.Response
+        Response opened with ``stream=True``
+
+    Returns
+    -------
+    body: bytearray
+        Response body
+    """
+    content_length = response.headers.get("Content-Length")
+
+    if content_length is None or response.headers.get("Content-Encoding"):
+        body = bytearray()
+        for chunk in response.iter_content(READ_CHUNK_SIZE):
+            body += chunk
+        return body
+
+    body = bytearray(int(content_length))
+    view = memoryview(body)
+    position = 0
+    for chunk in response.iter_content(READ_CHUNK_SIZE):
+        end = position + len(chunk)
+        if end > len(body):
+            # The server sent more than it announced, fall back to growing.
+            view.release()
+            body[position:] = chunk
+            view = memoryview(body)
+        else:
+            view[position:end] = chunk
+        position = end
+    view.release()
+
+    del body[position:]
+    return body
+
+
+def read_response_metadata(response) -> Tuple[Any, Union[Dict, List]]:
+    """
+    Read only the value and properties of a streamed result, without its array.
+
+    Binary results are read up to the end of their header, so the array isn't
+    transferred even if the server ignored a request for metadata only. Pickled
+    results have to be read in full.
+
+    Parameters
+    ----------
+    response: requests.Response
+        Response opened with ``stream=True``
+
+    Returns
+    -------
+    value: Any
+        The value of the result, or None if the result is an array
+    properties: Union[Dict, List]
+        Properties associated with the result
+    """
+    chunks = response.iter_content(METADATA_READ_CHUNK_SIZE)
+    head = bytearray()
+
+    for chunk in chunks:
+        head += chunk
+        if len(head) < _PREAMBLE.size:
+            continue
+        if not is_binary_result(head):
+            break
+
+        header_length = _PREAMBLE.unpack_from(head)[3]
+        if len(head) >= _PREAMBLE.size + header_length:
+            header = decode_header(head)
+            return header.get("value"), header["properties"]
+
+    for chunk in chunks:
+        head += chunk
+
+    value, properties = decode_any(head)
+    if isinstance(value, np.ndarray):
+        value = None
+    return value, properties
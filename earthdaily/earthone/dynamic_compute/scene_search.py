@@ -0,0 +1,179 @@
+"""Catalog searches equivalent to the scene selection of simple ImageStacks.
+
+Grouping an ImageStack only needs the metadata of its images. For a stack that
+is a product's scenes between two dates, optionally filtered with a catalog
+predicate, `ImageStack.from_product_bands` without further operations, the
+images are exactly those of a catalog image search. `catalog_groups` runs that
+search, a few paged catalog requests, and groups the images locally, rather
+than having the groups computed by a compute job.
+
+This is on by default and can be turned off by setting the
+DYNAMIC_COMPUTE_CATALOG_GROUPING environment variable to 0.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import earthdaily.earthone as eo
+
+from .compute_map import DotDict
+from .group_keys import GroupKeySpec, group_ids, groups_from_keys
+from .operations import is_op, op_args, op_type
+from .proxies import is_datetime_parameter_name
+
+CATALOG_GROUPING = os.getenv("DYNAMIC_COMPUTE_CATALOG_GROUPING", "1") != "0"
+
+# Image attributes that aren't passed to grouping functions, as the product is
+# a related object
+_EXCLUDED_ATTRIBUTES = ("product",)
+
+
+def scene_selection(graft: Dict) -> Optional[Dict[str, Any]]:
+    """
+    The catalog selection of a simple ImageStack graft, see the module
+    documentation.
+
+    Parameters
+    ----------
+    graft: Dict
+        Graft of an ImageStack
+
+    Returns
+    -------
+    selection: Optional[Dict[str, Any]]
+        The product_id, start_datetime, end_datetime and predicate_filter of
+        the stack, or None if the stack isn't simple or its dates are
+        parameters
+    """
+    key = graft["returns"]
+    while is_op(graft.get(key)) and op_type(graft[key]) == "stack_scenes":
+        key = op_args(graft[key])[0]
+
+    node = graft.get(key)
+    if not is_op(node) or op_type(node) != "select_scenes":
+        return None
+
+    args = op_args(node)
+    kwargs = next((arg for arg in args if isinstance(arg, dict)), {})
+    selection = {"product_id": graft[args[0]]}
+    for name in ("start_datetime", "end_datetime", "predicate_filter"):
+        selection[name] = graft.get(kwargs[name]) if name in kwargs else None
+
+    for name in ("start_datetime", "end_datetime"):
+        value = selection[name]
+        if not isinstance(value, str) or is_datetime_parameter_name(value):
+            return None
+
+    return selection
+
+
+def search_scenes(
+    selection: Dict[str, Any],
+    aoi: eo.geo.AOI,
+    catalog_client: Optional[eo.catalog.CatalogClient] = None,
+) -> List[eo.catalog.Image]:
+    """
+    Search the catalog for the images of a selection, see `scene_selection`.
+
+    Parameters
+    ----------
+    selection: Dict[str, Any]
+        The selection
+    aoi: earthdaily.earthone.geo.GeoContext
+        GeoContext the images must intersect
+    catalog_client: Optional[eo.catalog.CatalogClient]
+        Client for the search, by default one with the default auth
+
+    Returns
+    -------
+    images: List[eo.catalog.Image]
+        Images of the selection in order of acquisition, fetched a page at a time
+    """
+    p = eo.catalog.properties
+    search = (
+        eo.catalog.Image.search(client=catalog_client)
+        .filter(p.product_id == selection["product_id"])
+        .filter(p.acquired >= selection["start_datetime"])
+        .filter(p.acquired < selection["end_datetime"])
+        .intersects(aoi)
+        .sort("acquired")
+    )
+    if selection["predicate_filter"]:
+        search = search.filter(
+            eo.core.common.property_filtering.Expression.parse(
+                selection["predicate_filter"]
+            )
+        )
+    return list(search)
+
+
+def scene_metadata(image: eo.catalog.Image) -> DotDict:
+    """
+    The metadata of a catalog image as passed to grouping functions.
+
+    Parameters
+    ----------
+    image: eo.catalog.Image
+        The image
+
+    Returns
+    -------
+    metadata: DotDict
+        The image's attributes, e.g. metadata.acquired.month
+    """
+    return DotDict(
+        {
+            name: getattr(image, name)
+            for name in type(image)._attribute_types
+            if name not in _EXCLUDED_ATTRIBUTES
+        }
+    )
+
+
+def catalog_groups(
+    graft: Dict,
+    aoi: eo.geo.AOI,
+    key: Optional[GroupKeySpec] = None,
+    key_func: Optional[Callable[[DotDict], Hashable]] = None,
+    catalog_client: Optional[eo.catalog.CatalogClient] = None,
+) -> Optional[List[Tuple[Hashable, List[str]]]]:
+    """
+    Group the images of a simple ImageStack from a catalog search.
+
+    Parameters
+    ----------
+    graft: Dict
+        Graft of the ImageStack
+    aoi: earthdaily.earthone.geo.GeoContext
+        GeoContext for which to group the images
+    key: Optional[Union[str, Tuple[str, ...]]]
+        Declarative group key, see `group_keys`
+    key_func: Optional[Callable[[DotDict], Hashable]]
+        Grouping function, applied to the metadata of each image if there is no
+        `key`
+    catalog_client: Optional[eo.catalog.CatalogClient]
+        Client for the search, by default one with the default auth
+
+    Returns
+    -------
+    groups: Optional[List[Tuple[Hashable, List[str]]]]
+        (group key, image ids) pairs, or None if the stack isn't simple, in
+        which case the groups have to be computed
+    """
+    if not CATALOG_GROUPING:
+        return None
+
+    selection = scene_selection(graft)
+    if selection is None:
+        return None
+
+    metadata = [
+        scene_metadata(image)
+        for image in search_scenes(selection, aoi, catalog_client)
+    ]
+    if key is not None:
+        return group_ids(metadata, key)
+    ids = [image["id"] for image in metadata]
+    return groups_from_keys(ids, [key_func(image) for image in metadata])
@@ -0,0 +1,367 @@
+"""In-memory cache of compute results on a fixed tile grid.
+
+The result cache (see `result_cache`) only hits when an AOI is requested again
+exactly. Interactive use, e.g. panning `Map.geocontext()`, or computing over
+adjacent fields, instead produces AOIs which overlap without being identical.
+
+The spatial cache snaps such AOIs to a grid of square tiles in the AOI's CRS,
+anchored at the CRS origin, with one grid per resolution. Only the tiles not
+already cached are computed, and the requested window is then assembled from
+cached and freshly computed tiles.
+
+The window returned is the AOI's bounds, transformed into its CRS and expanded
+outwards to whole pixels of the grid. AOIs that can't be placed on a grid, i.e.
+those with a geometry, including DLTiles and XYZTiles, which are clipped to
+their footprint, or with a shape instead of a resolution, are computed
+directly. When nothing of an AOI is cached, one tile is computed first, to
+check that the result is an array. Once the tiles of a grid couldn't be
+assembled, e.g. those of an ImageStack whose scenes differ between tiles, AOIs
+of that grid are computed directly too.
+
+The cache is disabled by default. Enable it with `configure_spatial_cache`, or
+by setting the DYNAMIC_COMPUTE_TILE_SIZE environment variable.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import earthdaily.earthone as eo
+import numpy as np
+import pyproj
+
+from . import metrics, tracing
+
+DEFAULT_TILE_SIZE = 512
+DEFAULT_MAX_BYTES = 2**30
+DEFAULT_MAX_WORKERS = 8
+MAX_TILES = 1024
+
+Result = Tuple[Any, Union[Dict, List]]
+TileIndex = Tuple[int, int]
+
+_cache: Optional[SpatialCache] = None
+_cache_lock = threading.Lock()
+
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, np.ma.MaskedArray):
+        return value.data.nbytes + np.ma.getmaskarray(value).nbytes
+    return value.nbytes
+
+
+def _to_crs_bounds(aoi: eo.geo.AOI) -> Tuple[float, float, float, float]:
+    if pyproj.CRS.from_user_input(aoi.bounds_crs) == pyproj.CRS.from_user_input(
+        aoi.crs
+    ):
+        return tuple(aoi.bounds)
+
+    transformer = pyproj.Transformer.from_crs(aoi.bounds_crs, aoi.crs, always_xy=True)
+    return transformer.transform_bounds(*aoi.bounds, densify_pts=21)
+
+
+class SpatialCache:
+    """
+    A size-bounded, least-recently-used cache of result tiles.
+
+    Parameters
+    ----------
+    tile_size: int
+        Width and height of the tiles, in pixels.
+    max_bytes: int
+        Total size of cached tiles above which the least recently used are evicted.
+    max_workers: int
+        Maximum number of tiles computed concurrently.
+    """
+
+    def __init__(
+        self,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        self.tile_size = int(tile_size)
+        self.max_bytes = int(max_bytes)
+        self.max_workers = int(max_workers)
+
+        self._tiles: OrderedDict[Tuple[str, TileIndex], Result] = OrderedDict()
+        self._nbytes = 0
+        # Grids whose tiles couldn't be assembled, which are computed directly
+        self._unassemblable = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def supports(aoi: eo.geo.AOI) -> bool:
+        """Whether an AOI can be placed on a tile grid"""
+        return (
+            aoi.geometry is None
+            and aoi.bounds is not None
+            and aoi.resolution is not None
+            and aoi.crs is not None
+        )
+
+    def window(self, aoi: eo.geo.AOI) -> Tuple[int, int, int, int]:
+        """
+        The window of the grid covering an AOI.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.AOI
+            AOI with bounds and a resolution
+
+        Returns
+        -------
+        window: Tuple[int, int, int, int]
+            Pixel bounds ``(x0, y0, x1, y1)`` of the window, with y increasing
+            northwards like the CRS's y axis
+        """
+        minx, miny, maxx, maxy = _to_crs_bounds(aoi)
+        resolution = aoi.resolution
+        return (
+            math.floor(minx / resolution),
+            math.floor(miny / resolution),
+            math.ceil(maxx / resolution),
+            math.ceil(maxy / resolution),
+        )
+
+    def tiles(self, window: Tuple[int, int, int, int]) -> Optional[List[TileIndex]]:
+        """Indices of the tiles intersecting a window, or None if there are too many"""
+        x0, y0, x1, y1 = window
+        size = self.tile_size
+        columns = range(x0 // size, (x1 - 1) // size + 1)
+        rows = range(y0 // size, (y1 - 1) // size + 1)
+        if len(columns) * len(rows) > MAX_TILES:
+            return None
+        return [(tx, ty) for ty in rows for tx in columns]
+
+    def tile_aoi(self, aoi: eo.geo.AOI, tile: TileIndex) -> eo.geo.AOI:
+        """The AOI of a tile of the grid of an AOI"""
+        tx, ty = tile
+        extent = self.tile_size * aoi.resolution
+        return eo.geo.AOI(
+            bounds=(tx * extent, ty * extent, (tx + 1) * extent, (ty + 1) * extent),
+            bounds_crs=aoi.crs,
+            crs=aoi.crs,
+            resolution=aoi.resolution,
+            align_pixels=False,
+            all_touched=aoi.all_touched,
+        )
+
+    def _get(self, key: Tuple[str, TileIndex]) -> Optional[Result]:
+        with self._lock:
+            result = self._tiles.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._tiles.move_to_end(key)
+
+        metrics.counter(
+            "dynamic_compute_cache_requests_total",
+            "Cache lookups",
+            cache="spatial",
+            result="miss" if result is None else "hit",
+        ).inc()
+        return result
+
+    def _put(self, key: Tuple[str, TileIndex], result: Result):
+        nbytes = _nbytes(result[0])
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = result
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                _, (evicted, _) = self._tiles.popitem(last=False)
+                self._nbytes -= _nbytes(evicted)
+
+    @staticmethod
+    def _is_raster(value: Any) -> bool:
+        """Whether a tile's value is an array that tiles can be assembled from"""
+        return isinstance(value, np.ndarray) and value.ndim >= 2
+
+    def _assemble(
+        self,
+        window: Tuple[int, int, int, int],
+        tiles: Dict[TileIndex, Result],
+    ) -> Optional[Result]:
+        x0, y0, x1, y1 = window
+        size = self.tile_size
+
+        first_value, properties = next(iter(tiles.values()))
+        if not self._is_raster(first_value):
+            return None
+        leading_shape = first_value.shape[:-2]
+
+        for value, tile_properties in tiles.values():
+            if (
+                not isinstance(value, np.ndarray)
+                or value.shape != leading_shape + (size, size)
+                or value.dtype != first_value.dtype
+                or tile_properties != properties
+            ):
+                # e.g. an ImageStack whose scenes differ between tiles
+                return None
+
+        data = np.empty(leading_shape + (y1 - y0, x1 - x0), dtype=first_value.dtype)
+        mask = np.zeros(data.shape, dtype=bool)
+
+        for (tx, ty), (value, _) in tiles.items():
+            xa, xb = max(x0, tx * size), min(x1, (tx + 1) * size)
+            ya, yb = max(y0, ty * size), min(y1, (ty + 1) * size)
+
+            # Rows run southwards from the top of the tile or the window
+            tile_top = (ty + 1) * size
+            source = (
+                ...,
+                slice(tile_top - yb, tile_top - ya),
+                slice(xa - tx * size, xb - tx * size),
+            )
+            target = (..., slice(y1 - yb, y1 - ya), slice(xa - x0, xb - x0))
+
+            data[target] = np.ma.getdata(value)[source]
+            mask[target] = np.ma.getmaskarray(value)[source]
+
+        return np.ma.masked_array(data, mask), properties
+
+    def compute(
+        self,
+        aoi: eo.geo.AOI,
+        key: str,
+        fetch: Callable[[eo.geo.AOI], Result],
+    ) -> Optional[Result]:
+        """
+        Compute an AOI from cached and freshly computed tiles.
+
+        Parameters
+        ----------
+        aoi: earthdaily.earthone.geo.AOI
+            AOI to compute, which must be supported, see `supports`.
+        key: str
+            Identifies everything but the AOI the result depends on, e.g. the
+            graft and parameters.
+        fetch: Callable[[earthdaily.earthone.geo.AOI], Tuple[Any, Union[Dict, List]]]
+            Computes the AOI of a single tile.
+
+        Returns
+        -------
+        result: Optional[Tuple[Any, Union[Dict, List]]]
+            The assembled ``(value, properties)``, or None if the tiles can't be
+            assembled, in which case the AOI should be computed directly. Once
+            the tiles of a grid couldn't be assembled, no more are computed.
+        """
+        grid_key = hashlib.sha256(
+            json.dumps(
+                [key, str(aoi.crs), aoi.resolution, aoi.all_touched, self.tile_size]
+            ).encode("utf-8")
+        ).hexdigest()
+
+        if grid_key in self._unassemblable:
+            return None
+
+        window = self.window(aoi)
+        indices = self.tiles(window)
+        if indices is None:
+            return None
+
+        tiles: Dict[TileIndex, Result] = {}
+        missing = []
+        for tile in indices:
+            result = self._get((grid_key, tile))
+            if result is None:
+                missing.append(tile)
+            else:
+                tiles[tile] = result
+
+        if len(missing) > 1 and not tiles:
+            # Check that the result is an array before computing every tile
+            tile = missing[0]
+            tiles[tile] = fetch(self.tile_aoi(aoi, tile))
+            if not self._is_raster(tiles[tile][0]):
+                self._unassemblable.add(grid_key)
+                return None
+
+        unfetched = [tile for tile in missing if tile not in tiles]
+        if unfetched:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(unfetched))
+            ) as executor:
+                fetched = executor.map(
+                    tracing.propagate(lambda tile: fetch(self.tile_aoi(aoi, tile))),
+                    unfetched,
+                )
+                for tile, result in zip(unfetched, fetched):
+                    tiles[tile] = result
+
+        assembled = self._assemble(window, tiles)
+        if assembled is None:
+            # e.g. an ImageStack whose scenes differ between tiles. Later AOIs
+            # of the grid are computed directly rather than from tiles again.
+            self._unassemblable.add(grid_key)
+            return None
+
+        for tile in missing:
+            self._put((grid_key, tile), tiles[tile])
+        return assembled
+
+    def clear(self):
+        """Remove every tile from the cache"""
+        with self._lock:
+            self._tiles.clear()
+            self._nbytes = 0
+            self._unassemblable.clear()
+
+
+def configure_spatial_cache(
+    tile_size: Optional[int] = DEFAULT_TILE_SIZE,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> Optional[SpatialCache]:
+    """
+    Enable, reconfigure or, with a tile_size of None, disable the spatial cache used
+    by `compute_aoi`.
+
+    Parameters
+    ----------
+    tile_size: Optional[int]
+        Width and height of the tiles, in pixels.
+    max_bytes: int
+        Maximum total size of the cached tiles, defaults to 1 GiB.
+    max_workers: int
+        Maximum number of tiles computed concurrently.
+
+    Returns
+    -------
+    cache: Optional[SpatialCache]
+        The configured cache
+    """
+    global _cache
+
+    with _cache_lock:
+        _cache = (
+            SpatialCache(tile_size, max_bytes, max_workers) if tile_size else None
+        )
+
+    return _cache
+
+
+def get_spatial_cache() -> Optional[SpatialCache]:
+    """Return the configured spatial cache, or None if it is disabled"""
+    return _cache
+
+
+if os.getenv("DYNAMIC_COMPUTE_TILE_SIZE"):
+    configure_spatial_cache(int(os.environ["DYNAMIC_COMPUTE_TILE_SIZE"]))
@@ -0,0 +1,10 @@
+"""Utilities for exercising the client without access to the production API
+
+See also `testing.load_test`, which load tests the client's compute paths
+against a `StubServer`.
+"""
+
+from .recorder import Recording, SessionRecorder
+from .stub_server import StubAuth, StubServer
+
+__all__ = ["StubServer", "StubAuth", "SessionRecorder", "Recording"]
@@ -0,0 +1,264 @@
+"""Load test the client's compute paths against a local stub server.
+
+Requests are issued from a pool of threads through the client's real request
+path, transport included, and the throughput and latency percentiles of the
+calls are reported. The stub serves synthetic arrays, or a recorded session,
+with optional latency, bandwidth and failure injection, see `StubServer`.
+
+The load test can also be run from the command line, e.g.
+
+.. code-block:: bash
+
+    python -m earthdaily.earthone.dynamic_compute.testing.load_test \\
+        --path compute --requests 500 --concurrency 32 --latency 0.05
+
+Paths
+-----
+* ``compute``, `operations.compute_aoi` of distinct AOIs,
+* ``value_at``, `operations.value_at` of distinct points,
+* ``sample_points``, `operations.value_at_many` of batches of points,
+* ``register``, layer registration of distinct grafts.
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import earthdaily.earthone as eo
+import numpy as np
+
+from .. import operations
+from ..graft import client as graft_client
+from .recorder import Recording
+from .stub_server import StubAuth, StubServer
+
+PATHS = ("compute", "value_at", "sample_points", "register")
+PERCENTILES = (50, 90, 95, 99)
+SAMPLE_BATCH_SIZE = 16
+
+
+@dataclasses.dataclass
+class LoadTestReport:
+    """Throughput and latency of a load test"""
+
+    path: str
+    requests: int
+    concurrency: int
+    errors: int
+    duration: float
+    latencies: np.ndarray = dataclasses.field(repr=False)
+
+    @property
+    def throughput(self) -> float:
+        """Successful calls per second"""
+        completed = self.requests - self.errors
+        return completed / self.duration if self.duration else float("nan")
+
+    def percentile(self, q: float) -> float:
+        """A percentile of the latencies of successful calls, in seconds"""
+        if not len(self.latencies):
+            return float("nan")
+        return float(np.percentile(self.latencies, q))
+
+    def __str__(self) -> str:
+        lines = [
+            f"path:        {self.path}",
+            f"requests:    {self.requests} ({self.errors} failed)",
+            f"concurrency: {self.concurrency}",
+            f"duration:    {self.duration:.3f}s",
+            f"throughput:  {self.throughput:.1f}/s",
+        ]
+        for q in PERCENTILES:
+            lines.append(f"p{q}:{'':<9}{self.percentile(q) * 1e3:.1f}ms")
+        lines.append(f"max:{'':<9}{self.percentile(100) * 1e3:.1f}ms")
+        return "\n".join(lines)
+
+
+def _aoi(i: int, shape: Tuple[int, int]) -> eo.geo.AOI:
+    # Distinct AOIs, so requests aren't deduplicated or cached
+    x, y = (i % 3600) / 10 - 180, (i // 3600) % 1700 / 10 - 85
+    return eo.geo.AOI(
+        bounds=(x, y, x + 0.01, y + 0.01), crs="EPSG:4326", shape=shape
+    )
+
+
+def _calls(
+    path: str,
+    graft: dict,
+    auth: StubAuth,
+    shape: Tuple[int, int],
+    recording: Optional[Recording],
+) -> Callable[[int], object]:
+    if path == "compute":
+        if recording is not None:
+            recorded = list(recording.requests())
+            if not recorded:
+                raise ValueError("The recording holds no computes to replay")
+
+            def call(i):
+                graft, aoi, parameters = recorded[i % len(recorded)]
+                return operations.compute_aoi(
+                    graft, aoi, use_cache=False, tiled=False, auth=auth, **parameters
+                )
+
+            return call
+
+        return lambda i: operations.compute_aoi(
+            graft, _aoi(i, shape), use_cache=False, tiled=False, auth=auth
+        )
+
+    if path == "value_at":
+        return lambda i: operations.value_at(
+            graft, (i // 3600) % 1700 / 10 - 85, (i % 3600) / 10 - 180, auth=auth
+        )
+
+    if path == "sample_points":
+
+        def call(i):
+            offsets = np.arange(SAMPLE_BATCH_SIZE) * 0.01
+            return operations.value_at_many(
+                graft, offsets + (i % 1700) / 10 - 85, offsets, auth=auth
+            )
+
+        return call
+
+    if path == "register":
+        return lambda i: operations._register_layer(
+            graft_client.apply_graft("math", "add", graft, i), auth
+        )
+
+    raise ValueError(f"Unknown path {path!r}, expected one of {PATHS}")
+
+
+def run_load_test(
+    path: str = "compute",
+    requests: int = 100,
+    concurrency: int = 8,
+    shape: Tuple[int, ...] = (3, 256, 256),
+    server: Optional[StubServer] = None,
+    recording: Optional[str] = None,
+    **server_kwargs,
+) -> LoadTestReport:
+    """
+    Issue calls along one of the client's compute paths against a local stub.
+
+    Parameters
+    ----------
+    path: str
+        Compute path to exercise, one of "compute", "value_at", "sample_points"
+        or "register".
+    requests: int
+        Number of calls to make.
+    concurrency: int
+        Number of threads making calls.
+    shape: Tuple[int, ...]
+        Shape of the synthetic arrays the stub serves, the last two dimensions
+        are also the shape of the computed AOIs.
+    server: Optional[StubServer]
+        Stub to test against. By default one is started for the test.
+    recording: Optional[str]
+        Path of a recorded session to replay. Its computes are issued in turn
+        by the "compute" path and are served by the stub.
+    **server_kwargs:
+        Further arguments of the stub, e.g. latency, bandwidth or failure_rate.
+
+    Returns
+    -------
+    report: LoadTestReport
+    """
+    loaded = Recording.load(recording) if recording is not None else None
+    if server is None:
+        if loaded is not None:
+            server = StubServer.from_recording(loaded, **server_kwargs)
+        else:
+            server = StubServer(
+                result=np.ma.masked_array(np.random.random(shape), False),
+                **server_kwargs,
+            )
+
+    graft = graft_client.apply_graft("mosaic", "load-test", "red green blue")
+    call = _calls(path, graft, StubAuth(), tuple(shape[-2:]), loaded)
+
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed(i: int):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    api_host = operations.API_HOST
+    with server:
+        operations.API_HOST = server.url
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(timed, range(requests)))
+            duration = time.perf_counter() - start
+        finally:
+            operations.API_HOST = api_host
+
+    return LoadTestReport(
+        path=path,
+        requests=requests,
+        concurrency=concurrency,
+        errors=errors,
+        duration=duration,
+        latencies=np.array(latencies),
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", choices=PATHS, default="compute")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--shape",
+        type=lambda value: tuple(int(n) for n in value.split(",")),
+        default=(3, 256, 256),
+        help="Shape of the served arrays, e.g. 3,256,256",
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--bandwidth", type=float, help="Bytes per second")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int)
+    parser.add_argument(
+        "--formats", default="binary,pickle", help="Result formats the stub serves"
+    )
+    parser.add_argument("--compression", choices=("blosc2",))
+    parser.add_argument("--recording", help="Recorded session to replay")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(
+        path=args.path,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        shape=args.shape,
+        recording=args.recording,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        failure_rate=args.failure_rate,
+        max_concurrency=args.max_concurrency,
+        formats=tuple(args.formats.split(",")),
+        compression=args.compression,
+    )
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
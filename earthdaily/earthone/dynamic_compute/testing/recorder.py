@@ -0,0 +1,279 @@
+"""Record sessions against the compute API and replay them against a stub.
+
+`SessionRecorder` observes the client's transport (see `transport.add_observer`)
+and writes a JSON-lines file with one entry per request: the graft of each
+registered layer, and the AOI, parameters, response size, latency and a
+description of the result of each compute. Credentials are never recorded.
+Optionally the computed arrays themselves are saved next to the file.
+
+A `Recording` loads such a file, and can serve it from a `StubServer`, with the
+recorded arrays where they were saved and synthetic arrays of the recorded
+shape, dtype and masked fraction otherwise.
+
+Example
+-------
+>>> from earthdaily.earthone.dynamic_compute.testing import (
+...     Recording, SessionRecorder, StubServer
+... )
+>>> with SessionRecorder("session.jsonl"): # doctest: +SKIP
+...     image.compute(aoi) # doctest: +SKIP
+>>> with StubServer.from_recording("session.jsonl") as server: # doctest: +SKIP
+...     operations.API_HOST = server.url # doctest: +SKIP
+...     image.compute(aoi) # doctest: +SKIP
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import earthdaily.earthone as eo
+import numpy as np
+
+from .. import transport
+from ..operations import graft_fingerprint
+
+# Fields of an ``/aoi`` request body describing the client rather than the compute
+_CLIENT_FIELDS = ("python_version", "dynamic_compute_version")
+# Fields of an ``/aoi`` request body describing the AOI
+_AOI_FIELDS = (
+    "geometry",
+    "resolution",
+    "crs",
+    "align_pixels",
+    "bounds",
+    "bounds_crs",
+    "shape",
+    "all_touched",
+)
+
+
+def _jsonable(obj: Any) -> Any:
+    return json.loads(json.dumps(obj, default=str))
+
+
+def _describe(value: Any) -> Dict:
+    if isinstance(value, np.ndarray):
+        return {
+            "shape": list(value.shape),
+            "dtype": value.dtype.str,
+            "masked": float(np.ma.getmaskarray(value).mean()) if value.size else 0.0,
+        }
+    return {"value": _jsonable(value)}
+
+
+def request_key(graft: Dict, body: Dict) -> str:
+    """
+    Identify a compute by its graft and request body, ignoring layer ids and
+    client versions, so a compute can be matched with its recording.
+    """
+    description = {
+        "graft": graft_fingerprint(graft),
+        **{k: v for k, v in body.items() if k not in _CLIENT_FIELDS},
+    }
+    encoded = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SessionRecorder:
+    """
+    Record the client's requests to the compute API while active.
+
+    Parameters
+    ----------
+    path: str
+        JSON-lines file to write the session to, overwritten if it exists.
+    save_arrays: bool
+        Also save computed arrays, in a directory next to `path`, so they can
+        be served exactly when replaying.
+    """
+
+    def __init__(self, path: str, save_arrays: bool = False):
+        self.path = path
+        self.save_arrays = save_arrays
+        self.array_directory = path + ".arrays"
+        self.entries = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self) -> SessionRecorder:
+        if self.save_arrays:
+            os.makedirs(self.array_directory, exist_ok=True)
+        self._file = open(self.path, "w")
+        transport.add_observer(self._observe)
+        return self
+
+    def __exit__(self, *args):
+        transport.remove_observer(self._observe)
+        self._file.close()
+        self._file = None
+
+    def _observe(self, exchange: transport.Exchange):
+        content_length = exchange.response_headers.get("Content-Length")
+        entry = {
+            "endpoint": exchange.endpoint,
+            "path": urlparse(exchange.url).path,
+            "status": exchange.status,
+            "elapsed": exchange.elapsed,
+            "response_bytes": int(content_length) if content_length else None,
+            "content_type": exchange.response_headers.get("Content-Type"),
+            "time": time.time(),
+        }
+
+        if exchange.endpoint == "layers":
+            entry["graft"] = exchange.request["graft"]
+            entry["layer_id"] = exchange.result
+        elif exchange.endpoint == "aoi":
+            value, properties = exchange.result
+            entry["request"] = _jsonable(
+                {
+                    k: v
+                    for k, v in (exchange.request or {}).items()
+                    if k not in _CLIENT_FIELDS
+                }
+            )
+            entry["result"] = _describe(value)
+            entry["properties"] = _jsonable(properties)
+
+        with self._lock:
+            if (
+                self.save_arrays
+                and exchange.endpoint == "aoi"
+                and isinstance(exchange.result[0], np.ndarray)
+            ):
+                name = f"{self.entries}.npz"
+                value = exchange.result[0]
+                np.savez(
+                    os.path.join(self.array_directory, name),
+                    data=np.ma.getdata(value),
+                    mask=np.ma.getmaskarray(value),
+                )
+                entry["result"]["array"] = name
+
+            self._file.write(json.dumps(entry, default=str) + "\n")
+            self._file.flush()
+            self.entries += 1
+
+
+class Recording:
+    """
+    A session recorded with `SessionRecorder`.
+
+    Parameters
+    ----------
+    entries: List[Dict]
+        The recorded entries
+    array_directory: Optional[str]
+        Directory holding the arrays saved with the session, if any
+    """
+
+    def __init__(self, entries: List[Dict], array_directory: Optional[str] = None):
+        self.entries = entries
+        self.array_directory = array_directory
+        self.layers: Dict[str, Dict] = {
+            entry["layer_id"]: entry["graft"]
+            for entry in entries
+            if entry["endpoint"] == "layers"
+        }
+
+        self._computes: Dict[str, Dict] = {}
+        for entry in self.computes:
+            graft = self.layers.get(self._layer_id(entry))
+            if graft is not None:
+                self._computes.setdefault(request_key(graft, entry["request"]), entry)
+
+    @classmethod
+    def load(cls, path: str) -> Recording:
+        """Load a recording written by `SessionRecorder`"""
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        array_directory = path + ".arrays"
+        return cls(
+            entries, array_directory if os.path.isdir(array_directory) else None
+        )
+
+    @staticmethod
+    def _layer_id(entry: Dict) -> str:
+        return entry["path"].rstrip("/").split("/")[-2]
+
+    @property
+    def computes(self) -> List[Dict]:
+        """The recorded computes, in the order they completed"""
+        return [entry for entry in self.entries if entry["endpoint"] == "aoi"]
+
+    def requests(self) -> Iterator[Tuple[Dict, eo.geo.AOI, Dict]]:
+        """
+        The recorded computes as ``(graft, aoi, parameters)``, e.g. to issue them
+        again with `operations.compute_aoi`.
+        """
+        for entry in self.computes:
+            graft = self.layers.get(self._layer_id(entry))
+            if graft is None:
+                continue
+            body = entry["request"]
+            aoi = eo.geo.AOI(**{k: body[k] for k in _AOI_FIELDS if k in body})
+            yield graft, aoi, body.get("parameters", {})
+
+    def _result(self, entry: Dict, key: str) -> Tuple[Any, Union[Dict, List]]:
+        description = entry["result"]
+        properties = entry.get("properties", {})
+
+        if "value" in description:
+            return description["value"], properties
+
+        if "array" in description and self.array_directory is not None:
+            with np.load(os.path.join(self.array_directory, description["array"])) as f:
+                return np.ma.masked_array(f["data"], f["mask"]), properties
+
+        # Synthesize an array like the recorded one, the same for each request
+        rng = np.random.default_rng(int(key[:8], 16))
+        shape = tuple(description["shape"])
+        dtype = np.dtype(description["dtype"])
+        if dtype.kind == "b":
+            data = rng.random(shape) < 0.5
+        elif dtype.kind in "iu":
+            info = np.iinfo(dtype)
+            data = rng.integers(max(info.min, 0), min(info.max, 10000), shape)
+        else:
+            data = rng.random(shape)
+        mask = rng.random(shape) < description["masked"]
+        return np.ma.masked_array(data.astype(dtype), mask), properties
+
+    def result_factory(
+        self,
+        default: Optional[Tuple[Any, Union[Dict, List]]] = None,
+        replay_latency: bool = False,
+    ):
+        """
+        A result factory for `StubServer` serving the recorded computes.
+
+        Parameters
+        ----------
+        default: Optional[Tuple[Any, Union[Dict, List]]]
+            Result for computes that weren't recorded. By default they fail.
+        replay_latency: bool
+            Delay each result by the latency observed when it was recorded.
+
+        Returns
+        -------
+        factory: Callable[[Dict, Dict], Tuple[Any, Union[Dict, List]]]
+        """
+
+        def factory(graft: Dict, body: Dict) -> Tuple[Any, Union[Dict, List]]:
+            key = request_key(graft, body)
+            entry = self._computes.get(key)
+            if entry is None:
+                if default is None:
+                    raise LookupError("No recorded result for this compute")
+                return default
+
+            if replay_latency:
+                time.sleep(entry["elapsed"])
+            return self._result(entry, key)
+
+        return factory
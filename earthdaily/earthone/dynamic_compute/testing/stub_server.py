@@ -0,0 +1,504 @@
+"""A minimal local stand-in for the dynamic-compute API.
+
+The stub implements just enough of the API for the client:
+
+* ``POST /layers/`` registers a graft,
+* ``POST /layers/{layer_id}/aoi`` computes an AOI, served in either the binary
+  or the pickle result format depending on what the client asks for and what
+  the stub is configured to allow. Metadata-only requests are answered without
+  the array,
+* ``GET /layers/{layer_id}/tile/{z}/{x}/{y}`` serves a synthetic PNG tile,
+* ``GET`` and ``POST /cache/orgfuncs/geofencing/{org}`` read and store an
+  org's geofence.
+
+Latency, limited bandwidth and failures can be injected to emulate a remote or
+unreliable service, and recorded sessions can be replayed, see
+`StubServer.from_recording`.
+
+Example
+-------
+>>> import numpy as np
+>>> from earthdaily.earthone.dynamic_compute import operations
+>>> from earthdaily.earthone.dynamic_compute.testing import StubServer
+>>> with StubServer(result=np.ma.ones((3, 64, 64))) as server: # doctest: +SKIP
+...     operations.API_HOST = server.url # doctest: +SKIP
+...     array, properties = operations.compute_aoi(graft, aoi, auth=auth) # doctest: +SKIP
+"""
+
+from __future__ import annotations
+
+import email.parser
+import email.policy
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .. import result_format
+from .recorder import Recording
+
+ResultFactory = Callable[[Dict, Dict], Tuple[Any, Union[Dict, List]]]
+
+_AOI_PATH = re.compile(r"^/layers/(?P<layer_id>[^/]+)/aoi/?$")
+_TILE_PATH = re.compile(
+    r"^/layers/(?P<layer_id>[^/]+)/tile/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)/?(\?.*)?$"
+)
+_GEOFENCING_PATH = re.compile(r"^/cache/orgfuncs/geofencing/(?P<org>[^/?]+)/?$")
+
+TILE_SIZE = 256
+WRITE_CHUNK_SIZE = 2**16
+
+
+def _png(pixels: np.ndarray) -> bytes:
+    """Encode an 8-bit RGBA array of shape (height, width, 4) as a PNG"""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    height, width, _ = pixels.shape
+    # Each row is prefixed with filter type 0 (None)
+    rows = np.concatenate(
+        [np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, -1)], axis=1
+    )
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows.tobytes()))
+        + chunk(b"IEND", b"")
+    )
+
+
+def synthetic_tile(z: int, x: int, y: int) -> bytes:
+    """A PNG tile with a gradient that differs between neighbouring tiles"""
+    ramp = np.linspace(0, 255, TILE_SIZE, dtype=np.uint8)
+    pixels = np.empty((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    pixels[..., 0] = ramp[None, :]
+    pixels[..., 1] = ramp[:, None]
+    pixels[..., 2] = (x * 53 + y * 97 + z * 31) % 256
+    pixels[..., 3] = 255
+    return _png(pixels)
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    server: _StubHTTPServer
+
+    def log_message(self, format, *args):
+        # Keep test output quiet
+        pass
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send(
+        self, status: int, body: bytes, content_type: str, headers: Dict = None
+    ):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.server.stub._write(self.wfile, body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients reading only the header of a result hang up early
+            pass
+
+    def _send_json(self, status: int, payload: Any, headers: Dict = None):
+        self._send(
+            status, json.dumps(payload).encode("utf-8"), "application/json", headers
+        )
+
+    def _inject(self) -> bool:
+        """Apply the stub's latency and failures, True if a failure was sent"""
+        stub = self.server.stub
+        delay = stub._delay()
+        if delay:
+            time.sleep(delay)
+        if stub._fail():
+            self._send_json(stub.failure_status, {"detail": "Injected failure"})
+            return True
+        return False
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub._record(self.command, self.path, dict(self.headers), None)
+        if self._inject():
+            return
+
+        match = _TILE_PATH.match(self.path)
+        if match is not None:
+            if match.group("layer_id") not in stub.layers:
+                self._send_json(404, {"detail": "Unknown layer"})
+                return
+            tile = synthetic_tile(
+                int(match.group("z")), int(match.group("x")), int(match.group("y"))
+            )
+            self._send(200, tile, "image/png")
+            return
+
+        match = _GEOFENCING_PATH.match(self.path)
+        if match is not None:
+            with stub._lock:
+                fence = stub.fences.get(match.group("org"), b"")
+            self._send(200, fence, "application/json")
+            return
+
+        self._send_json(404, {"detail": f"Unknown path {self.path}"})
+
+    def _store_fence(self, org: str):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: "
+            + self.headers.get("Content-Type", "").encode("latin-1")
+            + b"\r\n\r\n"
+            + raw
+        )
+        stub = self.server.stub
+        stub._record(self.command, self.path, dict(self.headers), None)
+        if self._inject():
+            return
+
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "fence":
+                with stub._lock:
+                    stub.fences[org] = part.get_payload(decode=True)
+                self._send_json(200, {})
+                return
+        self._send_json(422, {"detail": "Missing fence"})
+
+    def do_POST(self):
+        stub = self.server.stub
+
+        match = _GEOFENCING_PATH.match(self.path)
+        if match is not None:
+            self._store_fence(match.group("org"))
+            return
+
+        body = self._read_json()
+        stub._record(self.command, self.path, dict(self.headers), body)
+        if self._inject():
+            return
+
+        if self.path.rstrip("/") == "/layers":
+            layer_id = stub.register_layer(body["graft"])
+            self._send_json(200, {"layer_id": layer_id})
+            return
+
+        match = _AOI_PATH.match(self.path)
+        if match is None:
+            self._send_json(404, {"detail": f"Unknown path {self.path}"})
+            return
+
+        graft = stub.layers.get(match.group("layer_id"))
+        if graft is None:
+            self._send_json(404, {"detail": "Unknown layer"})
+            return
+
+        if not stub._admit():
+            headers = {}
+            if stub.retry_after is not None:
+                headers["Retry-After"] = str(stub.retry_after)
+            self._send_json(429, {"detail": "Too many requests"}, headers)
+            return
+
+        try:
+            value, properties = stub.evaluate(graft, body)
+        except Exception as e:
+            self._send_json(500, {"detail": f"{type(e).__name__}: {e}"})
+            return
+        finally:
+            stub._finish()
+
+        if body.get("metadata_only") and isinstance(value, np.ndarray):
+            value = None
+        payload, content_type = stub.encode(
+            value, properties, self.headers.get("Accept"), body.get("output")
+        )
+        self._send(200, payload, content_type)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under load tests
+    request_queue_size = 1024
+
+    def __init__(self, address, handler, stub: StubServer):
+        super().__init__(address, handler)
+        self.stub = stub
+
+
+class StubAuth:
+    """
+    Stands in for `earthdaily.earthone.auth.Auth` when talking to a stub.
+
+    Parameters
+    ----------
+    org: str
+        Organization of the user
+    token: str
+        Bearer token sent with requests
+    """
+
+    def __init__(self, org: str = "stub", token: str = "stub-token"):
+        self.token = token
+        self.payload = {"org": org}
+
+
+class StubServer:
+    """
+    A local, in-process HTTP server mimicking the dynamic-compute compute API.
+
+    Parameters
+    ----------
+    result: Union[numpy.ndarray, ResultFactory, None]
+        Either the array to return for every compute, or a callable taking the
+        registered graft and the JSON body of the ``/aoi`` request and returning a
+        ``(value, properties)`` tuple. Defaults to a small masked array.
+    properties: Union[Dict, List, None]
+        Properties returned alongside `result` when it is an array.
+    formats: Tuple[str, ...]
+        Result formats the stub is allowed to respond with, a subset of
+        ``("binary", "pickle")``.
+    compression: Optional[str]
+        Compression to use for binary results, either None or "blosc2".
+    host: str
+        Interface to bind to.
+    port: int
+        Port to bind to, by default an ephemeral port is chosen.
+    max_concurrency: Optional[int]
+        Number of computes the stub evaluates at once. Computes beyond it are
+        answered with 429 Too Many Requests, like an overloaded server.
+    retry_after: Optional[float]
+        Retry-After delay in seconds to send with 429 responses.
+    latency: Union[float, Callable[[], float]]
+        Delay in seconds before answering each request, or a callable returning
+        one, e.g. to draw delays from a distribution.
+    bandwidth: Optional[float]
+        Rate in bytes per second at which response bodies are sent.
+    failure_rate: float
+        Fraction of requests, chosen at random, answered with `failure_status`.
+    failure_status: int
+        Status code of injected failures.
+    seed: Optional[int]
+        Seed for the choice of failed requests.
+    """
+
+    def __init__(
+        self,
+        result: Union[np.ndarray, ResultFactory, None] = None,
+        properties: Union[Dict, List, None] = None,
+        formats: Tuple[str, ...] = ("binary", "pickle"),
+        compression: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_concurrency: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        latency: Union[float, Callable[[], float]] = 0.0,
+        bandwidth: Optional[float] = None,
+        failure_rate: float = 0.0,
+        failure_status: int = 503,
+        seed: Optional[int] = None,
+    ):
+        if result is None:
+            result = np.ma.masked_array(np.zeros((1, 8, 8)), False)
+
+        self.result = result
+        self.properties = properties if properties is not None else {}
+        self.formats = formats
+        self.compression = compression
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.in_flight = 0
+        self.throttled = 0
+        self.failed = 0
+        self.layers: Dict[str, Dict] = {}
+        self.fences: Dict[str, bytes] = {}
+        self._random = random.Random(seed)
+        self.requests: List[Dict] = []
+        self._lock = threading.Lock()
+        self._server = _StubHTTPServer((host, port), _StubRequestHandler, self)
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_recording(
+        cls,
+        recording: Union[str, Recording],
+        default: Optional[Tuple[Any, Union[Dict, List]]] = None,
+        replay_latency: bool = False,
+        **kwargs,
+    ) -> StubServer:
+        """
+        A stub serving the computes of a recorded session, see `SessionRecorder`.
+
+        Parameters
+        ----------
+        recording: Union[str, Recording]
+            The recording, or the path of its file
+        default: Optional[Tuple[Any, Union[Dict, List]]]
+            Result for computes that weren't recorded. By default they fail.
+        replay_latency: bool
+            Delay each result by the latency observed when it was recorded.
+        **kwargs:
+            Further arguments of `StubServer`, e.g. a bandwidth.
+
+        Returns
+        -------
+        server: StubServer
+        """
+        if isinstance(recording, str):
+            recording = Recording.load(recording)
+
+        server = cls(
+            result=recording.result_factory(default, replay_latency), **kwargs
+        )
+        # Recorded layers are already registered, e.g. for their tiles
+        for graft in recording.layers.values():
+            server.register_layer(graft)
+        return server
+
+    @property
+    def url(self) -> str:
+        """Base URL of the stub, suitable for use as API_HOST"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> StubServer:
+        """Start serving requests in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._server.serve_forever, daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and release the port"""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self) -> StubServer:
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _record(self, method: str, path: str, headers: Dict, body: Dict):
+        with self._lock:
+            self.requests.append(
+                {"method": method, "path": path, "headers": headers, "body": body}
+            )
+
+    def _admit(self) -> bool:
+        with self._lock:
+            if (
+                self.max_concurrency is not None
+                and self.in_flight >= self.max_concurrency
+            ):
+                self.throttled += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def _finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _delay(self) -> float:
+        return self.latency() if callable(self.latency) else self.latency
+
+    def _fail(self) -> bool:
+        if not self.failure_rate:
+            return False
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+            self.failed += failed
+        return failed
+
+    def _write(self, stream, body: bytes):
+        if self.bandwidth is None:
+            stream.write(body)
+            return
+        for start in range(0, len(body), WRITE_CHUNK_SIZE):
+            chunk = body[start : start + WRITE_CHUNK_SIZE]
+            stream.write(chunk)
+            time.sleep(len(chunk) / self.bandwidth)
+
+    def register_layer(self, graft: Dict) -> str:
+        """Register a graft and return its layer id"""
+        layer_id = hashlib.sha256(
+            json.dumps(graft, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        with self._lock:
+            self.layers[layer_id] = graft
+        return layer_id
+
+    def evaluate(self, graft: Dict, body: Dict) -> Tuple[Any, Union[Dict, List]]:
+        """Produce the result for an ``/aoi`` request"""
+        if callable(self.result):
+            return self.result(graft, body)
+        return self.result, self.properties
+
+    def encode(
+        self,
+        value: Any,
+        properties: Union[Dict, List],
+        accept: Optional[str],
+        output: Optional[Dict] = None,
+    ) -> Tuple[bytes, str]:
+        """
+        Encode a result in the format negotiated with the client, honouring any
+        requested output options and falling back to pickle for results the
+        binary format can't represent.
+        """
+        output = output or {}
+        value = result_format.apply_output_options(value, output)
+
+        allowed = ", ".join(
+            range_
+            for range_ in (accept or "").split(",")
+            if result_format.preferred_format(range_) in self.formats
+        )
+        chosen = result_format.preferred_format(allowed)
+
+        if chosen == "binary" and "binary" in self.formats:
+            try:
+                return (
+                    result_format.encode_result(
+                        value,
+                        properties,
+                        compression=self.compression,
+                        mask_format=output.get("mask_format", "packbits"),
+                        nodata=output.get("nodata"),
+                    ),
+                    result_format.BINARY_MEDIA_TYPE,
+                )
+            except result_format.ResultFormatError:
+                pass
+
+        return (
+            result_format.encode_pickle(value, properties),
+            result_format.PICKLE_MEDIA_TYPE,
+        )
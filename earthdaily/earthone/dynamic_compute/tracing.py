@@ -0,0 +1,359 @@
+"""Lightweight tracing of client-side work.
+
+Spans time a block of work, such as building a graft, registering a layer, an
+HTTP request or decoding a result, and nest within each other on the same
+thread, or on the threads of executors running functions wrapped with
+`propagate`. Tracing is disabled by default, in which case spans cost a flag check.
+
+Traces can be written to a Chrome trace-event file, which can be opened in
+``chrome://tracing`` or https://ui.perfetto.dev, and, when OpenTelemetry is
+installed, spans can additionally be forwarded to the current OpenTelemetry
+tracer.
+
+Tracing can also be enabled by setting the DYNAMIC_COMPUTE_TRACE environment
+variable. Only the last MAX_SPANS finished spans are kept, set it with the
+DYNAMIC_COMPUTE_TRACE_MAX_SPANS environment variable.
+
+Example
+-------
+>>> from earthdaily.earthone.dynamic_compute import tracing
+>>> with tracing.record("compute.trace.json"): # doctest: +SKIP
+...     image.compute(aoi) # doctest: +SKIP
+"""
+
+from __future__ import annotations
+
+import collections
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Number of finished spans kept, older spans are dropped
+MAX_SPANS = int(os.getenv("DYNAMIC_COMPUTE_TRACE_MAX_SPANS", 100_000))
+
+_enabled = False
+_opentelemetry_tracer = None
+_spans: collections.deque = collections.deque(maxlen=MAX_SPANS)
+# Number of spans ever finished, including those dropped from _spans
+_finished = 0
+_spans_lock = threading.Lock()
+_span_ids = itertools.count(1)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "dynamic_compute_span", default=None
+)
+
+
+def _attribute(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class Span:
+    """
+    A timed block of work.
+
+    Parameters
+    ----------
+    name: str
+        Name of the work, e.g. "compute_aoi"
+    attributes: Dict[str, Any]
+        Details of the work, e.g. sizes or status codes
+    parent: Optional[Span]
+        Span this one is nested in
+    """
+
+    def __init__(
+        self, name: str, attributes: Dict[str, Any], parent: Optional[Span] = None
+    ):
+        self.name = name
+        self.attributes = {key: _attribute(value) for key, value in attributes.items()}
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = next(_span_ids)
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self._opentelemetry_span = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Duration of the span in seconds, None while it is open"""
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any):
+        """Record a detail of the work"""
+        self.attributes[key] = _attribute(value)
+        if self._opentelemetry_span is not None:
+            self._opentelemetry_span.set_attribute(key, self.attributes[key])
+
+    def __repr__(self) -> str:
+        return f"Span({self.name!r}, duration={self.duration}, {self.attributes})"
+
+
+class _NoopSpan:
+    """Stands in for a span while tracing is disabled"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def enable(opentelemetry: bool = False):
+    """
+    Start recording spans.
+
+    Parameters
+    ----------
+    opentelemetry: bool
+        Also forward spans to the current OpenTelemetry tracer, which requires the
+        opentelemetry-api package.
+    """
+    global _enabled, _opentelemetry_tracer
+
+    if opentelemetry:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError(
+                "Forwarding spans to OpenTelemetry requires the opentelemetry-api "
+                "package, install it with `pip install opentelemetry-api`"
+            )
+        _opentelemetry_tracer = trace.get_tracer("earthdaily.earthone.dynamic_compute")
+    else:
+        _opentelemetry_tracer = None
+
+    _enabled = True
+
+
+def disable():
+    """Stop recording spans"""
+    global _enabled, _opentelemetry_tracer
+    _enabled = False
+    _opentelemetry_tracer = None
+
+
+def is_enabled() -> bool:
+    """Whether spans are being recorded"""
+    return _enabled
+
+
+def spans() -> List[Span]:
+    """
+    The spans finished since tracing was enabled or last cleared, at most the
+    last MAX_SPANS
+    """
+    with _spans_lock:
+        return list(_spans)
+
+
+def clear():
+    """Forget the recorded spans"""
+    with _spans_lock:
+        _spans.clear()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Time a block of work.
+
+    Parameters
+    ----------
+    name: str
+        Name of the work
+    **attributes:
+        Details of the work
+
+    Yields
+    ------
+    span: Span
+        The open span, to which further attributes can be added
+    """
+    if not _enabled:
+        yield _NOOP_SPAN
+        return
+
+    current = Span(name, attributes, parent=_current_span.get())
+    token = _current_span.set(current)
+
+    opentelemetry_context = None
+    if _opentelemetry_tracer is not None:
+        opentelemetry_context = _opentelemetry_tracer.start_as_current_span(
+            name, attributes=current.attributes
+        )
+        current._opentelemetry_span = opentelemetry_context.__enter__()
+
+    try:
+        yield current
+    except BaseException as e:
+        current.set_attribute("error", type(e).__name__)
+        raise
+    finally:
+        current.end_ns = time.perf_counter_ns()
+        _current_span.reset(token)
+        if opentelemetry_context is not None:
+            opentelemetry_context.__exit__(None, None, None)
+        global _finished
+        with _spans_lock:
+            _spans.append(current)
+            _finished += 1
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    Decorate a function so that each call is recorded as a span.
+
+    Parameters
+    ----------
+    name: Optional[str]
+        Name of the spans, defaults to the qualified name of the function
+    """
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def propagate(func: Callable) -> Callable:
+    """
+    Wrap a function to be run on other threads, e.g. by an executor, so that
+    its spans nest within the span that is current when it is wrapped.
+
+    Parameters
+    ----------
+    func: Callable
+        The function
+
+    Returns
+    -------
+    wrapper: Callable
+        The function, run in a copy of the current context on every call
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def to_chrome_trace(recorded: Optional[List[Span]] = None) -> Dict:
+    """
+    Convert spans to the Chrome trace-event format.
+
+    Parameters
+    ----------
+    recorded: Optional[List[Span]]
+        Spans to convert, defaults to every recorded span
+
+    Returns
+    -------
+    trace: Dict
+        Trace, ready to be serialized as JSON
+    """
+    if recorded is None:
+        recorded = spans()
+
+    pid = os.getpid()
+    events = []
+    threads = {}
+    origin = min((s.start_ns for s in recorded), default=0)
+
+    for s in recorded:
+        threads.setdefault(s.thread_id, s.thread_name)
+        events.append(
+            {
+                "name": s.name,
+                "cat": "dynamic_compute",
+                "ph": "X",
+                "ts": (s.start_ns - origin) / 1e3,
+                "dur": ((s.end_ns or s.start_ns) - s.start_ns) / 1e3,
+                "pid": pid,
+                "tid": s.thread_id,
+                "args": s.attributes,
+            }
+        )
+
+    for thread_id, thread_name in threads.items():
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": thread_id,
+                "args": {"name": thread_name},
+            }
+        )
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(path: str, recorded: Optional[List[Span]] = None):
+    """
+    Write spans to a Chrome trace-event JSON file.
+
+    Parameters
+    ----------
+    path: str
+        File to write
+    recorded: Optional[List[Span]]
+        Spans to write, defaults to every recorded span
+    """
+    with open(path, "w") as f:
+        json.dump(to_chrome_trace(recorded), f)
+
+
+@contextlib.contextmanager
+def record(path: Optional[str] = None, opentelemetry: bool = False) -> Iterator[None]:
+    """
+    Record the spans of a block, optionally writing them to a Chrome trace file.
+
+    Parameters
+    ----------
+    path: Optional[str]
+        File to write the spans of the block to
+    opentelemetry: bool
+        Also forward spans to the current OpenTelemetry tracer
+    """
+    was_enabled = _enabled
+    with _spans_lock:
+        first = _finished
+
+    enable(opentelemetry=opentelemetry)
+    try:
+        yield
+    finally:
+        if not was_enabled:
+            disable()
+        if path is not None:
+            with _spans_lock:
+                count = min(_finished - first, len(_spans))
+                recorded = list(_spans)[len(_spans) - count :]
+            export_chrome_trace(path, recorded)
+
+
+if os.getenv("DYNAMIC_COMPUTE_TRACE"):
+    enable()
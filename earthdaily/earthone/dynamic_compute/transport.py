@@ -0,0 +1,880 @@
+"""HTTP transport shared by the compute entry points.
+
+Every request to the dynamic-compute API that registers a layer or computes an
+AOI goes through a single `Transport`, which is where cross-cutting request
+policies live.
+
+Single-flight
+-------------
+Concurrent identical requests, e.g. several inspector threads sampling the same
+layer, or duplicate AOIs in a batch, are deduplicated: the first caller sends
+the request and the others wait for, and share, its result. Requests are
+identical when their method, URL, credentials and JSON body are. The arrays of
+a shared result are not copied: every caller receives a read-only view of them,
+with its own copy of the mask, so may mask pixels but must copy an array before
+modifying its values. Other values, e.g. properties, are copied.
+
+Single-flight is enabled by default; disable it with
+``configure_transport(single_flight=False)`` or by setting the
+DYNAMIC_COMPUTE_SINGLE_FLIGHT environment variable to 0.
+
+Adaptive concurrency
+--------------------
+The number of requests in flight is limited by an AIMD (additive increase,
+multiplicative decrease) limiter shared by every caller in the process, so batch
+entry points can submit work from as many threads as they like. Each successful
+request raises the limit by roughly one per round of requests, and each response
+signalling overload (429 or 503) halves it, so the limit settles near what the
+service can sustain. Other failures leave the limit unchanged.
+
+Overloaded and transiently failed requests are retried with jittered exponential
+backoff, or after the delay given by the server's Retry-After header.
+
+The limits, retries and timeouts are configured with `configure_transport`, or
+the DYNAMIC_COMPUTE_MAX_CONCURRENCY, DYNAMIC_COMPUTE_MAX_RETRIES and
+DYNAMIC_COMPUTE_CONNECT_TIMEOUT environment variables.
+
+Hedging
+-------
+The transport records a latency histogram per endpoint, see `metrics`. With
+hedging enabled, a hedgeable request, e.g. an AOI compute, that hasn't completed
+by the observed 95th percentile latency of its endpoint is sent a second time,
+and whichever attempt completes first wins; the other is abandoned and its
+response closed.
+Hedges are limited by a budget, by default one hedge per ten requests, so the
+extra load on the service is bounded.
+
+Hedging is disabled by default; enable it with ``configure_transport(hedge=True)``
+or by setting the DYNAMIC_COMPUTE_HEDGE environment variable to 1.
+
+Observers
+---------
+Callbacks registered with `add_observer` are passed an `Exchange` for every
+successfully handled request, e.g. to record a session for later replay, see
+`testing.SessionRecorder`. Observers apply to every configured transport.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import copy
+import dataclasses
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import numpy as np
+import requests
+
+from . import metrics, tracing
+
+T = TypeVar("T")
+
+# Responses signalling that the service is overloaded
+THROTTLE_STATUS_CODES = (429, 503)
+# Responses worth retrying, the service may succeed on a later attempt
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_CONNECT_TIMEOUT = 30.0
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_BUDGET = 0.1
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+
+_transport: Optional[Transport] = None
+_transport_lock = threading.Lock()
+_observers: List[Callable[[Exchange], None]] = []
+
+
+def request_fingerprint(
+    method: str, url: str, headers: Optional[Dict], body: Optional[Dict]
+) -> str:
+    """
+    Compute a fingerprint identifying a request.
+
+    Parameters
+    ----------
+    method: str
+        HTTP method
+    url: str
+        URL of the request
+    headers: Optional[Dict]
+        Request headers, including credentials
+    body: Optional[Dict]
+        JSON body of the request
+
+    Returns
+    -------
+    fingerprint: str
+        Hex digest identifying the request
+    """
+    encoded = json.dumps(
+        [method.upper(), url, headers or {}, body], sort_keys=True, default=str
+    )
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """
+    Parse the Retry-After header of a response.
+
+    Parameters
+    ----------
+    response: requests.Response
+        Response to inspect
+
+    Returns
+    -------
+    delay: Optional[float]
+        Seconds to wait before retrying, or None if the header is absent or invalid
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (date - now).total_seconds())
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a client-side phase of a request, see `metrics` and `tracing`."""
+    histogram = metrics.histogram(
+        "dynamic_compute_phase_seconds",
+        "Time spent in client-side phases of requests",
+        min_value=1e-6,
+        buckets=250,
+        phase=name,
+    )
+    with tracing.span(name), histogram.time():
+        yield
+
+
+def _encode_body(body: Optional[Dict]) -> Optional[bytes]:
+    """Serialize a JSON request body once, rather than on every attempt"""
+    if body is None:
+        return None
+    with phase("encode"):
+        return json.dumps(body).encode("utf-8")
+
+
+def _count_request(endpoint: str, status: Union[int, str]):
+    metrics.counter(
+        "dynamic_compute_requests_total",
+        "Requests to the dynamic-compute API",
+        endpoint=endpoint,
+        status=status,
+    ).inc()
+
+
+def _record_sizes(endpoint: str, response: requests.Response, span):
+    span.set_attribute("status", response.status_code)
+    body = response.request.body if response.request is not None else None
+    if body is not None:
+        span.set_attribute("request_bytes", len(body))
+        metrics.byte_histogram(
+            "dynamic_compute_request_bytes",
+            "Size of request bodies sent to the dynamic-compute API",
+            endpoint=endpoint,
+        ).record(len(body))
+
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None:
+        span.set_attribute("response_bytes", int(content_length))
+        metrics.byte_histogram(
+            "dynamic_compute_response_bytes",
+            "Size of response bodies received from the dynamic-compute API",
+            endpoint=endpoint,
+        ).record(int(content_length))
+
+
+@dataclasses.dataclass
+class Exchange:
+    """A successfully handled request, as passed to observers"""
+
+    url: str
+    endpoint: str
+    request: Optional[Dict]
+    status: int
+    response_headers: Dict[str, str]
+    elapsed: float
+    result: Any
+
+
+def add_observer(observer: Callable[[Exchange], None]):
+    """Register a callback to be passed every successfully handled request"""
+    _observers.append(observer)
+
+
+def remove_observer(observer: Callable[[Exchange], None]):
+    """Unregister a callback added with `add_observer`"""
+    _observers.remove(observer)
+
+
+def _notify(exchange: Exchange):
+    for observer in list(_observers):
+        observer(exchange)
+
+
+class Cancelled(Exception):
+    """Raised by an attempt that lost to a hedge"""
+
+
+def _cancel_reads(response: requests.Response, cancelled: threading.Event):
+    """
+    Stop reading a response body once its attempt is cancelled, closing the
+    response so that an attempt that lost to a hedge frees its connection.
+    """
+    iter_content = response.iter_content
+
+    def checked(*args, **kwargs) -> Iterator[bytes]:
+        for chunk in iter_content(*args, **kwargs):
+            if cancelled.is_set():
+                response.close()
+                raise Cancelled()
+            yield chunk
+
+    # Response.content reads through iter_content too
+    response.iter_content = checked
+
+
+class HedgeBudget:
+    """
+    A token bucket limiting hedges to a fraction of requests.
+
+    Parameters
+    ----------
+    ratio: float
+        Hedges allowed per request
+    burst: float
+        Maximum number of hedges that can be saved up
+    """
+
+    def __init__(self, ratio: float = DEFAULT_HEDGE_BUDGET, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Record a request, earning a fraction of a hedge"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Spend a hedge, returning False if none is available"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+def _freeze(value: Any):
+    """Make the arrays in a result read-only, so it can be shared"""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+        if isinstance(value, np.ma.MaskedArray) and value.mask is not np.ma.nomask:
+            value.mask.flags.writeable = False
+    elif isinstance(value, (dict, list, tuple)):
+        for item in value.values() if isinstance(value, dict) else value:
+            _freeze(item)
+
+
+def _share(value: Any) -> Any:
+    """
+    Return a caller's copy of a frozen result, sharing its arrays' data but not
+    their masks
+    """
+    if isinstance(value, np.ma.MaskedArray):
+        view = value.view()
+        view.unshare_mask()
+        return view
+    if isinstance(value, np.ndarray):
+        return value.view()
+    if isinstance(value, dict):
+        return {key: _share(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_share(item) for item in value)
+    return copy.deepcopy(value)
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls sharing a key, so only one runs at a time and
+    its result, or exception, is shared with every caller waiting on it.
+
+    The arrays of a result shared by several callers are made read-only, and
+    each caller receives views of them (see `_share`) rather than copies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._followers: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        Call fn, unless a call with the same key is in flight, in which case wait
+        for it and share its result.
+
+        Parameters
+        ----------
+        key: str
+            Identifies calls that are interchangeable
+        fn: Callable[[], T]
+            Function to call
+
+        Returns
+        -------
+        result: T
+            The result of fn, or of the call in flight. If the result is shared,
+            its arrays are read-only.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._followers[key] = 0
+            else:
+                self._followers[key] += 1
+
+        if not leader:
+            return _share(future.result())
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+
+        if not self._finish(key):
+            # Nobody waited, so the result is the caller's alone
+            future.set_result(result)
+            return result
+
+        _freeze(result)
+        future.set_result(result)
+        return _share(result)
+
+    def _finish(self, key: str) -> bool:
+        """Stop sharing the call, returning whether any caller waited on it"""
+        with self._lock:
+            del self._calls[key]
+            return self._followers.pop(key) > 0
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent requests, adapting the limit to the service's
+    capacity with additive increase and multiplicative decrease.
+
+    Parameters
+    ----------
+    initial: int
+        Initial limit
+    minimum: int
+        Lower bound of the limit
+    maximum: int
+        Upper bound of the limit
+    decrease_factor: float
+        Factor the limit is multiplied by when the service is overloaded
+    """
+
+    def __init__(
+        self,
+        initial: int = DEFAULT_INITIAL_CONCURRENCY,
+        minimum: int = 1,
+        maximum: int = DEFAULT_MAX_CONCURRENCY,
+        decrease_factor: float = 0.5,
+    ):
+        if not 1 <= minimum <= maximum:
+            raise ValueError("Limits must satisfy 1 <= minimum <= maximum")
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Current number of requests allowed in flight"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of requests in flight"""
+        return self._in_flight
+
+    def acquire(self) -> float:
+        """
+        Wait until a request may be sent.
+
+        Returns
+        -------
+        started: float
+            Monotonic time at which the request was admitted, to pass to `release`
+        """
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(
+        self, started: float, throttled: bool = False, succeeded: bool = False
+    ):
+        """
+        Record the outcome of an admitted request.
+
+        The limit is raised only by successful requests. Other failures, such as
+        connection errors, timeouts or server errors, say nothing about the
+        service's capacity and leave it unchanged.
+
+        Parameters
+        ----------
+        started: float
+            Value returned by `acquire` for the request
+        throttled: bool
+            Whether the service signalled it is overloaded
+        succeeded: bool
+            Whether the request succeeded
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                # Requests admitted before the last decrease were sent at the old
+                # limit, so only decrease once per round of requests.
+                if started >= self._last_decrease:
+                    self._limit = max(
+                        self.minimum, self._limit * self.decrease_factor
+                    )
+                    self._last_decrease = time.monotonic()
+            elif succeeded:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+
+class Transport:
+    """
+    Sends requests to the dynamic-compute API, applying the configured policies.
+
+    Parameters
+    ----------
+    single_flight: bool
+        Whether concurrent identical requests share a single request.
+    max_concurrency: int
+        Upper bound of the number of requests in flight.
+    initial_concurrency: int
+        Number of requests allowed in flight before the limit has adapted.
+    max_retries: int
+        Number of times an overloaded or transiently failed request is retried.
+    backoff_base: float
+        Initial backoff between retries in seconds, doubled on each attempt.
+    backoff_cap: float
+        Maximum backoff between retries in seconds.
+    connect_timeout: Optional[float]
+        Timeout for establishing connections in seconds, used for requests without
+        a timeout of their own.
+    hedge: bool
+        Whether slow hedgeable requests are sent a second time.
+    hedge_quantile: float
+        Quantile of an endpoint's latency after which a request is hedged.
+    hedge_budget: float
+        Maximum number of hedges per request.
+    hedge_min_samples: int
+        Number of latencies recorded for an endpoint before its requests are
+        hedged.
+    """
+
+    def __init__(
+        self,
+        single_flight: bool = True,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+        connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+        hedge: bool = False,
+        hedge_quantile: float = DEFAULT_HEDGE_QUANTILE,
+        hedge_budget: float = DEFAULT_HEDGE_BUDGET,
+        hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+    ):
+        self.single_flight = single_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.connect_timeout = connect_timeout
+        self.limiter = AdaptiveLimiter(
+            initial=min(initial_concurrency, max_concurrency),
+            maximum=max_concurrency,
+        )
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_budget = HedgeBudget(hedge_budget)
+        self.hedges = 0
+        self._flights = SingleFlight()
+
+    @staticmethod
+    def histogram(endpoint: str) -> metrics.Histogram:
+        """The latency histogram of an endpoint"""
+        return metrics.histogram(
+            "dynamic_compute_request_seconds",
+            "Latency of requests to the dynamic-compute API",
+            endpoint=endpoint,
+        )
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Seconds after which a request to an endpoint is hedged, if at all"""
+        histogram = self.histogram(endpoint)
+        if not self.hedge or histogram.count < self.hedge_min_samples:
+            return None
+        return histogram.quantile(self.hedge_quantile)
+
+    def backoff(
+        self, attempt: int, response: Optional[requests.Response] = None
+    ) -> float:
+        """Seconds to wait before retry number `attempt`, counting from zero"""
+        delay = retry_after(response) if response is not None else None
+        if delay is not None:
+            return min(delay, self.backoff_cap)
+        # Full jitter, so retries of requests throttled together spread out
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    def _send(
+        self,
+        url: str,
+        handle: Callable[[requests.Response], T],
+        json: Optional[Dict],
+        data: Optional[bytes],
+        headers: Optional[Dict],
+        stream: bool,
+        timeout: Optional[Union[float, Tuple[float, Optional[float]]]],
+        endpoint: Optional[str] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> T:
+        if timeout is None and self.connect_timeout is not None:
+            # Computes can take a long time, so only bound the connection
+            timeout = (self.connect_timeout, None)
+        if data is not None:
+            headers = {**(headers or {}), "Content-Type": "application/json"}
+
+        label = endpoint or "other"
+        in_flight = metrics.gauge(
+            "dynamic_compute_requests_in_flight",
+            "Requests to the dynamic-compute API being sent or read",
+        )
+
+        attempt = 0
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled()
+
+            started = self.limiter.acquire()
+            in_flight.inc()
+            throttled = succeeded = False
+            try:
+                with tracing.span("http", endpoint=label, attempt=attempt) as span:
+                    try:
+                        response = requests.post(
+                            url,
+                            headers=headers,
+                            data=data,
+                            stream=stream,
+                            timeout=timeout,
+                        )
+                    except (requests.ConnectionError, requests.Timeout) as e:
+                        _count_request(label, type(e).__name__)
+                        span.set_attribute("status", type(e).__name__)
+                        if attempt >= self.max_retries:
+                            raise
+                        response = None
+                    else:
+                        _count_request(label, response.status_code)
+                        _record_sizes(label, response, span)
+                        throttled = response.status_code in THROTTLE_STATUS_CODES
+                        if (
+                            response.status_code not in RETRY_STATUS_CODES
+                            or attempt >= self.max_retries
+                        ):
+                            if cancelled is not None:
+                                if cancelled.is_set():
+                                    response.close()
+                                    raise Cancelled()
+                                _cancel_reads(response, cancelled)
+                            result = handle(response)
+                            succeeded = response.ok
+                            elapsed = time.monotonic() - started
+                            self.histogram(label).record(elapsed)
+                            if _observers:
+                                _notify(
+                                    Exchange(
+                                        url=url,
+                                        endpoint=label,
+                                        request=json,
+                                        status=response.status_code,
+                                        response_headers=dict(response.headers),
+                                        elapsed=elapsed,
+                                        result=result,
+                                    )
+                                )
+                            return result
+                        response.close()
+            finally:
+                in_flight.dec()
+                self.limiter.release(
+                    started, throttled=throttled, succeeded=succeeded
+                )
+
+            metrics.counter(
+                "dynamic_compute_retries_total",
+                "Retried requests to the dynamic-compute API",
+                endpoint=label,
+            ).inc()
+            time.sleep(self.backoff(attempt, response))
+            attempt += 1
+
+    def post(
+        self,
+        url: str,
+        handle: Callable[[requests.Response], T],
+        json: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        stream: bool = False,
+        timeout: Optional[Union[float, Tuple[float, Optional[float]]]] = None,
+        endpoint: Optional[str] = None,
+        hedge: bool = False,
+    ) -> T:
+        """
+        POST a JSON body and handle the response.
+
+        Parameters
+        ----------
+        url: str
+            URL to post to
+        handle: Callable[[requests.Response], T]
+            Checks and decodes the response. Its result is what is shared between
+            deduplicated requests.
+        json: Optional[Dict]
+            JSON body of the request
+        headers: Optional[Dict]
+            Request headers
+        stream: bool
+            Whether to stream the response body, see `requests.request`
+        timeout: Optional[Union[float, Tuple[float, Optional[float]]]]
+            Timeout of the request in seconds, see `requests.request`
+        endpoint: Optional[str]
+            Name of the endpoint, under which the request's latency is recorded
+        hedge: bool
+            Whether the request may be hedged, which requires an endpoint. Only
+            idempotent requests should be hedged.
+
+        Returns
+        -------
+        result: T
+            The result of handle
+        """
+
+        def send() -> T:
+            data = _encode_body(json)
+            delay = self.hedge_delay(endpoint) if hedge and endpoint else None
+            if delay is None:
+                return self._send(
+                    url, handle, json, data, headers, stream, timeout, endpoint
+                )
+            return self._hedged(
+                lambda cancelled: self._send(
+                    url,
+                    handle,
+                    json,
+                    data,
+                    headers,
+                    stream,
+                    timeout,
+                    endpoint,
+                    cancelled,
+                ),
+                delay,
+                endpoint,
+            )
+
+        if not self.single_flight:
+            return send()
+
+        key = request_fingerprint("POST", url, headers, json)
+        return self._flights.do(key, send)
+
+    def _hedged(
+        self, send: Callable[[threading.Event], T], delay: float, endpoint: str
+    ) -> T:
+        self.hedge_budget.deposit()
+
+        def start() -> Tuple[Future, threading.Event]:
+            future: Future = Future()
+            cancelled = threading.Event()
+
+            def run():
+                try:
+                    future.set_result(send(cancelled))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            threading.Thread(target=tracing.propagate(run), daemon=True).start()
+            return future, cancelled
+
+        attempts = [start()]
+        primary = attempts[0][0]
+        wait([primary], timeout=delay)
+        if not primary.done() and self.hedge_budget.withdraw():
+            self.hedges += 1
+            metrics.counter(
+                "dynamic_compute_hedges_total",
+                "Hedged requests to the dynamic-compute API",
+                endpoint=endpoint,
+            ).inc()
+            attempts.append(start())
+
+        pending = {future for future, _ in attempts}
+        winner = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next(iter(done))
+            # An attempt failing doesn't mean the other one will
+            if winner.exception() is None:
+                break
+
+        for future, cancelled in attempts:
+            if future is not winner:
+                cancelled.set()
+
+        if winner.exception() is not None:
+            # Report the primary's failure rather than the hedge's
+            return primary.result()
+        return winner.result()
+
+
+def configure_transport(
+    single_flight: bool = True,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff_base: float = 0.5,
+    backoff_cap: float = 30.0,
+    connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+    hedge: bool = False,
+    hedge_quantile: float = DEFAULT_HEDGE_QUANTILE,
+    hedge_budget: float = DEFAULT_HEDGE_BUDGET,
+    hedge_min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+) -> Transport:
+    """
+    Configure the transport used for requests to the dynamic-compute API.
+
+    Parameters
+    ----------
+    single_flight: bool
+        Whether concurrent identical requests share a single request.
+    max_concurrency: int
+        Upper bound of the number of requests in flight.
+    initial_concurrency: int
+        Number of requests allowed in flight before the limit has adapted.
+    max_retries: int
+        Number of times an overloaded or transiently failed request is retried.
+    backoff_base: float
+        Initial backoff between retries in seconds, doubled on each attempt.
+    backoff_cap: float
+        Maximum backoff between retries in seconds.
+    connect_timeout: Optional[float]
+        Timeout for establishing connections in seconds.
+    hedge: bool
+        Whether slow hedgeable requests, such as AOI computes, are sent a second
+        time.
+    hedge_quantile: float
+        Quantile of an endpoint's latency after which a request is hedged.
+    hedge_budget: float
+        Maximum number of hedges per request.
+    hedge_min_samples: int
+        Number of latencies recorded for an endpoint before its requests are
+        hedged.
+
+    Returns
+    -------
+    transport: Transport
+        The configured transport
+    """
+    global _transport
+
+    with _transport_lock:
+        _transport = Transport(
+            single_flight=single_flight,
+            max_concurrency=max_concurrency,
+            initial_concurrency=initial_concurrency,
+            max_retries=max_retries,
+            backoff_base=backoff_base,
+            backoff_cap=backoff_cap,
+            connect_timeout=connect_timeout,
+            hedge=hedge,
+            hedge_quantile=hedge_quantile,
+            hedge_budget=hedge_budget,
+            hedge_min_samples=hedge_min_samples,
+        )
+
+    return _transport
+
+
+def get_transport() -> Transport:
+    """Return the transport used for requests to the dynamic-compute API"""
+    return _transport
+
+
+configure_transport(
+    single_flight=os.getenv("DYNAMIC_COMPUTE_SINGLE_FLIGHT", "1") != "0",
+    max_concurrency=int(
+        os.getenv("DYNAMIC_COMPUTE_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+    ),
+    max_retries=int(os.getenv("DYNAMIC_COMPUTE_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+    connect_timeout=float(
+        os.getenv("DYNAMIC_COMPUTE_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+    ),
+    hedge=os.getenv("DYNAMIC_COMPUTE_HEDGE", "0") == "1",
+)
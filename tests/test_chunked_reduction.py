@@ -0,0 +1,86 @@
+import datetime
+
+import earthdaily.earthone as eo
+import numpy as np
+import pytest
+
+from earthdaily.earthone.dynamic_compute import operations
+from earthdaily.earthone.dynamic_compute.image_stack import ImageStack
+from earthdaily.earthone.dynamic_compute.local import ArrayProvider
+from earthdaily.earthone.dynamic_compute.mosaic import Mosaic
+from earthdaily.earthone.dynamic_compute.testing.stub_server import StubAuth
+
+SCENES = 6
+AOI = eo.geo.AOI(bounds=(0, 0, 1, 1), crs="EPSG:4326", shape=(4, 5))
+
+
+@pytest.fixture
+def provider():
+    rng = np.random.default_rng(0)
+    red = np.ma.masked_array(
+        rng.random((SCENES, 4, 5)), rng.random((SCENES, 4, 5)) < 0.3
+    )
+    # A pixel masked in every image
+    red[:, 0, 0] = np.ma.masked
+    start = datetime.datetime(2020, 1, 1)
+    dates = [start + datetime.timedelta(days=7 * i) for i in range(SCENES)]
+    scenes = [
+        {"id": f"p:{i}", "acquired": date.isoformat()} for i, date in enumerate(dates)
+    ]
+    return ArrayProvider({"p": {"red": red}}, {"p": scenes})
+
+
+def _stack():
+    # The images are acquired in January and February, so the windows of March
+    # are empty
+    graft = operations.stack_scenes(
+        operations.select_scenes("p", "red", "2020-01-01", "2020-04-01"), "red"
+    )
+    return ImageStack(graft, "red", "p", "2020-01-01", "2020-04-01", auth=StubAuth())
+
+
+@pytest.mark.parametrize("reducer", ["sum", "mean", "std", "min", "max"])
+def test_chunked_reduction_matches_full_reduction(provider, reducer):
+    stack = _stack()
+
+    expected = stack.reduce(reducer, axis="images").compute_local(
+        AOI, provider=provider
+    )["ndarray"]
+    chunked = stack.reduce_chunked(reducer, "30D").compute_local(
+        AOI, provider=provider
+    )
+
+    np.testing.assert_array_equal(
+        np.ma.getmaskarray(chunked), np.ma.getmaskarray(expected)
+    )
+    assert np.ma.getmaskarray(chunked)[0, 0, 0]
+    np.testing.assert_allclose(chunked.compressed(), expected.compressed())
+
+
+def test_windows_without_images_are_skipped(provider):
+    reduction = _stack().reduce_chunked("sum", "30D")
+    evaluate = lambda compute_map: compute_map.compute_local(  # noqa: E731
+        AOI, provider=provider
+    )["ndarray"]
+
+    partials = reduction._compute_partials(
+        list(range(len(reduction.windows))), evaluate
+    )
+
+    assert partials[0] is not None
+    assert partials[len(reduction.windows) - 1] is None
+
+
+def test_partials_of_a_window_are_computed_together(provider):
+    reduction = _stack().reduce_chunked("std", "30D")
+    evaluated = []
+
+    def evaluate(compute_map):
+        evaluated.append(compute_map)
+        return compute_map.compute_local(AOI, provider=provider)["ndarray"]
+
+    reduction._evaluate(evaluate)
+
+    # Besides the lengths of windows whose reduction failed for lack of images
+    mosaics = [m for m in evaluated if isinstance(m, Mosaic)]
+    assert len(mosaics) == len(reduction.windows)
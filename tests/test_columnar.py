@@ -0,0 +1,48 @@
+import copy
+
+import numpy as np
+
+from earthdaily.earthone.dynamic_compute import operations
+from earthdaily.earthone.dynamic_compute.columnar import ColumnarProperties
+
+
+def test_deepcopy_does_not_share_values():
+    records = [{"id": "a", "geom": {"t": "P"}}, {"id": "b", "geom": {"t": "P"}}]
+    properties = ColumnarProperties.from_records(records)
+
+    copied = copy.deepcopy(properties)
+    copied[0]["geom"]["t"] = "X"
+
+    assert properties[0]["geom"] == {"t": "P"}
+    assert records[0]["geom"] == {"t": "P"}
+
+
+def test_deepcopy_keeps_missing_values():
+    properties = ColumnarProperties.from_records([{"id": "a", "x": [1]}, {"id": "b"}])
+
+    copied = copy.deepcopy(properties)
+
+    assert copied.to_records() == [{"id": "a", "x": [1]}, {"id": "b"}]
+
+
+def test_column_of_arrays():
+    properties = ColumnarProperties.from_records(
+        [{"v": np.zeros(2)}, {"v": np.ones(3)}, {}]
+    )
+
+    values = properties.column("v")
+
+    np.testing.assert_array_equal(values[1], np.ones(3))
+    assert values[2] is None
+
+
+def test_property_propagation_shares_columns():
+    properties = ColumnarProperties.from_records(
+        [{"id": str(i), "geom": {"t": "P"}, "pad": 0} for i in range(3)]
+    )
+
+    propagated = operations._default_property_propagation(properties, {})
+
+    assert propagated._columns["geom"] is properties._columns["geom"]
+    assert propagated.column("pad").tolist() == [0, 0, 0]
+    assert "bands" not in properties.keys()
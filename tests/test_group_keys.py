@@ -0,0 +1,56 @@
+import pytest
+
+from earthdaily.earthone.dynamic_compute.group_keys import group_ids, parse_group_key
+
+
+def _properties(*dates):
+    return [{"id": date, "acquired": date} for date in dates]
+
+
+def test_year_week_uses_the_iso_year():
+    properties = _properties("2024-01-02T10:00:00Z", "2024-12-30T10:00:00Z")
+
+    groups = dict(group_ids(properties, "acquired:year-week"))
+
+    assert groups == {
+        (2024, 1): ["2024-01-02T10:00:00Z"],
+        (2025, 1): ["2024-12-30T10:00:00Z"],
+    }
+
+
+def test_year_doy_buckets_start_on_the_first_day():
+    properties = _properties(
+        "2021-01-01T00:00:00Z",  # day 1
+        "2021-01-16T00:00:00Z",  # day 16
+        "2021-01-17T00:00:00Z",  # day 17
+        "2021-02-01T00:00:00Z",  # day 32
+        "2021-02-02T00:00:00Z",  # day 33
+    )
+
+    groups = dict(group_ids(properties, "acquired:year-doy//16"))
+
+    assert groups == {
+        (2021, 0): ["2021-01-01T00:00:00Z", "2021-01-16T00:00:00Z"],
+        (2021, 1): ["2021-01-17T00:00:00Z", "2021-02-01T00:00:00Z"],
+        (2021, 2): ["2021-02-02T00:00:00Z"],
+    }
+
+
+def test_month_and_property_keys():
+    properties = [
+        {"id": "a", "acquired": "2021-01-05T00:00:00Z", "sat": "s1"},
+        {"id": "b", "acquired": "2021-02-05T00:00:00Z", "sat": "s2"},
+        {"id": "c", "acquired": "2021-02-07T00:00:00Z"},
+    ]
+
+    assert group_ids(properties, "acquired:month") == [(1, ["a"]), (2, ["b", "c"])]
+    assert group_ids(properties, ("sat", "acquired:month")) == [
+        (("s1", 1), ["a"]),
+        (("s2", 2), ["b"]),
+    ]
+
+
+@pytest.mark.parametrize("spec", ["acquired:fortnight", "acquired:doy//0", "", ()])
+def test_invalid_keys(spec):
+    with pytest.raises(ValueError):
+        parse_group_key(spec)
@@ -0,0 +1,45 @@
+import earthdaily.earthone as eo
+import numpy as np
+
+from earthdaily.earthone.dynamic_compute import operations
+from earthdaily.earthone.dynamic_compute.image_stack import ImageStack
+from earthdaily.earthone.dynamic_compute.local import SyntheticProvider
+from earthdaily.earthone.dynamic_compute.testing.stub_server import StubAuth
+
+AOI = eo.geo.AOI(bounds=(0, 0, 1, 1), crs="EPSG:4326", shape=(4, 5))
+
+
+def test_synthetic_scenes_are_filtered_by_end_date():
+    provider = SyntheticProvider()
+
+    scenes = provider.select_scenes(
+        "p", ["red"], AOI, start_datetime="2024-01-01", end_datetime="2024-01-11"
+    )
+
+    assert [scene["acquired"][:10] for scene in scenes] == ["2024-01-01", "2024-01-06"]
+
+
+def test_synthetic_scenes_of_windows_are_those_of_the_range():
+    provider = SyntheticProvider()
+
+    def ids(start, end):
+        scenes = provider.select_scenes(
+            "p", ["red"], AOI, start_datetime=start, end_datetime=end
+        )
+        return [scene["id"] for scene in scenes]
+
+    whole = ids("2020-01-01", "2020-03-01")
+    assert len(set(whole)) == len(whole)
+    assert ids("2020-01-01", "2020-02-01") + ids("2020-02-01", "2020-03-01") == whole
+
+
+def test_chunked_reduction_of_synthetic_imagery_matches_full_reduction():
+    graft = operations.stack_scenes(
+        operations.select_scenes("p", "red", "2020-01-01", "2020-07-01"), "red"
+    )
+    stack = ImageStack(graft, "red", "p", "2020-01-01", "2020-07-01", auth=StubAuth())
+
+    expected = stack.reduce("sum", axis="images").compute_local(AOI)["ndarray"]
+    chunked = stack.reduce_chunked("sum", "45D").compute_local(AOI)
+
+    np.testing.assert_allclose(chunked, expected)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from earthdaily.earthone.dynamic_compute import result_format
+
+
+@pytest.mark.parametrize("mask_format", result_format.MASK_FORMATS)
+def test_masked_array_without_mask_stays_masked(mask_format):
+    value = np.ma.masked_array(np.arange(6.0).reshape(2, 3))
+
+    decoded, _ = result_format.decode_result(
+        result_format.encode_result(value, {}, mask_format=mask_format)
+    )
+
+    assert isinstance(decoded, np.ma.MaskedArray)
+    assert not np.ma.getmaskarray(decoded).any()
+    np.testing.assert_array_equal(decoded.data, value.data)
+
+
+def test_plain_array_stays_plain():
+    decoded, _ = result_format.decode_result(
+        result_format.encode_result(np.arange(3.0), {})
+    )
+
+    assert type(decoded) is np.ndarray
+
+
+def test_output_options_keep_masked_array_without_mask():
+    value = np.ma.masked_array(np.arange(3.0))
+
+    cast = result_format.apply_output_options(value, {"dtype": "float32"})
+
+    assert isinstance(cast, np.ma.MaskedArray)
+    assert cast.dtype == np.float32
+
+
+def test_integer_nodata_without_value_is_rejected():
+    value = np.ma.masked_array(np.zeros((2, 3), np.uint16), [[True] + [False] * 2] * 2)
+
+    with pytest.raises(result_format.ResultFormatError):
+        result_format.encode_result(value, {}, mask_format="nodata")
+
+
+def test_integer_nodata_round_trip():
+    mask = np.eye(3, dtype=bool)
+    value = np.ma.masked_array(np.arange(9, dtype=np.uint16).reshape(3, 3), mask)
+
+    decoded, _ = result_format.decode_result(
+        result_format.encode_result(value, {}, mask_format="nodata", nodata=65535)
+    )
+
+    np.testing.assert_array_equal(decoded.mask, mask)
+    assert decoded.fill_value == 65535
+
+
+def test_integer_result_without_nodata_value_decodes():
+    array = np.zeros((2, 3), np.uint16)
+    header = {"nodata": None, "properties": {}}
+
+    decoded = result_format.DecodedResult(header, array, None).value
+
+    assert isinstance(decoded, np.ma.MaskedArray)
+    assert not decoded.mask.any()
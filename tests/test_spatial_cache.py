@@ -0,0 +1,88 @@
+import earthdaily.earthone as eo
+import numpy as np
+
+from earthdaily.earthone.dynamic_compute.spatial_cache import SpatialCache
+
+RESOLUTION = 10.0
+# Offsets of the AOIs, on tile boundaries, so their bounds don't look like degrees
+X, Y = 400_000, 5_000_000
+
+
+def _aoi(minx, miny, maxx, maxy):
+    return eo.geo.AOI(
+        bounds=(X + minx, Y + miny, X + maxx, Y + maxy),
+        bounds_crs="EPSG:32631",
+        crs="EPSG:32631",
+        resolution=RESOLUTION,
+    )
+
+
+def _pixels(window):
+    """Each pixel's value encodes its column and row on the grid"""
+    x0, y0, x1, y1 = window
+    columns = np.arange(x0, x1)
+    # Rows run southwards
+    rows = np.arange(y1 - 1, y0 - 1, -1)
+    return np.ma.masked_array(columns[None, :] * 10**7 + rows[:, None])[None]
+
+
+class Fetcher:
+    def __init__(self, properties=lambda aoi: {"bands": ["red"]}):
+        self.properties = properties
+        self.fetched = []
+
+    def __call__(self, aoi):
+        self.fetched.append(aoi)
+        window = tuple(round(bound / RESOLUTION) for bound in aoi.bounds)
+        return _pixels(window), self.properties(aoi)
+
+
+def test_window_is_assembled_from_tiles():
+    cache = SpatialCache(tile_size=8)
+    aoi = _aoi(35, -45, 235, 95)
+    fetch = Fetcher()
+
+    value, properties = cache.compute(aoi, "graft", fetch)
+
+    np.testing.assert_array_equal(value, _pixels(cache.window(aoi)))
+    assert properties == {"bands": ["red"]}
+    assert len(fetch.fetched) == len(cache.tiles(cache.window(aoi)))
+
+
+def test_only_missing_tiles_are_computed():
+    cache = SpatialCache(tile_size=8)
+    fetch = Fetcher()
+    cache.compute(_aoi(0, 0, 160, 160), "graft", fetch)
+    first = len(fetch.fetched)
+
+    # Overlaps the first AOI by one column of tiles
+    aoi = _aoi(80, 0, 240, 160)
+    value, _ = cache.compute(aoi, "graft", fetch)
+
+    np.testing.assert_array_equal(value, _pixels(cache.window(aoi)))
+    assert len(fetch.fetched) - first == 2
+    assert cache.hits == 2
+
+
+def test_grid_that_cannot_be_assembled_is_computed_directly():
+    cache = SpatialCache(tile_size=8)
+    # Properties that differ between tiles, as the scenes of an ImageStack may
+    fetch = Fetcher(properties=lambda aoi: [{"id": str(aoi.bounds)}])
+
+    assert cache.compute(_aoi(0, 0, 160, 160), "graft", fetch) is None
+    fetched = len(fetch.fetched)
+
+    assert cache.compute(_aoi(80, 0, 240, 160), "graft", fetch) is None
+    assert len(fetch.fetched) == fetched
+
+
+def test_results_that_are_not_arrays_compute_a_single_tile():
+    cache = SpatialCache(tile_size=8)
+    fetched = []
+
+    def fetch(aoi):
+        fetched.append(aoi)
+        return 3, {}
+
+    assert cache.compute(_aoi(0, 0, 160, 160), "graft", fetch) is None
+    assert len(fetched) == 1
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from earthdaily.earthone.dynamic_compute import operations, tracing
+
+
+@pytest.fixture
+def recording():
+    tracing.clear()
+    tracing.enable()
+    yield
+    tracing.disable()
+    tracing.clear()
+
+
+def test_graft_construction_is_traced(recording):
+    with tracing.span("build") as parent:
+        operations.select_scenes("p", "red", "2020-01-01", "2020-04-01")
+
+    built = [span for span in tracing.spans() if span.name == "apply_graft"]
+    assert built
+    assert built[0].parent_id == parent.span_id
+    assert built[0].attributes["op"] == "select_scenes"
+
+
+def test_propagated_spans_nest_across_threads(recording):
+    def work(index):
+        with tracing.span("work", index=index):
+            pass
+
+    with tracing.span("parent") as parent:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(tracing.propagate(work), range(4)))
+
+    children = [span for span in tracing.spans() if span.name == "work"]
+    assert len(children) == 4
+    assert {span.parent_id for span in children} == {parent.span_id}
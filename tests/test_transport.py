@@ -0,0 +1,148 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+import requests
+
+from earthdaily.earthone.dynamic_compute import transport
+
+
+class _EndlessBody:
+    """A response body that never ends, read a chunk at a time"""
+
+    closed = False
+
+    def read(self, size=-1, **kwargs):
+        time.sleep(0.01)
+        return b"x" * max(size, 1)
+
+    def close(self):
+        self.closed = True
+
+
+def test_cancelled_attempt_stops_reading_and_releases_its_slot(monkeypatch):
+    body = _EndlessBody()
+
+    def post(url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = body
+        return response
+
+    monkeypatch.setattr(transport.requests, "post", post)
+    t = transport.Transport(single_flight=False, max_retries=0)
+    cancelled = threading.Event()
+    threading.Timer(0.1, cancelled.set).start()
+
+    with pytest.raises(transport.Cancelled):
+        t._send(
+            "http://test/aoi",
+            lambda response: response.content,
+            {},
+            b"{}",
+            None,
+            True,
+            None,
+            "aoi",
+            cancelled,
+        )
+
+    assert body.closed
+    assert t.limiter.in_flight == 0
+
+
+@pytest.mark.parametrize(
+    "outcome",
+    [
+        requests.ConnectionError(),
+        requests.Timeout(),
+        500,
+        400,
+    ],
+)
+def test_failures_leave_the_limit_unchanged(monkeypatch, outcome):
+    def post(url, **kwargs):
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        return response
+
+    def handle(response):
+        response.raise_for_status()
+
+    monkeypatch.setattr(transport.requests, "post", post)
+    t = transport.Transport(single_flight=False, max_retries=0)
+    limit = t.limiter._limit
+
+    with pytest.raises(requests.RequestException):
+        t._send("http://test/aoi", handle, {}, b"{}", None, False, None, "aoi")
+
+    assert t.limiter._limit == limit
+    assert t.limiter.in_flight == 0
+
+
+def test_success_raises_the_limit(monkeypatch):
+    def post(url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(transport.requests, "post", post)
+    t = transport.Transport(single_flight=False, max_retries=0)
+    limit = t.limiter._limit
+
+    t._send("http://test/aoi", lambda r: None, {}, b"{}", None, False, None, "aoi")
+
+    assert t.limiter._limit > limit
+
+
+def _flights(fn, callers=3):
+    """Call fn from several threads through a SingleFlight, all in one flight"""
+    flights = transport.SingleFlight()
+    started = threading.Event()
+    results = [None] * callers
+
+    def leader():
+        started.set()
+        # Wait for the other callers to join the flight
+        while flights._followers.get("key", 0) < callers - 1:
+            time.sleep(0.001)
+        return fn()
+
+    def call(i):
+        results[i] = flights.do("key", leader if i == 0 else fn)
+
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    started.wait()
+    threads += [threading.Thread(target=call, args=(i,)) for i in range(1, callers)]
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_shared_results_share_arrays_but_not_masks():
+    value = np.ma.masked_array(np.arange(6.0), [0, 1, 0, 0, 0, 0])
+    results = _flights(lambda: (value, {"bands": ["red"]}))
+
+    arrays = [array for array, _ in results]
+    assert all(np.shares_memory(array.data, value.data) for array in arrays)
+
+    arrays[1][0] = np.ma.masked
+    assert not arrays[0].mask[0] and not arrays[2].mask[0]
+    with pytest.raises(ValueError):
+        arrays[2][2] = 0.0
+
+    results[1][1]["bands"].append("green")
+    assert results[0][1] == results[2][1] == {"bands": ["red"]}
+
+
+def test_results_that_are_not_shared_are_returned_as_is():
+    value = np.arange(3.0)
+
+    assert transport.SingleFlight().do("key", lambda: value) is value
+    assert value.flags.writeable